@@ -0,0 +1,303 @@
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import numpy as np
+from stageProfiler import COUNTERS
+
+# Columnar, memory-mappable alternative to coco.json. A store is a folder of
+# .npy files plus meta.json:
+#   image_ids, image_widths, image_heights          one row per image
+#   ann_ids, ann_image_ids, ann_category_ids,
+#   ann_bboxes (N, 4), ann_areas, ann_iscrowd        one row per annotation
+# polygon segmentations:
+#   ann_polygon_offsets (N + 1)    annotation i owns polygons [o[i], o[i+1])
+#   polygon_vertex_offsets (P + 1) polygon j owns vertices [v[j], v[j+1])
+#   vertices (V, 2) int32          x, y
+# rle segmentations:
+#   rle_sizes (N, 2), rle_offsets (N + 1), rle_counts (bytes of the counts strings)
+# meta.json holds info, licenses, categories, the image file names and how ids
+# and areas were typed, so exportCoco writes the same coco.json the pipeline would.
+
+STORE_NAME = 'coco_store'
+STORE_VERSION = 1
+META_NAME = 'meta.json'
+
+IMAGE_COLUMNS = {
+    'image_ids': (np.int64, ()),
+    'image_widths': (np.int32, ()),
+    'image_heights': (np.int32, ()),
+}
+ANNOTATION_COLUMNS = {
+    'ann_ids': (np.int64, ()),
+    'ann_image_ids': (np.int64, ()),
+    'ann_category_ids': (np.int32, ()),
+    'ann_bboxes': (np.int32, (4,)),
+    'ann_areas': (np.float64, ()),
+    'ann_iscrowd': (np.uint8, ()),
+}
+POLYGON_COLUMNS = {
+    'ann_polygon_offsets': (np.int64, ()),
+    'polygon_vertex_offsets': (np.int64, ()),
+    'vertices': (np.int32, (2,)),
+}
+RLE_COLUMNS = {
+    'rle_sizes': (np.int32, (2,)),
+    'rle_offsets': (np.int64, ()),
+    'rle_counts': (np.uint8, ()),
+}
+
+
+class _SpoolColumn:
+    # Raw rows appended to a temporary file; turned into a .npy by finish()
+    def __init__(self, folder, name, dtype, row_shape):
+        self.name = name
+        self.dtype = np.dtype(dtype)
+        self.row_shape = row_shape
+        self.rows = 0
+        self.path = os.path.join(folder, name + '.raw')
+        self.file = open(self.path, 'wb')
+
+    def append(self, values):
+        array = np.ascontiguousarray(values, dtype=self.dtype).reshape((-1,) + self.row_shape)
+        self.file.write(array.tobytes())
+        self.rows += len(array)
+
+    def finish(self, folder):
+        self.file.close()
+        path = os.path.join(folder, self.name + '.npy')
+        header = {'descr': np.lib.format.dtype_to_descr(self.dtype), 'fortran_order': False,
+                  'shape': (self.rows,) + self.row_shape}
+        with open(path, 'wb') as out, open(self.path, 'rb') as raw:
+            np.lib.format.write_array_header_1_0(out, header)
+            shutil.copyfileobj(raw, out)
+        os.remove(self.path)
+        return os.path.getsize(path)
+
+
+class AnnotationStoreWriter:
+    # Drop-in for CocoWriter (addImage, addAnnotation(s), close, abort, context
+    # manager) that writes a store folder instead of coco.json. Rows go to raw
+    # spool files as they arrive, so memory stays bounded by one frame.
+    # close() replaces any previous store at store_path.
+    def __init__(self, store_path, info, categories, licenses=None):
+        self.store_path = store_path
+        self.meta = {'version': STORE_VERSION, 'info': info, 'licenses': licenses, 'categories': categories,
+                     'file_names': [], 'segmentation': None, 'string_ids': False, 'integer_areas': True}
+        self.num_images = 0
+        self.num_annotations = 0
+        self.closed = False
+
+        parent = os.path.dirname(os.path.abspath(store_path))
+        self.tmp_path = tempfile.mkdtemp(prefix=os.path.basename(store_path) + '.', suffix='.tmp', dir=parent)
+        self.columns = {}
+        for name, (dtype, row_shape) in {**IMAGE_COLUMNS, **ANNOTATION_COLUMNS}.items():
+            self.columns[name] = _SpoolColumn(self.tmp_path, name, dtype, row_shape)
+        self.num_polygons = 0
+        self.num_vertices = 0
+        self.num_rle_bytes = 0
+
+    def addImage(self, image):
+        self.columns['image_ids'].append(image['id'])
+        self.columns['image_widths'].append(image['width'])
+        self.columns['image_heights'].append(image['height'])
+        self.meta['file_names'].append(image['file_name'])
+        self.num_images += 1
+
+    def addAnnotation(self, annotation):
+        segmentation = annotation['segmentation']
+        mode = 'rle' if isinstance(segmentation, dict) else 'polygon'
+        if self.meta['segmentation'] is None:
+            self._startSegmentation(mode)
+        elif self.meta['segmentation'] != mode:
+            raise ValueError("An annotation store holds either polygon or RLE segmentations, not both")
+
+        ann_id = annotation['id']
+        if isinstance(ann_id, str):
+            if not ann_id.lstrip('-').isdigit():
+                raise ValueError(f"Annotation id {ann_id!r} is not an integer")
+            self.meta['string_ids'] = True
+        if not isinstance(annotation['area'], int):
+            self.meta['integer_areas'] = False
+        self.columns['ann_ids'].append(int(ann_id))
+        self.columns['ann_image_ids'].append(annotation['image_id'])
+        self.columns['ann_category_ids'].append(annotation['category_id'])
+        self.columns['ann_bboxes'].append(annotation['bbox'])
+        self.columns['ann_areas'].append(annotation['area'])
+        self.columns['ann_iscrowd'].append(annotation['iscrowd'])
+
+        if mode == 'rle':
+            counts = segmentation['counts'].encode('ascii')
+            self.columns['rle_sizes'].append(segmentation['size'])
+            self.columns['rle_counts'].append(np.frombuffer(counts, dtype=np.uint8))
+            self.num_rle_bytes += len(counts)
+            self.columns['rle_offsets'].append(self.num_rle_bytes)
+        else:
+            for polygon in segmentation:
+                self.columns['vertices'].append(polygon)
+                self.num_vertices += len(polygon) // 2
+                self.columns['polygon_vertex_offsets'].append(self.num_vertices)
+            self.num_polygons += len(segmentation)
+            self.columns['ann_polygon_offsets'].append(self.num_polygons)
+        self.num_annotations += 1
+
+    def addAnnotations(self, annotations):
+        for annotation in annotations:
+            self.addAnnotation(annotation)
+
+    def _startSegmentation(self, mode):
+        self.meta['segmentation'] = mode
+        for name, (dtype, row_shape) in (RLE_COLUMNS if mode == 'rle' else POLYGON_COLUMNS).items():
+            self.columns[name] = _SpoolColumn(self.tmp_path, name, dtype, row_shape)
+        # Offsets start at 0, the per-row appends add the ends
+        if mode == 'rle':
+            self.columns['rle_offsets'].append(0)
+        else:
+            self.columns['ann_polygon_offsets'].append(0)
+            self.columns['polygon_vertex_offsets'].append(0)
+
+    def close(self):
+        if self.closed:
+            return
+        if self.meta['segmentation'] is None:
+            self._startSegmentation('polygon')
+        size = 0
+        for column in self.columns.values():
+            size += column.finish(self.tmp_path)
+        with open(os.path.join(self.tmp_path, META_NAME), 'w') as f:
+            json.dump(self.meta, f)
+        self.closed = True
+
+        # Swap the finished folder in; a folder cannot be renamed over a non-empty one
+        old_path = None
+        if os.path.exists(self.store_path):
+            old_path = self.tmp_path + '.old'
+            os.replace(self.store_path, old_path)
+        os.replace(self.tmp_path, self.store_path)
+        if old_path:
+            shutil.rmtree(old_path)
+        COUNTERS.addWrite(size)
+
+    def abort(self):
+        # Drop everything written so far and leave any previous store untouched
+        if self.closed:
+            return
+        self.closed = True
+        for column in self.columns.values():
+            column.file.close()
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+class AnnotationStore:
+    # Read side: every column is np.load'ed with mmap_mode='r', so opening a
+    # store costs a few header reads and rows are paged in as they are touched
+    def __init__(self, store_path, mmap_mode='r'):
+        self.path = store_path
+        with open(os.path.join(store_path, META_NAME)) as f:
+            self.meta = json.load(f)
+        if self.meta.get('version') != STORE_VERSION:
+            raise ValueError(f"Unsupported annotation store version in {store_path}")
+        self.segmentation_mode = self.meta['segmentation']
+        columns = {**IMAGE_COLUMNS, **ANNOTATION_COLUMNS,
+                   **(RLE_COLUMNS if self.segmentation_mode == 'rle' else POLYGON_COLUMNS)}
+        for name in columns:
+            setattr(self, name, np.load(os.path.join(store_path, name + '.npy'), mmap_mode=mmap_mode))
+        # image_id -> annotation rows, built by the first query (see annotationRows)
+        self.ann_order = None
+        self.sorted_ann_image_ids = None
+
+    @property
+    def num_images(self):
+        return len(self.image_ids)
+
+    @property
+    def num_annotations(self):
+        return len(self.ann_ids)
+
+    def image(self, i):
+        return {
+            "id": int(self.image_ids[i]),
+            "width": int(self.image_widths[i]),
+            "height": int(self.image_heights[i]),
+            "file_name": self.meta['file_names'][i]
+        }
+
+    def polygons(self, i):
+        # Polygons of annotation i as (n, 2) vertex arrays (views into the mmap)
+        first, last = self.ann_polygon_offsets[i], self.ann_polygon_offsets[i + 1]
+        bounds = self.polygon_vertex_offsets[first:last + 1]
+        return [self.vertices[bounds[j]:bounds[j + 1]] for j in range(len(bounds) - 1)]
+
+    def segmentation(self, i):
+        if self.segmentation_mode == 'rle':
+            counts = self.rle_counts[self.rle_offsets[i]:self.rle_offsets[i + 1]]
+            return {"size": self.rle_sizes[i].tolist(), "counts": counts.tobytes().decode('ascii')}
+        return [polygon.reshape(-1).tolist() for polygon in self.polygons(i)]
+
+    def annotation(self, i):
+        ann_id = int(self.ann_ids[i])
+        area = float(self.ann_areas[i])
+        return {
+            "id": str(ann_id) if self.meta['string_ids'] else ann_id,
+            "image_id": int(self.ann_image_ids[i]),
+            "category_id": int(self.ann_category_ids[i]),
+            "bbox": self.ann_bboxes[i].tolist(),
+            "segmentation": self.segmentation(i),
+            "area": int(area) if self.meta['integer_areas'] else area,
+            "iscrowd": int(self.ann_iscrowd[i])
+        }
+
+    def annotationRows(self, image_id):
+        # Rows (store order) of image_id's annotations. Image ids only ascend with
+        # sequential ids; stable ids follow the folder listing. So rows are sorted
+        # by image id once (stable, so store order within an image) and found by
+        # binary search, like cocoReader.CocoReader
+        if self.ann_order is None:
+            self.ann_order = np.argsort(self.ann_image_ids, kind='stable')
+            self.sorted_ann_image_ids = self.ann_image_ids[self.ann_order]
+        first = int(np.searchsorted(self.sorted_ann_image_ids, image_id, side='left'))
+        last = int(np.searchsorted(self.sorted_ann_image_ids, image_id, side='right'))
+        return self.ann_order[first:last]
+
+    def annotationsForImage(self, image_id):
+        return [self.annotation(i) for i in self.annotationRows(image_id)]
+
+
+def exportCoco(store_path, coco_path):
+    # Writes the standard coco.json for a store, streaming through CocoWriter
+    from cocoWriter import CocoWriter
+
+    store = AnnotationStore(store_path)
+    meta = store.meta
+    with CocoWriter(coco_path, meta['info'], meta['categories'], meta['licenses']) as writer:
+        for i in range(store.num_images):
+            writer.addImage(store.image(i))
+        for i in range(store.num_annotations):
+            writer.addAnnotation(store.annotation(i))
+    return coco_path
+
+
+def parseArgs():
+    parser = argparse.ArgumentParser(description="Export a columnar annotation store to coco.json.")
+    parser.add_argument('store', help="Store folder (e.g. <segmentation folder>/coco_store)")
+    parser.add_argument('coco_path', nargs='?', help="Output file (default: coco.json next to the store)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parseArgs()
+    coco_path = args.coco_path or os.path.join(os.path.dirname(os.path.abspath(args.store)), 'coco.json')
+    exportCoco(args.store, coco_path)
+    print(f"Exported {args.store} to {coco_path}", file=sys.stderr)
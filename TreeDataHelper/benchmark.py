@@ -0,0 +1,165 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+
+import cocoEngine
+from cocoEngine import Reporter
+from cocoWriter import CocoWriter
+from datasetCatalog import DatasetCatalog
+from synthDataset import generateDataset
+
+# Times every pipeline stage on a synthetic (or given) dataset and writes the
+# results as JSON, so runs can be compared across commits.
+
+
+class QuietReporter(Reporter):
+    def status(self, message):
+        pass
+
+    def track(self, iterable, total=None, desc=None):
+        return iterable
+
+
+class StageTimer:
+    def __init__(self):
+        self.stages = {}
+
+    def run(self, name, files, func, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        seconds = time.perf_counter() - start
+        self.stages[name] = {
+            "seconds": seconds,
+            "files": files,
+            "files_per_sec": files / seconds if seconds > 0 else None,
+        }
+        return result
+
+
+def benchmarkStages(segmentation_folder, workers=1):
+    # Runs the multi-stage pipeline one stage at a time on segmentation_folder (modified in place)
+    reporter = QuietReporter()
+    timer = StageTimer()
+    coco_path = os.path.join(segmentation_folder, "coco.json")
+
+    catalog = timer.run("scanCatalog", 0, DatasetCatalog, segmentation_folder)
+    timer.stages["scanCatalog"]["files"] = len(catalog.allSingleTrees())
+    timer.run("checkSingleTreeMask", len(catalog.allSingleTrees()), cocoEngine.checkSingleTreeMask, catalog, reporter)
+    labels = timer.run("checkNumberAlignment", len(catalog.images), cocoEngine.checkNumberAlignment, catalog, reporter)
+    timer.run("createNewMasks", len(catalog.allSingleTrees()), cocoEngine.createNewMasks, catalog, labels, reporter)
+
+    writer = CocoWriter(coco_path, cocoEngine.createInfo(cocoEngine.DESCRIPTION), cocoEngine.CATEGORIES)
+    try:
+        name_id_dict = timer.run("createImgList", len(catalog.new_masks), cocoEngine.createImgList, catalog, writer, reporter)
+        name_sep_dict = timer.run("organizeMainSepMasks", len(name_id_dict), cocoEngine.organizeMainSepMasks, name_id_dict, catalog)
+        files = sum(len(v) for v in name_sep_dict.values())
+        timer.run("createAnnotations", files, cocoEngine.createAnnotations,
+                  name_id_dict, name_sep_dict, catalog, writer, reporter, workers)
+        timer.run("jsonDump", writer.num_annotations, writer.close)
+    except BaseException:
+        writer.abort()
+        raise
+    return timer.stages
+
+def benchmarkFused(segmentation_folder, workers=1, write_masks=True):
+    reporter = QuietReporter()
+    timer = StageTimer()
+    coco_path = os.path.join(segmentation_folder, "coco.json")
+
+    catalog = timer.run("scanCatalog", 0, DatasetCatalog, segmentation_folder)
+    timer.stages["scanCatalog"]["files"] = len(catalog.allSingleTrees())
+    labels = timer.run("checkNumberAlignment", len(catalog.images), cocoEngine.checkNumberAlignment, catalog, reporter)
+    writer = CocoWriter(coco_path, cocoEngine.createInfo(cocoEngine.DESCRIPTION), cocoEngine.CATEGORIES)
+    try:
+        timer.run("createFusedAnnotations", len(catalog.allSingleTrees()), cocoEngine.createFusedAnnotations,
+                  catalog, labels, writer, reporter, workers, write_masks)
+        timer.run("jsonDump", writer.num_annotations, writer.close)
+    except BaseException:
+        writer.abort()
+        raise
+    return timer.stages
+
+def environmentInfo():
+    import numpy as np
+    import cv2
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+    }
+
+def runBenchmark(args):
+    scratch = tempfile.mkdtemp(prefix="cocogen_bench_", dir=args.scratch)
+    try:
+        source = args.dataset
+        if source is None:
+            source = os.path.join(scratch, "source")
+            generateDataset(source, args.frames, args.size, args.trees, args.seed)
+
+        runs = []
+        for repeat in range(args.repeat):
+            # Stages delete and write files, so every run starts from a fresh copy
+            work = os.path.join(scratch, f"run{repeat}")
+            shutil.copytree(source, work)
+            if args.fused:
+                stages = benchmarkFused(work, args.workers, args.write_masks)
+            else:
+                stages = benchmarkStages(work, args.workers)
+            stages["total"] = {"seconds": sum(s["seconds"] for s in stages.values())}
+            runs.append(stages)
+            shutil.rmtree(work)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    return {
+        "params": {
+            "dataset": args.dataset,
+            "frames": args.frames,
+            "size": args.size,
+            "trees": args.trees,
+            "seed": args.seed,
+            "workers": args.workers,
+            "fused": args.fused,
+            "write_masks": args.write_masks,
+            "repeat": args.repeat,
+        },
+        "environment": environmentInfo(),
+        "runs": runs,
+    }
+
+
+def parseArgs():
+    parser = argparse.ArgumentParser(description="Time every coco generation stage on synthetic data.")
+    parser.add_argument('--dataset', help="Benchmark a copy of this segmentation folder instead of synthetic data")
+    parser.add_argument('--frames', type=int, default=20)
+    parser.add_argument('--size', type=int, default=768)
+    parser.add_argument('--trees', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--fused', action='store_true', help="Benchmark the single-decode pipeline")
+    parser.add_argument('--no-new-masks', dest='write_masks', action='store_false')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--scratch', help="Folder for the temporary copies (default: system temp)")
+    parser.add_argument('--output', help="Write the JSON results here instead of stdout")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parseArgs()
+    results = runBenchmark(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    for i, stages in enumerate(results["runs"]):
+        for name, stage in stages.items():
+            print(f"run {i} {name:24s} {stage['seconds']:8.3f}s", file=sys.stderr)
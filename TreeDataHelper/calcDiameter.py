@@ -1,17 +1,122 @@
-import maya.cmds as cmds
+import re
+import csv
+import json
+import numpy as np
 
-def calculate_cylinder_diameter(objectName):
-    boundingBox = cmds.xform(objectName, query=True, boundingBox=True, worldSpace=True)
+try:
+    import maya.cmds as cmds
+except ImportError:
+    # Outside Maya (e.g. tests) pass a stub with ls and xform as cmds_module
+    cmds = None
+
+# Diameter of a trunk = the larger of its world-space X and Z extents.
+# The batch functions resolve every transform with one ls call and query all
+# bounding boxes with one xform call, then compute the diameters in NumPy.
+# Results are cached per transform (long name) until clear_diameter_cache().
+
+_diameter_cache = {}
+
+# The treeN of a SingleTrees mask name ('..._Single_Tree_tree12.png')
+TREE_ID_RE = re.compile(r'tree(\d+)')
+
+
+def calculate_cylinder_diameter(objectName, cmds_module=None):
+    mc = cmds_module or cmds
+    boundingBox = mc.xform(objectName, query=True, boundingBox=True, worldSpace=True)
     # [xmin, ymin, zmin, xmax, ymax, zmax]
 
-    widthX = boundingBox[3] - boundingBox[0]  
-    depthZ = boundingBox[5] - boundingBox[2]  
+    widthX = boundingBox[3] - boundingBox[0]
+    depthZ = boundingBox[5] - boundingBox[2]
 
 
     diameter = max(widthX, depthZ)
 
     return diameter
-    
-objectName = 'birch01_trunk'
-diameter = calculate_cylinder_diameter(objectName)
-print("Diameter of the cylinder:", diameter)
\ No newline at end of file
+
+
+def resolve_transforms(objects, cmds_module=None):
+    # objects: a name pattern ('*_trunk') or a list of names -> sorted long transform names
+    mc = cmds_module or cmds
+    return sorted(set(mc.ls(objects, type='transform', long=True) or []))
+
+
+def world_bounding_boxes(transforms, cmds_module=None):
+    # (N, 6) array of [xmin, ymin, zmin, xmax, ymax, zmax], one xform call when
+    # it returns a box per object, one call per object otherwise
+    mc = cmds_module or cmds
+    if not transforms:
+        return np.zeros((0, 6))
+    values = mc.xform(transforms, query=True, boundingBox=True, worldSpace=True)
+    if len(values) != 6 * len(transforms):
+        values = [v for t in transforms for v in mc.xform(t, query=True, boundingBox=True, worldSpace=True)]
+    return np.asarray(values, dtype=np.float64).reshape(-1, 6)
+
+
+def cylinder_diameters(boxes):
+    # Vectorized calculate_cylinder_diameter over an (N, 6) bounding box array
+    return np.maximum(boxes[:, 3] - boxes[:, 0], boxes[:, 5] - boxes[:, 2])
+
+
+def batch_diameters(objects, cmds_module=None):
+    # {long transform name: diameter} of every transform matching objects;
+    # only the ones not cached yet are queried
+    transforms = resolve_transforms(objects, cmds_module)
+    missing = [t for t in transforms if t not in _diameter_cache]
+    if missing:
+        diameters = cylinder_diameters(world_bounding_boxes(missing, cmds_module))
+        _diameter_cache.update(zip(missing, diameters.tolist()))
+    return {t: _diameter_cache[t] for t in transforms}
+
+
+def clear_diameter_cache():
+    # Call after moving or scaling trees
+    _diameter_cache.clear()
+
+
+def tree_id_of(transform):
+    # Tree id of an object named like its SingleTrees mask: the N of the one
+    # treeN in its short name ('|forest|ns:tree12_trunk' -> 12). Other names
+    # (e.g. 'birch07_v2_trunk') raise instead of guessing, pass tree_id to
+    # diameters_by_tree_id for them
+    matches = TREE_ID_RE.findall(transform.split('|')[-1].split(':')[-1])
+    if len(matches) != 1:
+        raise ValueError(f"Expected one treeN in {transform!r}, found {len(matches)}; "
+                         f"pass the tree ids to diameters_by_tree_id")
+    return int(matches[0])
+
+
+def diameters_by_tree_id(diameters, tree_id=tree_id_of):
+    # {tree id: (transform, diameter)}; the id has to be unique to join onto annotations.
+    # tree_id: transform -> tree id, a function or a dict
+    lookup = tree_id.__getitem__ if isinstance(tree_id, dict) else tree_id
+    by_id = {}
+    for transform, diameter in diameters.items():
+        key = int(lookup(transform))
+        if key in by_id:
+            raise ValueError(f"Tree id {key} used by {by_id[key][0]} and {transform}")
+        by_id[key] = (transform, diameter)
+    return by_id
+
+
+def write_diameters(by_id, path):
+    # .json -> {"<tree id>": {"object": ..., "diameter": ...}}, anything else -> CSV
+    rows = sorted(by_id.items())
+    if path.endswith('.json'):
+        with open(path, 'w') as f:
+            json.dump({str(k): {"object": t, "diameter": d} for k, (t, d) in rows}, f, indent=1)
+        return path
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["tree_id", "object", "diameter"])
+        for k, (t, d) in rows:
+            writer.writerow([k, t, d])
+    return path
+
+
+if __name__ == "__main__":
+    objectName = 'birch01_trunk'
+    diameter = calculate_cylinder_diameter(objectName)
+    print("Diameter of the cylinder:", diameter)
+
+    #trunks = batch_diameters('*_trunk')
+    #write_diameters(diameters_by_tree_id(trunks), 'C:/temp/trunk_diameters.csv')
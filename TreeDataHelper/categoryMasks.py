@@ -0,0 +1,135 @@
+import json
+from collections import namedtuple
+from functools import partial, lru_cache
+import numpy as np
+import cv2
+from maskOps import readImage, segmentObjectMask, orderedMap
+
+# Multi-category annotations from the semantic Masks/ images. A lookup table
+# file maps Masks/ colors to categories:
+#   {"categories": [{"name": "trunk", "color": [120, 60, 30]},
+#                   {"name": "canopy", "colors": [[60, 160, 40], [70, 170, 50]], "min_area": 50}, ...]}
+# Colors are RGB like TREE_RGB. Categories get ids 1, 2, ... in file order,
+# after the "tree" category (0). Every frame is decoded once: the LUT turns the
+# image into a uint8 label map in one vectorized lookup, connected components
+# of each label give the instances with their bboxes and pixel counts, and
+# contours are only traced inside each instance's bbox. Instances smaller than
+# their category's min_area pixels (default MIN_AREA) are dropped.
+
+MIN_AREA = 1
+
+# categories: COCO category dicts; colors: packed 0xRRGGBB keys, sorted;
+# labels: the label (1-based category index) of each color; min_areas: per
+# label, index 0 (no category) unused
+CategoryTable = namedtuple('CategoryTable', ['categories', 'colors', 'labels', 'min_areas'])
+
+
+def packColor(rgb):
+    r, g, b = rgb
+    return r << 16 | g << 8 | b
+
+def loadCategoryTable(path):
+    with open(path) as f:
+        data = json.load(f)
+    entries = data.get('categories') if isinstance(data, dict) else None
+    if not entries:
+        raise ValueError(f"{path} has no categories")
+    if len(entries) > 255:
+        raise ValueError(f"{path} has more than 255 categories")
+
+    categories = []
+    min_areas = [0]
+    by_color = {}
+    for label, entry in enumerate(entries, 1):
+        if not isinstance(entry, dict) or 'name' not in entry:
+            raise ValueError(f"Category {label} in {path} needs a name and a color")
+        colors = entry.get('colors') or ([entry['color']] if 'color' in entry else [])
+        if not isinstance(colors, list) or not colors:
+            raise ValueError(f"Category {label} in {path} needs a name and a color")
+        for rgb in colors:
+            if not isinstance(rgb, list) or len(rgb) != 3 or not all(isinstance(c, int) and 0 <= c <= 255 for c in rgb):
+                raise ValueError(f"Invalid color {rgb} for {entry['name']!r} in {path}")
+            key = packColor(rgb)
+            if key in by_color:
+                raise ValueError(f"Color {rgb} is used by more than one category in {path}")
+            by_color[key] = label
+        categories.append({"id": label, "name": entry['name']})
+        min_areas.append(int(entry.get('min_area', MIN_AREA)))
+
+    colors = sorted(by_color)
+    return CategoryTable(categories, tuple(colors), tuple(by_color[c] for c in colors), tuple(min_areas))
+
+def tableSettings(table):
+    # JSON form of a table for manifest settings
+    return {"categories": table.categories, "colors": list(table.colors), "labels": list(table.labels),
+            "min_areas": list(table.min_areas)}
+
+@lru_cache(maxsize=4)
+def _lookupTable(colors, labels):
+    # Label of every 0xRRGGBB color, 16 MB built once per process and table
+    lut = np.zeros(1 << 24, dtype=np.uint8)
+    lut[np.asarray(colors, dtype=np.int64)] = labels
+    return lut
+
+def labelMap(img, table):
+    # uint8 label of every pixel of a BGR image, 0 where its color is not in the table.
+    # BGR -> BGRA viewed as little-endian uint32 packs each pixel into
+    # 0xAARRGGBB in one pass; dropping the alpha byte leaves the LUT index
+    key = cv2.cvtColor(img, cv2.COLOR_BGR2BGRA).view('<u4')[..., 0]
+    key &= np.uint32(0xFFFFFF)
+    return _lookupTable(table.colors, table.labels).take(key)
+
+def frameInstances(path, table, segmentation='polygon', simplify=None):
+    # [(category id, list_poly)] of every instance in a Masks/ image, ordered by
+    # category and then by position (row-major, of each instance's first pixel)
+    img = readImage(path)
+    if img is None:
+        return []
+    label_map = labelMap(img, table)
+    height, width = label_map.shape
+    instances = []
+    for label, category in enumerate(table.categories, 1):
+        mask = cv2.compare(label_map, label, cv2.CMP_EQ)
+        if not cv2.countNonZero(mask):
+            continue
+        # Grana's block-based labeling gathers the stats in about half the time of the default
+        count, components, stats, _ = cv2.connectedComponentsWithStatsWithAlgorithm(mask, 8, cv2.CV_32S,
+                                                                                    cv2.CCL_GRANA)
+        for i in np.flatnonzero(stats[1:, cv2.CC_STAT_AREA] >= table.min_areas[label]) + 1:
+            x, y, w, h = stats[i, :4]
+            # One pixel of background around the bbox, like maskOps.instancePolys
+            x0, y0 = max(x - 1, 0), max(y - 1, 0)
+            x1, y1 = min(x + w + 1, width), min(y + h + 1, height)
+            roi = (components[y0:y1, x0:x1] == i).astype(np.uint8) * 255
+            list_poly = segmentObjectMask(roi, path, segmentation, offset=(int(x0), int(y0)),
+                                          frame_size=(height, width), simplify=simplify)
+            if list_poly:
+                instances.append((category["id"], list_poly))
+    return instances
+
+def iterCategoryFrames(mask_paths, table, workers=1, segmentation='polygon', simplify=None, manifest=None):
+    # Yields the frameInstances of every path in order, [] for None (a frame
+    # without a Masks/ image). With a RunManifest, unchanged images come from it
+    cached = {}
+    todo = []
+    for i, path in enumerate(mask_paths):
+        hit = manifest.lookup(path) if manifest is not None and path is not None else None
+        if path is None:
+            cached[i] = None
+        elif hit is not None:
+            # Read back from the manifest's data file once the frame is yielded
+            cached[i] = path
+        else:
+            todo.append(path)
+
+    results = orderedMap(partial(frameInstances, table=table, segmentation=segmentation, simplify=simplify),
+                         todo, workers)
+    for i, path in enumerate(mask_paths):
+        if i in cached:
+            cached_path = cached.pop(i)
+            yield manifest.readPayload(cached_path) if cached_path is not None else []
+            continue
+        instances = next(results)
+        if manifest is not None:
+            manifest.store(path, {}, instances)
+        yield instances
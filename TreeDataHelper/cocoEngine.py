@@ -0,0 +1,792 @@
+import os
+import shutil
+import tempfile
+from functools import partial
+from datetime import datetime, timezone
+
+# numpy, cv2, PIL and tqdm are imported inside the stages that need them, so
+# argument parsing, folder validation and the GUI start without loading them.
+from datasetCatalog import DatasetCatalog, scanFolder
+from cocoWriter import CocoAppender, CocoWriter, DIR_MODE
+from runManifest import RunManifest, MANIFEST_NAME
+from quarantineManifest import QuarantineManifest, QUARANTINE_NAME
+from imageProbe import probeImageSize
+from stageProfiler import COUNTERS, StageProfiler, PROFILE_NAME, simplificationStats
+from cocoShards import CATEGORY_ID_BASE, categoryAnnotationId, fragmentName, inShard, shardPath, stableAnnotationId, stableImageId
+
+REQUIRED_FOLDERS = ['Depth', 'Images', 'Masks', 'SingleTrees']
+CATEGORIES = [{"id": 0, "name": "tree"}]
+DESCRIPTION = "UE Generated Simulated Data"
+
+
+class PipelineCancelled(Exception):
+    pass
+
+
+class Reporter:
+    # How the stages talk to whoever runs them. The default prints to the
+    # console with tqdm progress bars; CocoGenTool passes its own subclass.
+    # cancel is an optional threading.Event: once it is set, the next file a
+    # stage tracks raises PipelineCancelled. coco.json and a rebuilt NewMasks
+    # are only replaced at the very end, so a cancelled run leaves the previous
+    # ones in place (incremental and sharded runs rewrite the masks of the
+    # frames they process, see MaskFolders).
+    def __init__(self, cancel=None):
+        self.cancel = cancel
+
+    def status(self, message):
+        print(message)
+
+    def track(self, iterable, total=None, desc=None):
+        from tqdm import tqdm
+        return self.cancellable(tqdm(iterable, total=total, desc=desc))
+
+    def cancellable(self, iterable):
+        for item in iterable:
+            if self.cancel is not None and self.cancel.is_set():
+                raise PipelineCancelled()
+            yield item
+
+
+class PipelineOptions:
+    def __init__(self, workers=1, fused=False, write_masks=True, incremental=False, use_hash=False,
+                 total_pixels=None, profile=False, cprofile_path=None, tracemalloc=False,
+                 quarantine=None, coverage_min=None, coverage_max=None, io_threads=0, prefetch=None,
+                 segmentation='polygon', output='json', instance_map=False, stable_ids=False, shard=None,
+                 frames=None, mask_cache=False, simplify_tolerance=None, max_vertices=None, categories=None,
+                 frame_files=None, layout=None, append=False):
+        # workers: processes for annotation extraction (0 = all cores)
+        # fused: decode every SingleTree file once (see createFusedAnnotations)
+        # write_masks: with fused, also write the NewMasks composites
+        # incremental: reuse coco_manifest.json results (implies fused)
+        # use_hash: with incremental, compare content hashes when size/mtime changed
+        # total_pixels: pixel count for the coverage filter, None reads it per image
+        # profile: write a per-stage coco_profile.json next to coco.json
+        # cprofile_path / tracemalloc: deeper profiling, both imply profile
+        # quarantine: None deletes rejected files, "record" lists them in
+        #   coco_quarantine.json instead, "move" also moves them into Quarantine/
+        # coverage_min / coverage_max: black coverage bounds, None keeps the defaults
+        # io_threads: threads reading and decoding images ahead of the checks and
+        #   annotation extraction (0 reads inline); prefetch: images read ahead at most
+        # segmentation: "polygon" contours or "rle" (COCO compressed RLE) annotations
+        # output: "json" writes coco.json, "store" the columnar coco_store/ folder
+        #   (see annotationStore), "both" the store and coco.json exported from it
+        # instance_map: segment trees from a per-frame uint16 instance map, i.e.
+        #   their visible pixels (implies fused; maps go to InstanceMaps/ with write_masks)
+        # stable_ids: image id = numeric frame id, annotation id = image id << 16 | tree id,
+        #   instead of counting in listing order
+        # shard: (i, N) only processes the frames hashing to shard i and writes
+        #   coco.shard-i-of-N.json for cocoShards.mergeFragments (implies stable_ids)
+        # frames: set of frame keys to process, None takes every frame in the folder.
+        #   folderWatcher sets it to the frames whose files have all arrived
+        # mask_cache: keep bit-packed SingleTree decodes in coco_maskcache.bin, so
+        #   later runs rebuild them instead of decoding the PNGs
+        # simplify_tolerance: Douglas-Peucker tolerance in pixels for polygon
+        #   segmentations, None writes every contour point
+        # max_vertices: cap on the vertices of a polygon (raises its tolerance as
+        #   needed), None for no cap. Either one turns simplification on
+        # categories: path of a Masks/ color -> category lookup table (see
+        #   categoryMasks); each frame's Masks/ image then adds one annotation per
+        #   connected region of every category, next to the tree annotations
+        # frame_files: {folder name: file names} of Images/, Depth/ and SingleTrees/,
+        #   used instead of listing them (folderWatcher knows them already)
+        # layout: a cocoWriter.CocoLayout; coco.json is written with room for more
+        #   images and the layout records where
+        # append: add the frames to the coco.json layout describes instead of
+        #   rewriting it (folderWatcher's new frames). Entries of other frames in
+        #   the manifests, caches and NewMasks are left alone
+        self.workers = workers
+        self.fused = fused or incremental or instance_map
+        self.write_masks = write_masks
+        self.incremental = incremental
+        self.use_hash = use_hash
+        self.total_pixels = total_pixels
+        self.profile = profile or bool(cprofile_path) or tracemalloc
+        self.cprofile_path = cprofile_path
+        self.tracemalloc = tracemalloc
+        self.quarantine = quarantine
+        self.coverage_bounds = (coverage_min, coverage_max)
+        self.io_threads = io_threads
+        self.prefetch = prefetch
+        self.segmentation = segmentation
+        self.output = output
+        self.instance_map = instance_map
+        self.stable_ids = stable_ids or shard is not None
+        self.shard = shard
+        self.frames = frames
+        self.mask_cache = mask_cache
+        if simplify_tolerance is not None and not 0 <= simplify_tolerance < float('inf'):
+            raise ValueError("simplify_tolerance must be a non-negative number")
+        if max_vertices is not None and max_vertices < 3:
+            raise ValueError("max_vertices must be at least 3")
+        self.simplify_tolerance = simplify_tolerance
+        self.max_vertices = max_vertices
+        self.categories = categories
+        if append and (layout is None or frames is None or not incremental or not self.stable_ids
+                       or shard is not None or output != "json"):
+            raise ValueError("append needs a layout, frames, incremental, stable_ids and json output, without shard")
+        self.frame_files = frame_files
+        self.layout = layout
+        self.append = append
+
+
+def validateSegmentationFolder(segmentation_folder):
+    # Returns an error message, or None when the folder can be processed
+    if not segmentation_folder or not os.path.exists(segmentation_folder):
+        return "Invalid Segmentation path."
+    if not os.path.exists(os.path.join(segmentation_folder, 'SingleTrees')):
+        return "SingleTree folder not found"
+    return None
+
+
+def checkFolders(segmentation_folder, reporter):
+    folders = os.listdir(segmentation_folder)
+    if not all(folder in folders for folder in REQUIRED_FOLDERS):
+        reporter.status('Missing folder')
+        return False
+    else:
+        reporter.status('Folders are complete')
+        return True
+
+def checkSingleTreeMask(catalog, reporter, TOTAL_PIXELS=None, bounds=None, quarantine=None, io_threads=0, prefetch=None,
+                        mask_cache=None):
+    # TOTAL_PIXELS=None uses each image's own size. Files that cannot be decoded
+    # (e.g. truncated) are rejected with a coverage of None.
+    # With a QuarantineManifest, rejected files are recorded instead of deleted
+    # and images whose coverage it already knows are not decoded again.
+    # io_threads/prefetch: see maskOps.prefetchImages
+    # Every decision is made on the exact coverage. A reduced-resolution decode
+    # only samples the pixels, so it cannot bound thin structures, and for PNG it
+    # costs as much as the full decode.
+    # Files in mask_cache take their coverage from its index, with no decode at all
+    from maskOps import isValidCoverage, prefetchImages, blackCoverage
+
+    reporter.status("Checking invalid SINGLE Tree Mask images...")
+    all_imgs = catalog.allSingleTrees()
+    known = {}
+    if quarantine is not None:
+        known = {record.name: quarantine.coverage(catalog.singleTreePath(record)) for record in all_imgs}
+    cached = {}
+    if mask_cache is not None:
+        from maskCache import cachedCoverage
+        for record in all_imgs:
+            path = catalog.singleTreePath(record)
+            entry = mask_cache.lookup(path) if known.get(record.name) is None else None
+            if entry is not None:
+                cached[path] = cachedCoverage(entry, TOTAL_PIXELS)
+    to_decode = [catalog.singleTreePath(r) for r in all_imgs if known.get(r.name) is None]
+    to_decode = [path for path in to_decode if path not in cached]
+    if quarantine is not None:
+        to_decode = [quarantine.locate(path) for path in to_decode]
+
+    # Decoded images come back in the order of to_decode, i.e. of the records that need one
+    decoded = prefetchImages(to_decode, io_threads=io_threads, depth=prefetch)
+
+    invalid_imgs = {}
+    for record in reporter.track(all_imgs, total=len(all_imgs), desc="Processing"):
+        path = catalog.singleTreePath(record)
+        percentage = known.get(record.name)
+        if percentage is None:
+            if path in cached:
+                percentage = cached[path]
+            else:
+                _, img = next(decoded)
+                percentage = None if img is None else blackCoverage(img, TOTAL_PIXELS)
+            if quarantine is not None and percentage is not None:
+                quarantine.setCoverage(path, percentage)
+        if percentage is None or not isValidCoverage(percentage, bounds):
+            invalid_imgs[path] = percentage
+            if quarantine is not None:
+                quarantine.reject(path, "coverage" if percentage is not None else "unreadable", percentage)
+            else:
+                os.remove(path)
+            catalog.discardSingleTree(record)
+    reporter.status(f"{len(invalid_imgs)} images {'quarantined' if quarantine is not None else 'removed'}")
+    return invalid_imgs
+
+def quarantineKnownTrees(catalog, reporter, quarantine, bounds=None):
+    # Fused runs check coverage while decoding; trees whose cached coverage
+    # already fails the bounds are dropped here so they are never read
+    from maskOps import isValidCoverage
+
+    rejected = 0
+    for record in catalog.allSingleTrees():
+        path = catalog.singleTreePath(record)
+        percentage = quarantine.coverage(path)
+        if percentage is not None and not isValidCoverage(percentage, bounds):
+            quarantine.reject(path, "coverage", percentage)
+            catalog.discardSingleTree(record)
+            rejected += 1
+    reporter.status(f"{rejected} images quarantined from cached coverage")
+
+def reinstateQuarantined(catalog, quarantine):
+    # Files an earlier run moved to Quarantine/ are filtered again with this run's settings
+    for folder, name in quarantine.movedFiles():
+        catalog.addFile(folder, name)
+
+def applyQuarantine(quarantine, reporter):
+    moved, restored = quarantine.apply()
+    reporter.status(f"{len(quarantine.rejected)} files quarantined ({moved} moved, {restored} restored), "
+                    f"see {quarantine.path}")
+
+def removeImages(folder, invalid_imgs, reporter, quarantine=None):
+    if len(invalid_imgs) == 0:
+        reporter.status(f"No invalid images in {folder}")
+        return
+
+    if quarantine is not None:
+        for i in invalid_imgs:
+            quarantine.reject(os.path.join(folder, i), "unaligned")
+        reporter.status(f"{len(invalid_imgs)} invalid images in {folder} quarantined")
+        return
+
+    # Names come from the catalog scan, so they are known to exist
+    for i in reporter.track(invalid_imgs, total=len(invalid_imgs), desc=f"Deleting invalid images in {folder}"):
+        try:
+            os.remove(os.path.join(folder, i))
+        except FileNotFoundError:
+            pass
+
+def checkNumberAlignment(catalog, reporter, quarantine=None):
+    # Assume segmentation_folder is an absolute folder
+    if not os.path.isabs(catalog.root):
+        reporter.status("Argument 'segmentation_folder' has to be an ABSOLUTE path!")
+        return None
+
+    # All frame keys in the format of 1435_Forest_Environment_Set_Map_
+    common_frames = catalog.commonFrames()
+    unaligned_image, unaligned_depth, unaligned_stree = catalog.unalignedFiles()
+
+    # Clean unaligned images
+    removeImages(catalog.image_folder, unaligned_image, reporter, quarantine)
+    removeImages(catalog.depth_folder, unaligned_depth, reporter, quarantine)
+    removeImages(catalog.stree_folder, unaligned_stree, reporter, quarantine)
+    catalog.keepFrames(common_frames)
+    return common_frames
+
+def fillMaskCache(catalog, mask_cache, reporter, io_threads=0, prefetch=None, prune=True):
+    # Decodes the SingleTree files mask_cache does not know in their current
+    # version into it, and forgets the ones that are gone (unless prune is off,
+    # e.g. when the catalog only holds some frames). Saved even when cancelled,
+    # so the next run picks up where this one stopped
+    import cv2
+    from maskOps import prefetchImages, treeImage
+
+    paths = [catalog.singleTreePath(r) for r in catalog.allSingleTrees()]
+    if prune:
+        mask_cache.prune(paths)
+    # Files a quarantine moved away are decoded where they are, by the stages
+    missing = [path for path in paths if not mask_cache.known(path) and os.path.exists(path)]
+    try:
+        decoded = prefetchImages(missing, cv2.IMREAD_UNCHANGED, io_threads, prefetch)
+        for path, img in reporter.track(decoded, total=len(missing), desc="Caching masks"):
+            mask_cache.store(path, treeImage(img))
+    finally:
+        mask_cache.save()
+    reporter.status(f"{len(paths) - len(missing)} masks reused from the mask cache, {len(missing)} cached")
+    uncacheable = mask_cache.uncacheable(paths)
+    if uncacheable:
+        reporter.status(f"{uncacheable} SingleTree images are not one flat color on black and are decoded on every run")
+
+# labels is the image/frame names
+def createNewMasks(catalog, labels, reporter, mask_cache=None):
+    # Writes into catalog.mask_folder, which MaskFolders points at a fresh folder for full rebuilds
+    # mask_cache: SingleTree files in it are rebuilt from it instead of decoded
+    import numpy as np
+    from maskOps import readPilImage, savePng
+    from maskCache import cachedRgba
+
+    def read_rgba(path):
+        entry = mask_cache.lookup(path) if mask_cache is not None else None
+        if entry is not None:
+            return cachedRgba(entry)
+        return np.asarray(readPilImage(path).convert("RGBA"))
+
+    def is_not_black(pixels):
+        return np.any(pixels[..., :3] != 0, axis=-1)
+
+    def combine(img_files, new_mask_dir, label):
+        images = [read_rgba(path) for path in img_files]
+        # Later trees are painted over earlier ones, same as the old per-pixel loop
+        combined = np.zeros(images[0].shape, dtype=np.uint8)
+        combined[..., 3] = 255
+        for pixels in images:
+            np.copyto(combined, pixels, where=is_not_black(pixels)[..., None])
+        new_mask = os.path.join(new_mask_dir, label+'.png')
+        savePng(combined, "RGBA", new_mask)
+        del combined
+        del images
+
+    new_mask_dir = catalog.mask_folder
+    os.makedirs(new_mask_dir, exist_ok=True)
+    catalog.clearNewMasks()
+
+    # For each label, find all single tree masks belongs to this frame
+    for label in reporter.track(labels, total=len(labels), desc="Open Images"):
+        img_files = [catalog.singleTreePath(r) for r in catalog.singleTreesForFrame(label)]
+
+        combine(img_files, new_mask_dir, label)
+        catalog.addNewMask(label, label+'.png')
+
+def createImgList(catalog, writer, reporter, stable_ids=False):
+    id_count = 0
+    name_id_dict = {}
+    masks = list(catalog.new_masks.values())
+    for i in reporter.track(masks, total=len(masks), desc="Creating Image List"):
+        width, height = probeImageSize(os.path.join(catalog.mask_folder, i))
+        if stable_ids:
+            id_count = stableImageId(i)
+        main_mask_img = {
+            "id": id_count,
+            "width": width,
+            "height": height,
+            "file_name": i
+        }
+        writer.addImage(main_mask_img)
+        name_id_dict[i] = id_count
+        id_count += 1
+
+    return name_id_dict
+
+def organizeMainSepMasks(name_id_dict, catalog):
+    name_sep_dict = {}
+    for name in name_id_dict:
+        name_sep_dict[name] = [r.name for r in catalog.singleTreesForFrame(name.split('.')[0])]
+    return name_sep_dict
+
+def polygonSimplification(options):
+    # maskOps.Simplification for the options, None when polygons are not simplified
+    if options.segmentation != 'polygon' or (options.simplify_tolerance is None and options.max_vertices is None):
+        return None
+    from maskOps import Simplification
+    return Simplification(options.simplify_tolerance or 0.0, options.max_vertices)
+
+def reportSimplification(before, reporter):
+    stats = simplificationStats(COUNTERS.snapshot(), before)
+    if stats is not None:
+        reporter.status(f"Simplified {stats['polygons']} polygons: {stats['vertices']} -> "
+                        f"{stats['simplified_vertices']} vertices ({stats['vertex_reduction']:.1%} fewer), "
+                        f"mean IoU {stats['mean_iou']:.4f} with the source masks")
+
+def makeCategoryAnnotations(image_id, instances, stable_ids=False):
+    # COCO annotations of a frame's categoryMasks.frameInstances. Ids are
+    # strings without stable_ids, like the tree ids of makeAnnotation
+    return [{
+        "id": categoryAnnotationId(image_id, index) if stable_ids else str(categoryAnnotationId(image_id, index)),
+        "image_id": image_id,
+        "category_id": category_id,
+        "bbox": list_poly[0],
+        "segmentation": list_poly[1],
+        "area": list_poly[2],
+        "iscrowd": 0
+    } for index, (category_id, list_poly) in enumerate(instances)]
+
+def checkTreeIds(catalog):
+    # Tree annotations share the id space of the Masks/ category instances
+    # (cocoShards.CATEGORY_ID_BASE and up); checked before anything is written,
+    # so a tree id in that range stops the run instead of failing it halfway
+    # or giving two annotations one id
+    for record in catalog.allSingleTrees():
+        if record.tree_id.isdigit() and int(record.tree_id) >= CATEGORY_ID_BASE:
+            raise ValueError(f"{record.name}: tree id {record.tree_id} is in the category annotation id range, "
+                             f"tree ids must be below {CATEGORY_ID_BASE}")
+
+def reportCategories(catalog, frames, reporter):
+    missing = sum(catalog.semanticMaskPath(frame) is None for frame in frames)
+    if missing:
+        reporter.status(f"{missing} frames have no Masks image, they only get tree annotations")
+
+def makeAnnotation(image, image_id, list_poly, stable_ids=False):
+    tree_id = image.split('.')[0].split('_')[-1][4:]
+    return {
+        "id": stableAnnotationId(image_id, tree_id) if stable_ids else tree_id,
+        "image_id": image_id,
+        "category_id": 0,
+        "bbox": list_poly[0],
+        "segmentation": list_poly[1],
+        "area": list_poly[2],
+        "iscrowd": 0
+    }
+
+def createAnnotations(name_id_dict, name_sep_dict, catalog, writer, reporter, workers=1, io_threads=0, prefetch=None,
+                      segmentation='polygon', stable_ids=False, mask_cache=None, simplify=None, categories=None):
+    # Annotations are handed to the writer one frame at a time, so only the
+    # current frame's polygons are held in memory.
+    # simplify: a maskOps.Simplification applied to every polygon
+    # categories: a categoryMasks.CategoryTable; each frame's Masks/ instances
+    #   follow its tree annotations
+    from maskOps import extractTreePolys
+
+    counters = COUNTERS.snapshot()
+
+    reporter.status("Start creating annotation list...")
+    image_paths = [os.path.join(catalog.stree_folder, image) for name in name_id_dict for image in name_sep_dict[name]]
+    list_polys = extractTreePolys(image_paths, workers, io_threads, prefetch, segmentation, mask_cache, simplify)
+    list_polys = reporter.track(list_polys, total=len(image_paths), desc="Creating Annotations")
+    category_frames = None
+    if categories is not None:
+        from categoryMasks import iterCategoryFrames
+        frames = [name.split('.')[0] for name in name_id_dict]
+        reportCategories(catalog, frames, reporter)
+        category_frames = iterCategoryFrames([catalog.semanticMaskPath(frame) for frame in frames], categories,
+                                             workers, segmentation, simplify)
+
+    for name, image_id in name_id_dict.items():
+        # zip stops after the frame's last tree, before taking the next frame's result
+        annotations = [makeAnnotation(image, image_id, list_poly, stable_ids)
+                       for image, list_poly in zip(name_sep_dict[name], list_polys) if list_poly != []]
+        if category_frames is not None:
+            annotations += makeCategoryAnnotations(image_id, next(category_frames), stable_ids)
+        writer.addAnnotations(annotations)
+
+    reportSimplification(counters, reporter)
+    return writer.num_annotations
+
+def clearStaleMasks(catalog, labels, folder=None, owns=None):
+    # Incremental runs keep NewMasks (or folder), minus the ones of frames that are gone.
+    # With owns, masks it rejects (e.g. other shards') are never touched
+    folder = folder or catalog.mask_folder
+    keep = {label+'.png' for label in labels}
+    for name in scanFolder(folder):
+        if name not in keep and (owns is None or owns(name)):
+            os.remove(os.path.join(folder, name))
+
+class MaskFolders:
+    # The mask folders (NewMasks, InstanceMaps) a run writes. A full rebuild
+    # points the catalog at empty folders next to them and only swaps those in
+    # on commit(), so a failed or cancelled run leaves the previous masks as they
+    # were. In place (incremental runs, which keep the masks of unchanged frames,
+    # and sharded runs, which share the folder) masks are rewritten where they
+    # are and the ones of frames that are gone are only deleted on commit();
+    # with owns, masks it rejects (e.g. other shards') are never touched.
+    # Use it like the writers: leaving the with block without an error commits.
+    def __init__(self, catalog, labels, attributes, in_place=False, owns=None):
+        # attributes: the catalog's folder attributes, e.g. ['mask_folder']
+        self.catalog = catalog
+        self.labels = labels
+        self.attributes = attributes
+        self.in_place = in_place
+        self.owns = owns
+        self.staged = {}
+        for attribute in attributes:
+            folder = getattr(catalog, attribute)
+            if in_place:
+                os.makedirs(folder, exist_ok=True)
+                continue
+            staging = tempfile.mkdtemp(prefix=os.path.basename(folder) + '.', suffix='.tmp',
+                                       dir=os.path.dirname(folder))
+            self.staged[attribute] = (folder, staging)
+            setattr(catalog, attribute, staging)
+
+    def commit(self):
+        if self.in_place:
+            for attribute in self.attributes:
+                clearStaleMasks(self.catalog, self.labels, getattr(self.catalog, attribute), self.owns)
+            return
+        for attribute, (folder, staging) in self.staged.items():
+            setattr(self.catalog, attribute, folder)
+            os.chmod(staging, DIR_MODE)
+            # A folder cannot be renamed over a non-empty one: move the old one aside first
+            previous = staging[:-len('.tmp')] + '.old'
+            if os.path.exists(folder):
+                os.rename(folder, previous)
+            os.rename(staging, folder)
+            shutil.rmtree(previous, ignore_errors=True)
+        self.staged = {}
+
+    def abort(self):
+        for attribute, (folder, staging) in self.staged.items():
+            setattr(self.catalog, attribute, folder)
+            shutil.rmtree(staging, ignore_errors=True)
+        self.staged = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+        return False
+
+def createFusedAnnotations(catalog, labels, writer, reporter, workers=1, write_masks=True, TOTAL_PIXELS=None, manifest=None,
+                           bounds=None, quarantine=None, segmentation='polygon', instance_map=False,
+                           stable_ids=False, mask_cache=None, simplify=None, categories=None, prune=True):
+    # Replaces checkSingleTreeMask, createNewMasks, createImgList and
+    # createAnnotations with one stage that decodes every SingleTree file once.
+    # Produces the same coco.json; NewMasks are only written when write_masks is set,
+    # into the catalog's folders (see MaskFolders).
+    # With a RunManifest only new or changed frames are decoded.
+    # With a QuarantineManifest rejected files are recorded instead of deleted.
+    # With instance_map, annotations come from each frame's instance map and the
+    # maps are written to InstanceMaps/ along with NewMasks.
+    # With a MaskCache, SingleTree files are rebuilt from it instead of decoded.
+    # With a Simplification, polygons of the frames decoded in this run are
+    # simplified (the manifest settings include it, so cached ones already are).
+    # With a CategoryTable, each frame's Masks/ instances follow its trees; the
+    # manifest keeps them per Masks/ image as well.
+    # prune: drop the manifest entries of files that are not in the catalog, off
+    # when it only holds some frames (appends)
+    from maskOps import iterFusedFrames
+
+    counters = COUNTERS.snapshot()
+    reporter.status("Creating masks and annotations in a single pass...")
+    folders = [catalog.mask_folder, catalog.instance_folder] if instance_map else [catalog.mask_folder]
+    if write_masks:
+        for folder in folders:
+            os.makedirs(folder, exist_ok=True)
+    catalog.clearNewMasks()
+
+    frames = []
+    for label in labels:
+        tree_paths = [catalog.singleTreePath(r) for r in catalog.singleTreesForFrame(label)]
+        mask_path = os.path.join(catalog.mask_folder, label+'.png') if write_masks else None
+        map_path = os.path.join(catalog.instance_folder, label+'.png') if write_masks and instance_map else None
+        frames.append((label, tree_paths, mask_path, map_path))
+
+    id_count = 0
+    removed = 0
+    results = iterFusedFrames(frames, TOTAL_PIXELS, workers, manifest, bounds, segmentation, instance_map, mask_cache,
+                              simplify, reporter)
+    semantic_paths = []
+    category_frames = None
+    if categories is not None:
+        from categoryMasks import iterCategoryFrames
+        reportCategories(catalog, labels, reporter)
+        semantic_paths = [catalog.semanticMaskPath(label) for label in labels]
+        category_frames = iterCategoryFrames(semantic_paths, categories, workers, segmentation, simplify, manifest)
+    for label, size, tree_polys, rejected in reporter.track(results, total=len(labels), desc="Processing Frames"):
+        instances = next(category_frames) if category_frames is not None else []
+        records = {r.name: r for r in catalog.singleTreesForFrame(label)}
+        for name, percentage in rejected:
+            path = catalog.singleTreePath(records[name])
+            if quarantine is not None:
+                if percentage is not None:
+                    quarantine.setCoverage(path, percentage)
+                quarantine.reject(path, "coverage" if percentage is not None else "unreadable", percentage)
+            else:
+                os.remove(path)
+                if manifest is not None:
+                    manifest.discard(path)
+            catalog.discardSingleTree(records[name])
+            removed += 1
+        if quarantine is not None:
+            for name, percentage, list_poly in tree_polys:
+                quarantine.setCoverage(catalog.singleTreePath(records[name]), percentage)
+
+        # A frame left without valid trees is unaligned, so its image and depth go too
+        if size is None:
+            image_names, depth_names = catalog.discardFrame(label)
+            removeImages(catalog.image_folder, image_names, reporter, quarantine)
+            removeImages(catalog.depth_folder, depth_names, reporter, quarantine)
+            continue
+
+        file_name = label+'.png'
+        catalog.addNewMask(label, file_name)
+        height, width = size
+        if stable_ids:
+            id_count = stableImageId(label)
+        writer.addImage({
+            "id": id_count,
+            "width": width,
+            "height": height,
+            "file_name": file_name
+        })
+
+        annotations = [makeAnnotation(image, id_count, list_poly, stable_ids)
+                       for image, percentage, list_poly in tree_polys if list_poly != []]
+        annotations += makeCategoryAnnotations(id_count, instances, stable_ids)
+        writer.addAnnotations(annotations)
+        id_count += 1
+
+    reporter.status(f"{removed} images {'quarantined' if quarantine is not None else 'removed'}")
+    reportSimplification(counters, reporter)
+    if manifest is not None and prune:
+        manifest.prune([catalog.singleTreePath(r) for r in catalog.allSingleTrees()]
+                       + [path for path in semantic_paths if path is not None])
+    return writer.num_annotations
+
+def createInfo(description):
+    # SOURCE_DATE_EPOCH pins the date, for reproducible (e.g. sharded and merged) output
+    epoch = os.environ.get("SOURCE_DATE_EPOCH")
+    created = datetime.fromtimestamp(int(epoch), timezone.utc) if epoch else datetime.now()
+    return {"date_created": created.strftime('%Y-%m-%d %H:%M:%S'), "description": description}
+
+def storePath(segmentation_folder):
+    from annotationStore import STORE_NAME
+    return os.path.join(segmentation_folder, STORE_NAME)
+
+def openWriter(segmentation_folder, coco_path, info, output="json", categories=CATEGORIES, layout=None, append=False):
+    # Both writers take images and annotations frame by frame and only replace
+    # the previous output once close() has written everything; with append,
+    # a CocoAppender adds them to the coco.json layout describes
+    if append:
+        return CocoAppender(coco_path, layout)
+    if output == "json":
+        return CocoWriter(coco_path, info, categories, layout=layout)
+    from annotationStore import AnnotationStoreWriter
+    return AnnotationStoreWriter(storePath(segmentation_folder), info, categories)
+
+def exportStore(segmentation_folder, coco_path, profiler):
+    from annotationStore import exportCoco
+    with profiler.stage("exportCoco"):
+        exportCoco(storePath(segmentation_folder), coco_path)
+
+
+def runPipeline(segmentation_folder, options=None, reporter=None):
+    # Runs every stage on segmentation_folder and writes <segmentation_folder>/coco.json
+    # (or coco_store/, see PipelineOptions.output). Returns the path of what was
+    # written, or None when the folder cannot be processed.
+    options = options or PipelineOptions()
+    reporter = reporter or Reporter()
+
+    error = validateSegmentationFolder(segmentation_folder)
+    if error:
+        reporter.status(error)
+        return None
+    if options.shard is not None and options.output != "json":
+        reporter.status("Sharded runs write coco.json fragments only")
+        return None
+    segmentation_folder = os.path.abspath(segmentation_folder)
+    coco_path = os.path.join(segmentation_folder, "coco.json")
+    if options.shard is not None:
+        coco_path = os.path.join(segmentation_folder, fragmentName(options.shard))
+
+    profiler = StageProfiler(options.profile, options.cprofile_path, options.tracemalloc)
+    profiler.start()
+    try:
+        _runStages(segmentation_folder, coco_path, options, reporter, profiler)
+    finally:
+        profiler.stop()
+
+    if options.profile:
+        report_path = profiler.writeReport(segmentation_folder,
+                                           os.path.basename(shardPath('', PROFILE_NAME, options.shard)))
+        for line in profiler.summary():
+            reporter.status(line)
+        reporter.status(f"Profile written to {report_path}")
+    return storePath(segmentation_folder) if options.output == "store" else coco_path
+
+def _runStages(segmentation_folder, coco_path, options, reporter, profiler):
+    checkFolders(segmentation_folder, reporter)
+    with profiler.stage("scanCatalog") as stats:
+        catalog = DatasetCatalog(segmentation_folder, options.frame_files)
+        stats["files"] = len(catalog.allSingleTrees())
+    info_dict = createInfo(DESCRIPTION)
+    bounds = options.coverage_bounds
+
+    quarantine = None
+    if options.quarantine:
+        quarantine = QuarantineManifest(segmentation_folder, {"total_pixels": options.total_pixels},
+                                        move=options.quarantine == "move",
+                                        manifest_path=shardPath(segmentation_folder, QUARANTINE_NAME, options.shard),
+                                        reporter=reporter)
+        reinstateQuarantined(catalog, quarantine)
+
+    # Shards share the folder: each one only sees, deletes and rewrites its own frames
+    owns = None
+    if options.shard is not None:
+        owns = partial(inShard, shard=options.shard)
+        catalog.filterFrames(owns)
+    if options.frames is not None:
+        catalog.filterFrames(options.frames.__contains__)
+    if options.stable_ids or options.categories:
+        checkTreeIds(catalog)
+    mask_owns = owns
+    if options.append:
+        # The frames already in coco.json keep their masks and quarantine decisions
+        mask_owns = lambda name: os.path.splitext(name)[0] in options.frames
+        if quarantine is not None:
+            quarantine.limitTo(catalog.allPaths())
+
+    simplify = polygonSimplification(options)
+    categories = None
+    coco_categories = CATEGORIES
+    if options.categories:
+        from categoryMasks import loadCategoryTable
+        categories = loadCategoryTable(options.categories)
+        coco_categories = CATEGORIES + categories.categories
+    mask_cache = None
+    if options.mask_cache:
+        from maskCache import MaskCache, CACHE_NAME
+        mask_cache = MaskCache(segmentation_folder, shardPath(segmentation_folder, CACHE_NAME, options.shard), reporter)
+
+    if options.fused:
+        manifest = None
+        if options.incremental:
+            from maskOps import fusedSettings
+            settings = fusedSettings(options.total_pixels, options.segmentation, options.instance_map, simplify,
+                                     categories)
+            manifest = RunManifest(segmentation_folder, settings, options.use_hash,
+                                   shardPath(segmentation_folder, MANIFEST_NAME, options.shard), reporter)
+        if quarantine is not None:
+            quarantineKnownTrees(catalog, reporter, quarantine, bounds)
+        with profiler.stage("checkNumberAlignment", len(catalog.images)):
+            labels = checkNumberAlignment(catalog, reporter, quarantine)
+        if quarantine is not None:
+            # Brings back reinstated trees before they are decoded
+            with profiler.stage("applyQuarantine", len(quarantine.rejected)):
+                applyQuarantine(quarantine, reporter)
+        try:
+            if mask_cache is not None:
+                with profiler.stage("fillMaskCache", len(catalog.allSingleTrees())):
+                    fillMaskCache(catalog, mask_cache, reporter, options.io_threads, options.prefetch,
+                                  not options.append)
+            attributes = []
+            if options.write_masks:
+                attributes = ['mask_folder', 'instance_folder'] if options.instance_map else ['mask_folder']
+            with MaskFolders(catalog, labels, attributes, manifest is not None or mask_owns is not None, mask_owns), \
+                    openWriter(segmentation_folder, coco_path, info_dict, options.output, coco_categories,
+                               options.layout, options.append) as writer:
+                with profiler.stage("createFusedAnnotations") as stats:
+                    stats["files"] = len(catalog.allSingleTrees())
+                    createFusedAnnotations(catalog, labels, writer, reporter, options.workers, options.write_masks,
+                                           options.total_pixels, manifest, bounds, quarantine, options.segmentation,
+                                           options.instance_map, options.stable_ids, mask_cache, simplify,
+                                           categories, not options.append)
+                with profiler.stage("writeCoco", writer.num_images + writer.num_annotations):
+                    writer.close()
+            if options.output == "both":
+                exportStore(segmentation_folder, coco_path, profiler)
+        finally:
+            # Whatever finished before a crash is reused by the next run
+            if manifest is not None:
+                manifest.save()
+            if quarantine is not None:
+                with profiler.stage("applyQuarantine", len(quarantine.rejected)):
+                    applyQuarantine(quarantine, reporter)
+        return
+
+    try:
+        if mask_cache is not None:
+            with profiler.stage("fillMaskCache", len(catalog.allSingleTrees())):
+                fillMaskCache(catalog, mask_cache, reporter, options.io_threads, options.prefetch)
+        with profiler.stage("checkSingleTreeMask", len(catalog.allSingleTrees())):
+            checkSingleTreeMask(catalog, reporter, options.total_pixels, bounds, quarantine,
+                                options.io_threads, options.prefetch, mask_cache)
+        with profiler.stage("checkNumberAlignment", len(catalog.images)):
+            labels = checkNumberAlignment(catalog, reporter, quarantine)
+    finally:
+        # Coverage computed before a cancel or crash is kept for the next run
+        if quarantine is not None:
+            with profiler.stage("applyQuarantine", len(quarantine.rejected)):
+                applyQuarantine(quarantine, reporter)
+    # coco.json and NewMasks only replace the previous ones once everything has been written
+    with MaskFolders(catalog, labels, ['mask_folder'], owns is not None, owns):
+        with profiler.stage("createNewMasks", len(catalog.allSingleTrees())):
+            createNewMasks(catalog, labels, reporter, mask_cache)
+        with openWriter(segmentation_folder, coco_path, info_dict, options.output, coco_categories,
+                        options.layout) as writer:
+            with profiler.stage("createImgList", len(catalog.new_masks)):
+                name_id_dict = createImgList(catalog, writer, reporter, options.stable_ids)
+            with profiler.stage("organizeMainSepMasks", len(name_id_dict)):
+                name_sep_dict = organizeMainSepMasks(name_id_dict, catalog)
+            with profiler.stage("createAnnotations", sum(len(v) for v in name_sep_dict.values())):
+                createAnnotations(name_id_dict, name_sep_dict, catalog, writer, reporter, options.workers,
+                                  options.io_threads, options.prefetch, options.segmentation, options.stable_ids,
+                                  mask_cache, simplify, categories)
+            with profiler.stage("writeCoco", writer.num_images + writer.num_annotations):
+                writer.close()
+    if options.output == "both":
+        exportStore(segmentation_folder, coco_path, profiler)
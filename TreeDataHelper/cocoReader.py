@@ -0,0 +1,291 @@
+import os
+import re
+import sys
+import mmap
+import json
+import argparse
+from collections import namedtuple
+import numpy as np
+
+# Lazy, indexed access to a (possibly huge) coco.json without json.load'ing it.
+# The file is memory-mapped and scanned once in WINDOW sized slices: NumPy
+# finds the quotes and brackets of each slice, the quote parity tells which
+# brackets are structural, and a cumulative sum gives their nesting depth. Only
+# brackets down to the depth of the image and annotation objects reach Python,
+# so polygon coordinates are never looked at one by one. Each annotation object
+# is recorded as (offset, length) with its id, image_id and bbox, which are read
+# with regexes instead of parsing the segmentation; anything unusual falls back
+# to json.loads of that one object.
+
+WINDOW = 16 << 20
+
+QUOTE, BACKSLASH = ord('"'), ord('\\')
+OPENING = (ord('{'), ord('['))
+BRACKETS = (ord('{'), ord('}'), ord('['), ord(']'))
+
+# Nesting depth of a bracket: 1 for the top-level object, 2 for the "images"
+# and "annotations" arrays, 3 for the objects in them
+SECTION_DEPTH = 2
+ELEMENT_DEPTH = 3
+
+KEY_RE = re.compile(rb'"((?:[^"\\]|\\.)*)"\s*:\s*$')
+ID_RE = re.compile(rb'"id"\s*:\s*("(?:[^"\\]|\\.)*"|-?\d+)')
+IMAGE_ID_RE = re.compile(rb'"image_id"\s*:\s*(-?\d+)[\s,}]')
+BBOX_RE = re.compile(rb'"bbox"\s*:\s*\[([^\]]*)\]')
+
+# Examples kept per failed check
+MAX_EXAMPLES = 10
+
+# check: name of the check; count: offending entries; examples: the first
+# MAX_EXAMPLES of them (annotation or image ids)
+Problem = namedtuple('Problem', ['check', 'count', 'examples'])
+
+
+def _quotePositions(view, lo, hi):
+    # Positions in [lo, hi) of the quotes that open or close a string, i.e. not
+    # preceded by an odd number of backslashes
+    quotes = np.flatnonzero(view[lo:hi] == QUOTE) + lo
+    escaped = quotes[(quotes > 0) & (view[np.maximum(quotes - 1, 0)] == BACKSLASH)]
+    if not len(escaped):
+        return quotes
+    drop = []
+    for pos in escaped.tolist():
+        run = 1
+        while pos - run - 1 >= 0 and view[pos - run - 1] == BACKSLASH:
+            run += 1
+        if run % 2:
+            drop.append(pos)
+    return np.setdiff1d(quotes, drop, assume_unique=True)
+
+
+def scanElements(view, window=WINDOW):
+    # Yields (section key, start, end) of every object in a top-level array,
+    # end exclusive, in file order
+    in_string = 0
+    depth = 0
+    section = None
+    start = None
+    for lo in range(0, len(view), window):
+        hi = min(lo + window, len(view))
+        chunk = view[lo:hi]
+        brackets = np.flatnonzero(np.isin(chunk, BRACKETS)) + lo
+        if not len(brackets):
+            in_string = (in_string + len(_quotePositions(view, lo, hi))) & 1
+            continue
+        quotes = _quotePositions(view, lo, hi)
+        # A bracket is inside a string when an odd number of quotes precede it
+        structural = brackets[((in_string + np.searchsorted(quotes, brackets)) & 1) == 0]
+        in_string = (in_string + len(quotes)) & 1
+        if not len(structural):
+            continue
+        opening = np.isin(view[structural], OPENING)
+        after = depth + np.cumsum(np.where(opening, 1, -1))
+        level = np.where(opening, after, after + 1)
+        depth = int(after[-1])
+        shallow = level <= ELEMENT_DEPTH
+        for pos, is_open, lvl in zip(structural[shallow].tolist(), opening[shallow].tolist(),
+                                     level[shallow].tolist()):
+            if lvl == SECTION_DEPTH:
+                if is_open:
+                    match = KEY_RE.search(bytes(view[max(pos - 256, 0):pos]))
+                    section = match.group(1).decode() if match else None
+                else:
+                    section = None
+            elif lvl == ELEMENT_DEPTH and section is not None:
+                if is_open:
+                    start = pos
+                elif start is not None:
+                    yield section, start, pos + 1
+                    start = None
+    if depth:
+        raise ValueError("Truncated JSON file")
+
+
+def _annotationFields(data):
+    # (id token, image_id, bbox) of one annotation object's bytes. The id token
+    # is its JSON text, so "5" and 5 stay different ids
+    ids = ID_RE.findall(data)
+    image_ids = IMAGE_ID_RE.findall(data)
+    bboxes = BBOX_RE.findall(data)
+    if len(ids) == 1 and len(image_ids) == 1 and len(bboxes) == 1:
+        try:
+            bbox = [float(v) for v in bboxes[0].split(b',')]
+            if len(bbox) == 4:
+                return ids[0], int(image_ids[0]), bbox
+        except ValueError:
+            pass
+    # e.g. a key repeated inside a nested object, or an unusual bbox
+    annotation = json.loads(data)
+    bbox = annotation.get('bbox')
+    if not isinstance(bbox, list) or len(bbox) != 4:
+        bbox = [np.nan] * 4
+    image_id = annotation.get('image_id')
+    return json.dumps(annotation.get('id')).encode(), image_id if isinstance(image_id, int) else None, bbox
+
+
+class CocoReader:
+    # Opening a file runs the streaming scan; afterwards images and annotations
+    # are parsed one object at a time, straight from the mmap
+    def __init__(self, coco_path, window=WINDOW):
+        self.path = coco_path
+        self.file = open(coco_path, 'rb')
+        if os.fstat(self.file.fileno()).st_size == 0:
+            self.file.close()
+            raise ValueError(f"{coco_path} is empty")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._buildIndex(window)
+
+    def _buildIndex(self, window):
+        view = np.frombuffer(self.map, dtype=np.uint8)
+        image_spans = []
+        image_ids = []
+        image_sizes = []
+        ann_spans = []
+        ann_ids = []
+        ann_image_ids = []
+        ann_bboxes = []
+        for section, start, end in scanElements(view, window):
+            if section == 'annotations':
+                token, image_id, bbox = _annotationFields(self.map[start:end])
+                ann_spans.append((start, end))
+                ann_ids.append(token)
+                # -1 marks a missing image_id (the missing_image_id check)
+                ann_image_ids.append(-1 if image_id is None else image_id)
+                ann_bboxes.append(bbox)
+            elif section == 'images':
+                image = json.loads(self.map[start:end])
+                image_spans.append((start, end))
+                image_ids.append(image.get('id', -1))
+                image_sizes.append((image.get('width', 0), image.get('height', 0)))
+        del view
+
+        self.image_spans = np.asarray(image_spans, dtype=np.int64).reshape(-1, 2)
+        self.image_ids = np.asarray(image_ids, dtype=np.int64)
+        self.image_sizes = np.asarray(image_sizes, dtype=np.float64).reshape(-1, 2)
+        self.ann_spans = np.asarray(ann_spans, dtype=np.int64).reshape(-1, 2)
+        self.ann_ids = np.asarray(ann_ids, dtype=bytes)
+        self.ann_image_ids = np.asarray(ann_image_ids, dtype=np.int64)
+        self.ann_bboxes = np.asarray(ann_bboxes, dtype=np.float64).reshape(-1, 4)
+
+        # image_id -> annotation rows: rows sorted by image id (stable, so file
+        # order within an image), found by binary search
+        self.image_order = np.argsort(self.image_ids, kind='stable')
+        self.ann_order = np.argsort(self.ann_image_ids, kind='stable')
+        self.sorted_ann_image_ids = self.ann_image_ids[self.ann_order]
+
+    @property
+    def num_images(self):
+        return len(self.image_ids)
+
+    @property
+    def num_annotations(self):
+        return len(self.ann_ids)
+
+    def _load(self, span):
+        return json.loads(self.map[int(span[0]):int(span[1])])
+
+    def image(self, image_id):
+        # The image record with id image_id, or None
+        row = self._imageRow(image_id)
+        return None if row is None else self._load(self.image_spans[row])
+
+    def _imageRow(self, image_id):
+        i = int(np.searchsorted(self.image_ids, image_id, sorter=self.image_order))
+        if i < len(self.image_order) and self.image_ids[self.image_order[i]] == image_id:
+            return int(self.image_order[i])
+        return None
+
+    def annotationRows(self, image_id):
+        # Rows (file order) of image_id's annotations
+        first = int(np.searchsorted(self.sorted_ann_image_ids, image_id, side='left'))
+        last = int(np.searchsorted(self.sorted_ann_image_ids, image_id, side='right'))
+        return self.ann_order[first:last]
+
+    def annotation(self, row):
+        return self._load(self.ann_spans[row])
+
+    def annotationsForImage(self, image_id):
+        # Parses only image_id's annotation objects
+        return [self.annotation(row) for row in self.annotationRows(image_id)]
+
+    def validate(self):
+        # Problems found, [] for a consistent file. Every check runs on the index
+        problems = []
+
+        def report(check, mask, ids):
+            count = int(np.count_nonzero(mask))
+            if count:
+                examples = [_exampleId(v) for v in ids[mask][:MAX_EXAMPLES].tolist()]
+                problems.append(Problem(check, count, examples))
+
+        sorted_image_ids = self.image_ids[self.image_order]
+        repeated_images = np.zeros(self.num_images, dtype=bool)
+        repeated_images[1:] = sorted_image_ids[1:] == sorted_image_ids[:-1]
+        report('duplicate_image_ids', repeated_images, sorted_image_ids)
+
+        # Annotation ids that occur more than once, each reported once
+        if self.num_annotations:
+            unique_ids, counts = np.unique(self.ann_ids, return_counts=True)
+            report('duplicate_annotation_ids', counts > 1, unique_ids)
+
+        missing = self.ann_image_ids < 0
+        report('missing_image_id', missing, self.ann_ids)
+
+        # Row of each annotation's image, or -1 when there is no such image
+        rows = np.full(self.num_annotations, -1, dtype=np.int64)
+        if self.num_images:
+            i = np.minimum(np.searchsorted(sorted_image_ids, self.ann_image_ids), self.num_images - 1)
+            found = sorted_image_ids[i] == self.ann_image_ids
+            rows[found] = self.image_order[i[found]]
+        report('dangling_image_ids', (rows < 0) & ~missing, self.ann_ids)
+
+        known = rows >= 0
+        x, y, w, h = self.ann_bboxes.T
+        width, height = self.image_sizes[rows].T if self.num_images else (np.zeros(self.num_annotations),) * 2
+        with np.errstate(invalid='ignore'):
+            outside = (np.isnan(self.ann_bboxes).any(axis=1) | (x < 0) | (y < 0) | (w < 0) | (h < 0)
+                       | (x + w > width) | (y + h > height))
+        report('bbox_out_of_bounds', outside & known, self.ann_ids)
+        return problems
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def _exampleId(value):
+    # Annotation id tokens back to their JSON value
+    return json.loads(value) if isinstance(value, bytes) else value
+
+
+def formatProblems(problems):
+    hints = {'duplicate_annotation_ids': " (filename-derived tree ids repeat across frames, use --stable-ids)"}
+    return [f"{p.check}: {p.count}{hints.get(p.check, '')}, e.g. {p.examples}" for p in problems]
+
+
+def parseArgs():
+    parser = argparse.ArgumentParser(description="Index and validate a coco.json without loading it.")
+    parser.add_argument('coco_path', help="COCO file written by the pipeline")
+    parser.add_argument('--image', type=int, action='append', default=[],
+                        help="Print the annotations of this image id (repeatable)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parseArgs()
+    with CocoReader(args.coco_path) as reader:
+        for image_id in args.image:
+            print(json.dumps({"image": reader.image(image_id),
+                              "annotations": reader.annotationsForImage(image_id)}))
+        problems = reader.validate()
+        print(f"{args.coco_path}: {reader.num_images} images, {reader.num_annotations} annotations", file=sys.stderr)
+        for line in formatProblems(problems):
+            print(line, file=sys.stderr)
+    sys.exit(1 if problems else 0)
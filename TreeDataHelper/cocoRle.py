@@ -0,0 +1,97 @@
+import numpy as np
+
+# COCO compressed RLE ({"size": [h, w], "counts": str}) in plain NumPy, so
+# generating coco.json does not need pycocotools. Same output as
+# pycocotools.mask.encode: runs over the column-major flattened mask, starting
+# with a run of zeros, stored as deltas in 5-bit groups offset by 48.
+
+# 5-bit groups a run length can take; COCO counts fit in 32 bits
+MAX_GROUPS = 7
+
+
+def runLengths(mask):
+    flat = np.asarray(mask, dtype=bool).ravel(order='F')
+    if flat.size == 0:
+        return np.zeros(0, dtype=np.int64)
+    changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    bounds = np.concatenate(([0], changes, [flat.size]))
+    counts = np.diff(bounds)
+    if flat[0]:
+        counts = np.concatenate(([0], counts))
+    return counts.astype(np.int64)
+
+def countsToString(counts):
+    # Vectorized over runs: every step peels one 5-bit group off all values still going
+    counts = np.asarray(counts, dtype=np.int64)
+    values = counts.copy()
+    # pycocotools stores the delta to the run two back from the fourth run on
+    values[3:] -= counts[1:-2]
+    groups = np.zeros((values.size, MAX_GROUPS), dtype=np.uint8)
+    used = np.zeros((values.size, MAX_GROUPS), dtype=bool)
+    active = np.ones(values.size, dtype=bool)
+    for g in range(MAX_GROUPS):
+        c = values & 0x1f
+        values >>= 5
+        more = np.where(c & 0x10, values != -1, values != 0)
+        used[:, g] = active
+        groups[:, g] = (c | np.where(more, 0x20, 0)) + 48
+        active &= more
+        if not active.any():
+            break
+    return groups[used].tobytes().decode('ascii')
+
+def stringToCounts(s):
+    counts = []
+    i = 0
+    data = s.encode('ascii')
+    while i < len(data):
+        x = 0
+        k = 0
+        more = True
+        while more:
+            c = data[i] - 48
+            x |= (c & 0x1f) << (5 * k)
+            more = bool(c & 0x20)
+            i += 1
+            k += 1
+            if not more and (c & 0x10):
+                x |= -1 << (5 * k)
+        if len(counts) > 2:
+            x += counts[-2]
+        counts.append(x)
+    return counts
+
+def encodeMask(mask):
+    h, w = mask.shape[:2]
+    return {"size": [int(h), int(w)], "counts": countsToString(runLengths(mask))}
+
+def encodeRoi(roi_mask, offset, frame_size):
+    # RLE of a frame_size (h, w) mask that is empty outside roi_mask, placed at
+    # offset (x, y). Only the roi's columns are scanned, not the whole frame
+    x0, y0 = offset
+    h, w = frame_size
+    roi_h, roi_w = roi_mask.shape
+    strip = np.zeros((h, roi_w), dtype=bool)
+    strip[y0:y0 + roi_h] = roi_mask
+    counts = runLengths(strip)
+    # The columns left of the roi extend the first (zero) run
+    counts[0] += h * x0
+    tail = h * (w - x0 - roi_w)
+    if tail:
+        # An odd number of runs ends with zeros
+        if len(counts) % 2:
+            counts[-1] += tail
+        else:
+            counts = np.append(counts, tail)
+    return {"size": [int(h), int(w)], "counts": countsToString(counts)}
+
+def decodeMask(rle):
+    h, w = rle["size"]
+    counts = stringToCounts(rle["counts"]) if isinstance(rle["counts"], str) else rle["counts"]
+    values = np.zeros(len(counts), dtype=np.uint8)
+    values[1::2] = 1
+    return np.repeat(values, counts).reshape((h, w), order='F')
+
+def maskArea(rle):
+    counts = stringToCounts(rle["counts"]) if isinstance(rle["counts"], str) else rle["counts"]
+    return int(sum(counts[1::2]))
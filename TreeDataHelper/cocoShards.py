@@ -0,0 +1,133 @@
+import os
+import re
+import json
+import zlib
+from cocoWriter import CocoWriter
+
+# Sharded generation: every machine runs the pipeline with --shard i/N on the
+# same segmentation folder and only handles the frames whose id hashes to i.
+# Each writes coco.shard-<i>-of-<N>.json with stable ids, and merge puts the
+# fragments back together. Ids only depend on file names, so the merged file
+# holds the same data whatever N was. It is only byte-identical across runs when
+# every shard ran with the same SOURCE_DATE_EPOCH: otherwise info.date_created
+# is the latest wall-clock time of the shards.
+
+FRAGMENT_RE = re.compile(r'^coco\.shard-(\d+)-of-(\d+)\.json$')
+# Stable annotation ids are image_id << TREE_ID_BITS | tree_id
+TREE_ID_BITS = 16
+# Masks/ category instances (categoryMasks) take the upper half of the tree id
+# range, so tree ids must stay below it
+CATEGORY_ID_BASE = 1 << (TREE_ID_BITS - 1)
+
+
+def parseShard(text):
+    # "i/N" -> (i, N)
+    try:
+        index, count = (int(part) for part in text.split('/'))
+    except ValueError:
+        raise ValueError(f"Shard must look like i/N, got {text!r}")
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Shard index must be in [0, {count}), got {text!r}")
+    return index, count
+
+def shardSuffix(shard):
+    return f".shard-{shard[0]}-of-{shard[1]}"
+
+def fragmentName(shard):
+    return f"coco{shardSuffix(shard)}.json"
+
+def shardPath(folder, name, shard):
+    # Per-shard name of a file every run writes (manifests, profile report), so
+    # shards sharing a folder do not overwrite each other's; None keeps name
+    if shard is None:
+        return os.path.join(folder, name)
+    base, ext = os.path.splitext(name)
+    return os.path.join(folder, base + shardSuffix(shard) + ext)
+
+def frameIdOf(name):
+    # Frame, depth, SingleTree and NewMasks names all start with "<frame id>_"
+    return name.split('_')[0]
+
+def shardOf(frame_id, count):
+    # crc32 instead of hash(), which is salted per process
+    return zlib.crc32(frame_id.encode('utf-8')) % count
+
+def inShard(name, shard):
+    return shardOf(frameIdOf(name), shard[1]) == shard[0]
+
+def stableImageId(frame_key):
+    frame_id = frameIdOf(frame_key)
+    if not frame_id.isdigit():
+        raise ValueError(f"Stable ids need numeric frame ids, got {frame_id!r}")
+    return int(frame_id)
+
+def stableAnnotationId(image_id, tree_id):
+    tree_id = int(tree_id)
+    if not 0 <= tree_id < CATEGORY_ID_BASE:
+        raise ValueError(f"Tree id {tree_id} does not fit in a stable annotation id: tree ids must be below "
+                         f"{CATEGORY_ID_BASE}, the ids above are reserved for Masks/ category instances")
+    return image_id << TREE_ID_BITS | tree_id
+
+def categoryAnnotationId(image_id, index):
+    # Id of the index-th category instance of an image
+    if not 0 <= index < (1 << TREE_ID_BITS) - CATEGORY_ID_BASE:
+        raise ValueError(f"Too many category instances in image {image_id}")
+    return image_id << TREE_ID_BITS | CATEGORY_ID_BASE + index
+
+
+def findFragments(folder):
+    # Fragment paths ordered by shard index; all shards of a single N must be there
+    found = {}
+    for name in os.listdir(folder):
+        match = FRAGMENT_RE.match(name)
+        if match:
+            found[(int(match.group(1)), int(match.group(2)))] = os.path.join(folder, name)
+    if not found:
+        raise ValueError(f"No coco.shard-*-of-*.json fragments in {folder}")
+    counts = {count for _, count in found}
+    if len(counts) != 1:
+        raise ValueError(f"Fragments of different shard counts in {folder}: {sorted(counts)}")
+    count = counts.pop()
+    missing = [i for i in range(count) if (i, count) not in found]
+    if missing:
+        raise ValueError(f"Missing fragments for shards {missing} of {count}")
+    return [found[(i, count)] for i in range(count)]
+
+def mergeFragments(fragment_paths, coco_path):
+    # Images ordered by id and annotations by id, so the result does not
+    # depend on how frames were spread over shards or listed on disk
+    images = []
+    annotations = []
+    info = None
+    categories = None
+    licenses = None
+    for path in fragment_paths:
+        with open(path) as f:
+            fragment = json.load(f)
+        if categories is None:
+            info, categories, licenses = dict(fragment['info']), fragment['categories'], fragment['licenses']
+        elif fragment['categories'] != categories:
+            raise ValueError(f"{path} has different categories than the other fragments")
+        # The newest fragment dates the merged file
+        info['date_created'] = max(info['date_created'], fragment['info']['date_created'])
+        images.extend(fragment['images'])
+        annotations.extend(fragment['annotations'])
+
+    images.sort(key=lambda image: image['id'])
+    annotations.sort(key=lambda annotation: annotation['id'])
+    image_ids = [image['id'] for image in images]
+    if len(set(image_ids)) != len(image_ids):
+        raise ValueError("Duplicate image ids across fragments")
+    annotation_ids = [annotation['id'] for annotation in annotations]
+    if len(set(annotation_ids)) != len(annotation_ids):
+        raise ValueError("Duplicate annotation ids across fragments")
+    known = set(image_ids)
+    dangling = [a['id'] for a in annotations if a['image_id'] not in known]
+    if dangling:
+        raise ValueError(f"{len(dangling)} annotations point to missing images")
+
+    with CocoWriter(coco_path, info, categories, licenses) as writer:
+        for image in images:
+            writer.addImage(image)
+        writer.addAnnotations(annotations)
+    return len(images), len(annotations)
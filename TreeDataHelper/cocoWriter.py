@@ -0,0 +1,254 @@
+import os
+import json
+import shutil
+import tempfile
+from stageProfiler import COUNTERS
+
+# mkstemp creates 0600 files (mkdtemp 0700 folders); give the final ones the usual permissions instead
+_umask = os.umask(0)
+os.umask(_umask)
+FILE_MODE = 0o666 & ~_umask
+DIR_MODE = 0o777 & ~_umask
+
+# Room CocoLayout keeps after the images by default, about a thousand image entries
+RESERVE_BYTES = 64 * 1024
+
+
+class CocoLayout:
+    # Where a coco.json written with room to grow keeps its images, so that
+    # CocoAppender can add frames without rewriting the file: the writer leaves
+    # gap spaces (still valid JSON) between the last image and "], "categories"
+    # and records the offsets here. size and mtime_ns tell whether the file was
+    # replaced since; counts tell whether the next entry needs a separator.
+    def __init__(self, reserve=RESERVE_BYTES):
+        self.reserve = reserve
+        self.path = None
+        self.images_end = None
+        self.gap = 0
+        self.size = None
+        self.mtime_ns = None
+        self.num_images = 0
+        self.num_annotations = 0
+
+    def record(self, path, images_end, gap, num_images, num_annotations):
+        stat = os.stat(path)
+        self.path = path
+        self.images_end = images_end
+        self.gap = gap
+        self.size = stat.st_size
+        self.mtime_ns = stat.st_mtime_ns
+        self.num_images = num_images
+        self.num_annotations = num_annotations
+
+    def matches(self, path):
+        # True when path is still the file this layout was recorded for
+        if self.path != path:
+            return False
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return False
+        return stat.st_size == self.size and stat.st_mtime_ns == self.mtime_ns
+
+
+class CocoWriter:
+    # Streams a COCO file to disk while frames are processed.
+    #
+    # Images are written straight into a temporary copy of the output file and
+    # annotations into a spool file next to it, so memory stays bounded by what
+    # the caller holds for one frame. close() appends the categories and the
+    # spooled annotations, then atomically renames the temporary file over
+    # coco_path. The result is byte-identical to json.dump() of the same dict,
+    # unless a CocoLayout asks for room after the images (then it is equal once parsed).
+    def __init__(self, coco_path, info, categories, licenses=None, layout=None):
+        self.coco_path = coco_path
+        self.categories = categories
+        self.layout = layout
+        self.num_images = 0
+        self.num_annotations = 0
+        self.closed = False
+
+        folder = os.path.dirname(os.path.abspath(coco_path))
+        base = os.path.basename(coco_path)
+        fd, self.tmp_path = tempfile.mkstemp(prefix=base + '.', suffix='.tmp', dir=folder)
+        self.file = os.fdopen(fd, 'w')
+        fd, self.spool_path = tempfile.mkstemp(prefix=base + '.', suffix='.annotations.tmp', dir=folder)
+        self.spool = os.fdopen(fd, 'w+')
+
+        self.file.write('{"info": ' + json.dumps(info))
+        self.file.write(', "licenses": ' + json.dumps(licenses))
+        self.file.write(', "images": [')
+
+    def addImage(self, image):
+        if self.num_images:
+            self.file.write(', ')
+        self.file.write(json.dumps(image))
+        self.num_images += 1
+
+    def addAnnotation(self, annotation):
+        if self.num_annotations:
+            self.spool.write(', ')
+        self.spool.write(json.dumps(annotation))
+        self.num_annotations += 1
+
+    def addAnnotations(self, annotations):
+        for annotation in annotations:
+            self.addAnnotation(annotation)
+
+    def close(self):
+        if self.closed:
+            return
+        if self.layout is not None:
+            # json.dumps output is ASCII, so characters are bytes
+            images_end = self.file.tell()
+            self.file.write(' ' * self.layout.reserve)
+        self.file.write('], "categories": ' + json.dumps(self.categories))
+        self.file.write(', "annotations": [')
+        self.spool.flush()
+        self.spool.seek(0)
+        shutil.copyfileobj(self.spool, self.file)
+        self.file.write(']}')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self._closeFiles()
+        os.chmod(self.tmp_path, FILE_MODE)
+        os.replace(self.tmp_path, self.coco_path)
+        os.remove(self.spool_path)
+        COUNTERS.addWrite(os.path.getsize(self.coco_path))
+        if self.layout is not None:
+            self.layout.record(self.coco_path, images_end, self.layout.reserve, self.num_images, self.num_annotations)
+
+    def abort(self):
+        # Drop everything written so far and leave any previous coco_path untouched
+        if self.closed:
+            return
+        self._closeFiles()
+        for path in (self.tmp_path, self.spool_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _closeFiles(self):
+        self.closed = True
+        self.file.close()
+        self.spool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+class CocoAppender:
+    # Adds frames to a coco.json a CocoWriter wrote with a CocoLayout, with the
+    # writer's interface. The batch is held in memory (it is the few frames that
+    # settled since the last run). close() copies coco.json to a temporary file
+    # (shutil.copyfile copies in the kernel where the platform can), writes the
+    # images into the gap and the annotations over the closing "]}" of the copy
+    # and renames it over coco.json, so that readers and crashes only ever see
+    # the old or the new file, as with CocoWriter. When the images do not fit,
+    # the copy is rebuilt with a gap as large as everything before it, so that
+    # rebuilds get rarer as the file grows.
+    def __init__(self, coco_path, layout):
+        if not layout.matches(coco_path):
+            raise ValueError(f"{coco_path} changed since its layout was recorded")
+        self.coco_path = coco_path
+        self.layout = layout
+        self.images = []
+        self.annotations = []
+        self.num_images = 0
+        self.num_annotations = 0
+        self.closed = False
+
+    def addImage(self, image):
+        self.images.append(json.dumps(image))
+        self.num_images += 1
+
+    def addAnnotation(self, annotation):
+        self.annotations.append(json.dumps(annotation))
+        self.num_annotations += 1
+
+    def addAnnotations(self, annotations):
+        for annotation in annotations:
+            self.addAnnotation(annotation)
+
+    @staticmethod
+    def _entries(items, count):
+        # items as they continue an array that already holds count entries
+        text = ', '.join(items)
+        return (', ' + text if count and items else text).encode()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        layout = self.layout
+        if not layout.matches(self.coco_path):
+            raise ValueError(f"{self.coco_path} changed since its layout was recorded")
+        images = self._entries(self.images, layout.num_images)
+        annotations = self._entries(self.annotations, layout.num_annotations) + b']}'
+        folder = os.path.dirname(os.path.abspath(self.coco_path))
+        fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(self.coco_path) + '.', suffix='.tmp', dir=folder)
+        os.close(fd)
+        try:
+            if len(images) <= layout.gap:
+                gap = layout.gap - len(images)
+                self._patch(tmp_path, images, annotations)
+            else:
+                gap = max(layout.reserve, layout.images_end)
+                self._rebuild(tmp_path, images, annotations, gap)
+            os.chmod(tmp_path, FILE_MODE)
+            os.replace(tmp_path, self.coco_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        COUNTERS.addWrite(os.path.getsize(self.coco_path))
+        layout.record(self.coco_path, layout.images_end + len(images), gap,
+                      layout.num_images + self.num_images, layout.num_annotations + self.num_annotations)
+
+    def _patch(self, tmp_path, images, annotations):
+        # A copy of the file with the images in the gap and the annotations over "]}"
+        shutil.copyfile(self.coco_path, tmp_path)
+        with open(tmp_path, 'r+b') as out:
+            out.seek(self.layout.images_end)
+            out.write(images)
+            out.seek(self.layout.size - 2)
+            out.write(annotations)
+            out.flush()
+            os.fsync(out.fileno())
+
+    def _rebuild(self, tmp_path, images, annotations, gap):
+        layout = self.layout
+        with open(tmp_path, 'wb') as out, open(self.coco_path, 'rb') as src:
+            out.write(src.read(layout.images_end))
+            out.write(images)
+            out.write(b' ' * gap)
+            src.seek(layout.images_end + layout.gap)
+            remaining = layout.size - 2 - src.tell()
+            while remaining > 0:
+                chunk = src.read(min(remaining, 1 << 20))
+                out.write(chunk)
+                remaining -= len(chunk)
+            out.write(annotations)
+            out.flush()
+            os.fsync(out.fileno())
+
+    def abort(self):
+        # Nothing reaches the file before close()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
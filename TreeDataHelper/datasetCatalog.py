@@ -0,0 +1,166 @@
+import os
+from collections import namedtuple
+
+IMAGE_FOLDER = 'Images'
+DEPTH_FOLDER = 'Depth'
+STREE_FOLDER = 'SingleTrees'
+# Semantic masks from UE, one per frame; only read by category runs (categoryMasks)
+SEMANTIC_FOLDER = 'Masks'
+MASK_FOLDER = 'NewMasks'
+# uint16 tree id + 1 per pixel, written next to NewMasks by instance-map runs
+INSTANCE_FOLDER = 'InstanceMaps'
+
+# Frame files look like 1435_Forest_Environment_Set_Map_.png, single tree
+# files like 1435_Forest_Environment_Set_Map_<a>_<b>_tree12.png
+FrameFile = namedtuple('FrameFile', ['name', 'frame_id', 'frame_key'])
+TreeFile = namedtuple('TreeFile', ['name', 'frame_id', 'frame_key', 'tree_id'])
+
+
+def parseFrameFile(name):
+    frame_key = name.split('.')[0]
+    return FrameFile(name, frame_key.split('_')[0], frame_key)
+
+
+def parseTreeFile(name):
+    parts = name.split('_')
+    frame_key = '_'.join(parts[:-3]) + '_'
+    tree_id = name.split('.')[0].split('_')[-1][4:]
+    return TreeFile(name, parts[0], frame_key, tree_id)
+
+
+def scanFolder(folder):
+    # os.scandir keeps the same order as os.listdir but avoids an extra stat per entry
+    if not os.path.isdir(folder):
+        return []
+    with os.scandir(folder) as it:
+        return [entry.name for entry in it if entry.is_file()]
+
+
+class DatasetCatalog:
+    # Lists every folder of a segmentation export exactly once and keeps
+    # frame_key -> files indexes so that later stages never re-list directories.
+    # files: {folder name: file names} to index instead of listing those folders
+    # (e.g. from folderWatcher, which already knows every file)
+    def __init__(self, segmentation_folder, files=None):
+        self.root = segmentation_folder
+        self.files = files
+        self.image_folder = os.path.join(segmentation_folder, IMAGE_FOLDER)
+        self.depth_folder = os.path.join(segmentation_folder, DEPTH_FOLDER)
+        self.stree_folder = os.path.join(segmentation_folder, STREE_FOLDER)
+        self.mask_folder = os.path.join(segmentation_folder, MASK_FOLDER)
+        self.instance_folder = os.path.join(segmentation_folder, INSTANCE_FOLDER)
+        self.semantic_folder = os.path.join(segmentation_folder, SEMANTIC_FOLDER)
+
+        self.images = {}
+        self.depth = {}
+        self.single_trees = {}
+        self.new_masks = {}
+        # Masks/ is only listed once a category run asks for it
+        self.semantic = None
+        self.scan()
+
+    def _list(self, folder):
+        if self.files is not None and folder in self.files:
+            return list(self.files[folder])
+        return scanFolder(os.path.join(self.root, folder))
+
+    def scan(self):
+        self.images = self._indexFrames(self._list(IMAGE_FOLDER))
+        self.depth = self._indexFrames(self._list(DEPTH_FOLDER))
+        self.single_trees = {}
+        for name in self._list(STREE_FOLDER):
+            record = parseTreeFile(name)
+            self.single_trees.setdefault(record.frame_key, []).append(record)
+        self.new_masks = {}
+
+    def addFile(self, folder, name):
+        # Registers a file that is not in its folder right now (e.g. a quarantined one)
+        if folder == STREE_FOLDER:
+            record = parseTreeFile(name)
+            self.single_trees.setdefault(record.frame_key, []).append(record)
+        elif folder in (IMAGE_FOLDER, DEPTH_FOLDER):
+            index = self.images if folder == IMAGE_FOLDER else self.depth
+            record = parseFrameFile(name)
+            index.setdefault(record.frame_key, []).append(record)
+
+    @staticmethod
+    def _indexFrames(names):
+        index = {}
+        for name in names:
+            record = parseFrameFile(name)
+            index.setdefault(record.frame_key, []).append(record)
+        return index
+
+    # Single tree queries
+
+    def allSingleTrees(self):
+        return [record for records in self.single_trees.values() for record in records]
+
+    def singleTreesForFrame(self, frame_key):
+        return self.single_trees.get(frame_key, [])
+
+    def singleTreePath(self, record):
+        return os.path.join(self.stree_folder, record.name)
+
+    def discardSingleTree(self, record):
+        records = self.single_trees.get(record.frame_key)
+        if records is None:
+            return
+        records[:] = [r for r in records if r.name != record.name]
+        if not records:
+            del self.single_trees[record.frame_key]
+
+    # Frame queries
+
+    def allPaths(self):
+        # Every image, depth and SingleTree file the catalog holds
+        return ([os.path.join(self.image_folder, r.name) for records in self.images.values() for r in records]
+                + [os.path.join(self.depth_folder, r.name) for records in self.depth.values() for r in records]
+                + [self.singleTreePath(r) for r in self.allSingleTrees()])
+
+    def commonFrames(self):
+        # Frames that have an image, a depth map and at least one single tree mask,
+        # in the order they appear in the Images folder
+        return [key for key in self.images if key in self.depth and key in self.single_trees]
+
+    def unalignedFiles(self):
+        common = set(self.commonFrames())
+        unaligned_image = [r.name for key, records in self.images.items() if key not in common for r in records]
+        unaligned_depth = [r.name for key, records in self.depth.items() if key not in common for r in records]
+        unaligned_stree = [r.name for key, records in self.single_trees.items() if key not in common for r in records]
+        return unaligned_image, unaligned_depth, unaligned_stree
+
+    def discardFrame(self, frame_key):
+        # Returns the image and depth file names the frame had
+        image_names = [r.name for r in self.images.pop(frame_key, [])]
+        depth_names = [r.name for r in self.depth.pop(frame_key, [])]
+        self.single_trees.pop(frame_key, None)
+        self.new_masks.pop(frame_key, None)
+        return image_names, depth_names
+
+    def filterFrames(self, predicate):
+        # Drops every frame whose key does not satisfy predicate, e.g. other shards' frames
+        self.images = {k: v for k, v in self.images.items() if predicate(k)}
+        self.depth = {k: v for k, v in self.depth.items() if predicate(k)}
+        self.single_trees = {k: v for k, v in self.single_trees.items() if predicate(k)}
+
+    def keepFrames(self, frame_keys):
+        keep = set(frame_keys)
+        self.images = {k: v for k, v in self.images.items() if k in keep}
+        self.depth = {k: v for k, v in self.depth.items() if k in keep}
+        self.single_trees = {k: v for k, v in self.single_trees.items() if k in keep}
+
+    def semanticMaskPath(self, frame_key):
+        # Path of the frame's Masks/ image, None when there is none
+        if self.semantic is None:
+            self.semantic = self._indexFrames(scanFolder(self.semantic_folder))
+        records = self.semantic.get(frame_key)
+        return os.path.join(self.semantic_folder, records[0].name) if records else None
+
+    # NewMasks are produced by the pipeline itself, so they are registered as they are written
+
+    def addNewMask(self, frame_key, name):
+        self.new_masks[frame_key] = name
+
+    def clearNewMasks(self):
+        self.new_masks = {}
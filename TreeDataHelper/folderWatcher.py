@@ -0,0 +1,282 @@
+import os
+import time
+import struct
+import select
+import ctypes
+import ctypes.util
+from datasetCatalog import IMAGE_FOLDER, DEPTH_FOLDER, STREE_FOLDER, parseFrameFile, parseTreeFile
+from cocoEngine import PipelineCancelled, Reporter, runPipeline, validateSegmentationFolder
+from cocoWriter import CocoLayout
+
+# Live ingestion while UE is still rendering: Images/, Depth/ and SingleTrees/
+# are watched (inotify, or a polling fallback off Linux) and every frame whose
+# image, depth and SingleTree files have all arrived and stopped changing for
+# SETTLE_SECONDS is handed to an incremental run. The first run writes coco.json
+# with room for more images (cocoWriter.CocoLayout); after that, batches of new
+# frames are appended to it: only their files are decoded, looked up in the
+# manifests and written, from the file lists the watcher already has. A frame
+# that changes or loses a file after it was processed (e.g. a late SingleTree
+# file), a failed run or a coco.json replaced by something else makes the next
+# run a full incremental one, which still only decodes what changed.
+
+WATCHED_FOLDERS = (IMAGE_FOLDER, DEPTH_FOLDER, STREE_FOLDER)
+SETTLE_SECONDS = 5.0
+POLL_SECONDS = 1.0
+
+# <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+# struct inotify_event: wd, mask, cookie, len, then len bytes of name
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class InotifyWatcher:
+    # inotify through ctypes: changes() costs nothing while the folders are quiet,
+    # however many files they hold
+    kind = 'inotify'
+
+    def __init__(self, folders):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        # AttributeError off Linux, openWatcher falls back to polling
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.folders = {}
+        for folder in folders:
+            wd = libc.inotify_add_watch(self.fd, os.fsencode(folder), WATCH_MASK)
+            if wd < 0:
+                error = ctypes.get_errno()
+                os.close(self.fd)
+                raise OSError(error, f"Cannot watch {folder}")
+            self.folders[wd] = folder
+
+    def changes(self, timeout):
+        # (folder, name) of every file touched since the last call, waiting up to
+        # timeout seconds for the first one. None when the kernel queue overflowed
+        # and events were lost, i.e. the caller has to rescan
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        changed = set()
+        if not ready:
+            return changed
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    return None
+                if name and not mask & IN_ISDIR and wd in self.folders:
+                    changed.add((self.folders[wd], os.fsdecode(name)))
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    # Fallback for systems (or network mounts) without inotify: re-lists the
+    # folders every interval and compares size and mtime
+    kind = 'polling'
+
+    def __init__(self, folders, interval=POLL_SECONDS):
+        self.folders = folders
+        self.interval = interval
+        self.snapshot = self._scan()
+
+    def _scan(self):
+        snapshot = {}
+        for folder in self.folders:
+            try:
+                with os.scandir(folder) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_file():
+                                stat = entry.stat()
+                                snapshot[(folder, entry.name)] = (stat.st_size, stat.st_mtime_ns)
+                        except FileNotFoundError:
+                            pass
+            except FileNotFoundError:
+                pass
+        return snapshot
+
+    def changes(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        snapshot = self._scan()
+        changed = {key for key, state in snapshot.items() if self.snapshot.get(key) != state}
+        changed.update(key for key in self.snapshot if key not in snapshot)
+        self.snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+
+def openWatcher(folders, poll=False, interval=POLL_SECONDS):
+    if not poll:
+        try:
+            return InotifyWatcher(folders)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(folders, interval)
+
+
+class FrameTracker:
+    # Which files each frame has in the watched folders and when any of them last
+    # changed (time.monotonic). Frames are ready once they have an image, a depth
+    # image and at least one SingleTree file, and none changed for settle seconds
+    def __init__(self, segmentation_folder, settle=SETTLE_SECONDS):
+        self.root = segmentation_folder
+        self.settle = settle
+        self.parts = {}
+        self.changed_at = {}
+        # changed_at of each frame when it was last handed to a run
+        self.processed = {}
+        self.rescan()
+
+    def rescan(self):
+        # Files that were already there count as changed at their mtime
+        self.parts = {}
+        now = time.monotonic()
+        wall = time.time()
+        for folder in WATCHED_FOLDERS:
+            path = os.path.join(self.root, folder)
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        if not entry.is_file():
+                            continue
+                        mtime = entry.stat().st_mtime
+                    except FileNotFoundError:
+                        continue
+                    key = self._frameKey(folder, entry.name)
+                    self.parts.setdefault(key, {}).setdefault(folder, set()).add(entry.name)
+                    changed = now - max(wall - mtime, 0)
+                    self.changed_at[key] = max(self.changed_at.get(key, changed), changed)
+
+    @staticmethod
+    def _frameKey(folder, name):
+        return parseTreeFile(name).frame_key if folder == STREE_FOLDER else parseFrameFile(name).frame_key
+
+    def update(self, path, name):
+        folder = os.path.basename(path)
+        key = self._frameKey(folder, name)
+        names = self.parts.setdefault(key, {}).setdefault(folder, set())
+        if os.path.isfile(os.path.join(path, name)):
+            names.add(name)
+        else:
+            names.discard(name)
+        self.changed_at[key] = time.monotonic()
+
+    def discard(self, path, name):
+        # A file a run removed itself (rejected or unaligned): its frame does not count as changed
+        key = self._frameKey(os.path.basename(path), name)
+        self.parts.get(key, {}).get(os.path.basename(path), set()).discard(name)
+
+    def complete(self, key):
+        parts = self.parts.get(key, {})
+        return all(parts.get(folder) for folder in WATCHED_FOLDERS)
+
+    def ready(self, now=None):
+        now = time.monotonic() if now is None else now
+        return {key for key in self.parts if self.complete(key) and now - self.changed_at[key] >= self.settle}
+
+    def pending(self, ready):
+        # Ready frames that changed since they were last processed, and processed
+        # frames that lost a file. Processed frames still settling wait for their turn
+        lost = {key for key in self.processed if not self.complete(key)}
+        return lost | {key for key in ready if self.processed.get(key) != self.changed_at[key]}
+
+    def markProcessed(self, ready):
+        self.processed = {key: self.changed_at[key] for key in ready}
+
+    def files(self, keys):
+        # {folder: names} of the frames' files, for PipelineOptions.frame_files
+        files = {folder: [] for folder in WATCHED_FOLDERS}
+        for key in sorted(keys):
+            for folder, names in self.parts.get(key, {}).items():
+                files[folder].extend(sorted(names))
+        return files
+
+
+def watchDataset(segmentation_folder, options, reporter=None, settle=SETTLE_SECONDS, poll=False,
+                 interval=POLL_SECONDS):
+    # Runs the pipeline on the ready frames every time the set of ready frames
+    # changes, until reporter.cancel is set (or Ctrl+C). options must be
+    # incremental, otherwise every run would decode every frame again. With
+    # stable ids and json output, new frames are appended to coco.json (their ids
+    # do not depend on the frames before them); otherwise every run rewrites it
+    reporter = reporter or Reporter()
+    error = validateSegmentationFolder(segmentation_folder)
+    if error:
+        reporter.status(error)
+        return
+    if not options.incremental:
+        reporter.status("Watch mode needs an incremental pipeline")
+        return
+    segmentation_folder = os.path.abspath(segmentation_folder)
+    coco_path = os.path.join(segmentation_folder, "coco.json")
+    appendable = options.stable_ids and options.output == "json" and options.shard is None
+    options.layout = CocoLayout() if appendable else None
+    folders = [os.path.join(segmentation_folder, folder) for folder in WATCHED_FOLDERS]
+    watcher = openWatcher(folders, poll, interval)
+    tracker = FrameTracker(segmentation_folder, settle)
+    reporter.status(f"Watching {segmentation_folder} ({watcher.kind})")
+    # (folder path, name) of the files handed to the last run
+    run_files = set()
+    try:
+        while reporter.cancel is None or not reporter.cancel.is_set():
+            ready = tracker.ready()
+            pending = tracker.pending(ready)
+            if pending:
+                # Only new frames can be appended, changed or lost ones need a full run
+                new = pending - set(tracker.processed)
+                options.append = appendable and new == pending and options.layout.matches(coco_path)
+                options.frames = new if options.append else ready
+                options.frame_files = tracker.files(options.frames)
+                run_files = {(os.path.join(segmentation_folder, folder), name)
+                             for folder, names in options.frame_files.items() for name in names}
+                # Whatever changes during the run makes its frames pending again
+                tracker.markProcessed(ready)
+                try:
+                    runPipeline(segmentation_folder, options, reporter)
+                    if options.append:
+                        reporter.status(f"{len(new)} frames appended, {len(ready)} frames in coco.json, "
+                                        f"watching for more")
+                    else:
+                        reporter.status(f"{len(ready)} frames in coco.json, watching for more")
+                except PipelineCancelled:
+                    # The previous coco.json stays in place
+                    break
+                except Exception as e:
+                    # e.g. a file that was still being written after all; retried when it changes again.
+                    # Frames of a failed append are not in coco.json, so the next run is a full one
+                    if appendable:
+                        options.layout = CocoLayout()
+                    reporter.status(f"Run failed ({e}), waiting for changes")
+            changes = watcher.changes(interval)
+            if changes is None:
+                tracker.rescan()
+                run_files = set()
+                continue
+            for path, name in changes:
+                if (path, name) in run_files and not os.path.isfile(os.path.join(path, name)):
+                    tracker.discard(path, name)
+                else:
+                    tracker.update(path, name)
+            run_files = set()
+    finally:
+        watcher.close()
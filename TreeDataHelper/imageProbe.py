@@ -0,0 +1,65 @@
+import struct
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# JPEG start-of-frame markers that carry the image size (not DHT/JPG/DAC)
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# Markers without a length field
+JPEG_STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8, 0xD9}
+
+
+def _probePng(f):
+    header = f.read(24)
+    if len(header) < 24 or header[12:16] != b'IHDR':
+        return None
+    width, height = struct.unpack('>II', header[16:24])
+    return width, height
+
+def _probeJpeg(f):
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        if not byte:
+            return None
+        if byte != b'\xff':
+            continue
+        marker = f.read(1)
+        # Any number of 0xFF fill bytes may precede a marker
+        while marker == b'\xff':
+            marker = f.read(1)
+        if not marker:
+            return None
+        marker = marker[0]
+        if marker in JPEG_STANDALONE_MARKERS:
+            continue
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length = struct.unpack('>H', length_bytes)[0]
+        if marker in JPEG_SOF_MARKERS:
+            sof = f.read(5)
+            if len(sof) < 5:
+                return None
+            height, width = struct.unpack('>HH', sof[1:5])
+            return width, height
+        f.seek(length - 2, 1)
+
+def probeImageSize(path):
+    # Returns (width, height) from the PNG IHDR or JPEG SOF header without decoding
+    # pixels. Other formats (or headers this cannot parse) fall back to a full decode.
+    with open(path, 'rb') as f:
+        head = f.read(8)
+        f.seek(0)
+        size = None
+        if head == PNG_SIGNATURE:
+            size = _probePng(f)
+        elif head[:2] == b'\xff\xd8':
+            size = _probeJpeg(f)
+    if size is not None:
+        return size
+
+    import cv2
+    img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if img is None:
+        raise ValueError(f"Unable to read image size of {path}")
+    height, width = img.shape[:2]
+    return width, height
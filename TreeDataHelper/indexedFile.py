@@ -0,0 +1,83 @@
+import os
+import json
+import tempfile
+
+# What RunManifest, MaskCache and QuarantineManifest have in common: a JSON
+# index next to coco.json, keyed by paths relative to the segmentation folder
+# and replaced atomically on save, and (for the first two) a data file of
+# appended records that the index points into with (offset, length) spans.
+
+
+def atomicWrite(path, write, mode='w'):
+    # Calls write(f) on a temporary file next to path, then renames it over path
+    folder = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp', dir=folder)
+    try:
+        with os.fdopen(fd, mode) as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+class IndexedFile:
+    # data_suffix: extension of the data file (replacing the index's), None
+    # when there is none. Messages go to reporter.status, or print without one
+    def __init__(self, segmentation_folder, index_path, data_suffix=None, reporter=None):
+        self.root = segmentation_folder
+        self.path = index_path
+        self.data_path = os.path.splitext(index_path)[0] + data_suffix if data_suffix else None
+        self.reporter = reporter
+
+    def status(self, message):
+        if self.reporter is not None:
+            self.reporter.status(message)
+        else:
+            print(message)
+
+    def _key(self, path):
+        return os.path.relpath(path, self.root).replace(os.sep, '/')
+
+    def readIndex(self, description):
+        # The saved index, or None when there is none or it cannot be read
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            self.status(f"Ignoring unreadable {description} {self.path}")
+            return None
+
+    def writeIndex(self, data, indent=None):
+        atomicWrite(self.path, lambda f: json.dump(data, f, indent=indent))
+
+    def dataSize(self):
+        return os.path.getsize(self.data_path) if os.path.exists(self.data_path) else 0
+
+    def spansFit(self, spans):
+        # False when a span points past the end of the data file, i.e. the
+        # index belongs to another data file
+        size = self.dataSize()
+        return all(offset + length <= size for offset, length in spans)
+
+    def compactData(self, spans):
+        # Rewrites the data file with only the (offset, length) spans once the
+        # bytes nothing uses are the larger part of it. Returns the spans' new
+        # offsets in the same order, or None when the file was left as it is
+        spans = list(spans)
+        if self.dataSize() <= 2 * sum(length for _, length in spans):
+            return None
+        offsets = [None] * len(spans)
+
+        def write(out):
+            with open(self.data_path, 'rb') as src:
+                for i in sorted(range(len(spans)), key=lambda i: spans[i][0]):
+                    offset, length = spans[i]
+                    src.seek(offset)
+                    offsets[i] = out.tell()
+                    out.write(src.read(length))
+
+        atomicWrite(self.data_path, write, 'wb')
+        return offsets
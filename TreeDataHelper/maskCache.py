@@ -0,0 +1,180 @@
+import os
+import json
+import time
+from collections import namedtuple
+import cv2
+import numpy as np
+from indexedFile import IndexedFile
+from stageProfiler import COUNTERS
+
+# Persistent cache of decoded SingleTree images, so runs that only change
+# thresholds or bounds skip every PNG decode. A SingleTree image is one flat
+# tree color on black, so it is stored as one bit per pixel (B, G or R not 0)
+# plus the value of the set pixels (fill) and of the others (background), which
+# rebuilds the decode exactly. <name>.bin holds the np.packbits planes back to
+# back and is read through np.memmap, <name>.json indexes them:
+#   {key: {"size", "mtime_ns", "offset", "shape", "count", "fill", "background"}}
+# Keys are paths relative to the segmentation folder; an entry is dropped as
+# soon as its file's size or mtime differs. Images that are not two flat
+# colors get "offset": None and are always decoded.
+
+CACHE_NAME = 'coco_maskcache.json'
+CACHE_VERSION = 1
+
+# count: pixels whose B, G or R is not 0; shape: the decoded image's shape
+CachedMask = namedtuple('CachedMask', ['data_path', 'offset', 'shape', 'count', 'fill', 'background'])
+
+# data_path -> np.memmap of the whole .bin, reopened once it has grown past an entry
+_maps = {}
+
+
+def packImage(img):
+    # (packed plane, count, fill, background) of a decoded uint8 BGR(A) image,
+    # or None when it is not exactly two flat colors
+    if img is None or img.dtype != np.uint8 or img.ndim != 3:
+        return None
+    plane = np.any(img[..., :3], axis=-1)
+    count = int(np.count_nonzero(plane))
+    fill = background = [0] * img.shape[2]
+    if count:
+        pixels = img[plane]
+        if not np.all(pixels == pixels[0]):
+            return None
+        fill = pixels[0].tolist()
+    if count < plane.size and img.shape[2] > 3:
+        # Black pixels only differ in alpha
+        alpha = img[..., 3][~plane]
+        if not np.all(alpha == alpha[0]):
+            return None
+        background = [0, 0, 0, int(alpha[0])]
+    return np.packbits(plane.ravel()), count, fill, background
+
+def _dataView(data_path, end):
+    data = _maps.get(data_path)
+    if data is None or len(data) < end:
+        data = np.memmap(data_path, dtype=np.uint8, mode='r')
+        _maps[data_path] = data
+    return data
+
+def unpackPlane(entry):
+    # (h, w) bool array of the pixels whose B, G or R is not 0
+    h, w = entry.shape[:2]
+    nbytes = (h * w + 7) // 8
+    start = time.perf_counter()
+    data = _dataView(entry.data_path, entry.offset + nbytes)
+    bits = np.unpackbits(data[entry.offset:entry.offset + nbytes], count=h * w)
+    # Paging in and unpacking cannot be told apart, it all counts as decode
+    COUNTERS.addRead(nbytes, 0.0, time.perf_counter() - start)
+    return bits.view(bool).reshape(h, w)
+
+def cachedImage(entry):
+    # The array decodeTree returns for the file
+    plane = unpackPlane(entry).view(np.uint8)
+    # One 0/1 product per channel and a merge is several times faster than a
+    # boolean-indexed assignment into the (h, w, c) array
+    channels = []
+    for fill, background in zip(entry.fill, entry.background):
+        channel = plane * np.uint8((fill - background) % 256)
+        if background:
+            channel += np.uint8(background)
+        channels.append(channel)
+    return cv2.merge(channels)
+
+def cachedCoverage(entry, total_pixels=None):
+    # blackCoverage of the file, from the index alone
+    pixels = entry.shape[0] * entry.shape[1]
+    return (pixels - entry.count) / (total_pixels or pixels)
+
+def cachedObjectMask(entry, black_threshold):
+    # treeObjectMask of the file: every set pixel has the fill color, so the
+    # mask is the plane or nothing
+    if max(entry.fill[:3]) <= black_threshold:
+        return np.zeros(entry.shape[:2], dtype=np.uint8)
+    return unpackPlane(entry).view(np.uint8) * np.uint8(255)
+
+def cachedRgba(entry):
+    # The RGBA array createNewMasks composites (PIL's convert("RGBA"))
+    img = cachedImage(entry)
+    return cv2.cvtColor(img, cv2.COLOR_BGRA2RGBA if img.shape[2] == 4 else cv2.COLOR_BGR2RGBA)
+
+
+class MaskCache(IndexedFile):
+    def __init__(self, segmentation_folder, index_path=None, reporter=None):
+        super().__init__(segmentation_folder, index_path or os.path.join(segmentation_folder, CACHE_NAME),
+                         '.bin', reporter)
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        data = self.readIndex("mask cache")
+        if data is None or data.get('version') != CACHE_VERSION:
+            return
+        entries = data.get('entries', {})
+        if not self.spansFit(self._span(e) for e in entries.values() if e["offset"] is not None):
+            self.status("Mask cache data does not match its index, starting over")
+            return
+        self.entries = entries
+
+    @staticmethod
+    def _span(entry):
+        # (offset, length) of an entry's packed plane in the data file
+        h, w = entry["shape"][:2]
+        return entry["offset"], (h * w + 7) // 8
+
+    def _current(self, path):
+        # Index entry of path if its file is unchanged, else None
+        entry = self.entries.get(self._key(path))
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        if entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+            return None
+        return entry
+
+    def known(self, path):
+        # True when path is cached or known not to be cacheable, i.e. needs no fill
+        return self._current(path) is not None
+
+    def uncacheable(self, paths):
+        # How many of paths are indexed without a plane (not two flat colors), i.e. decoded on every run
+        entries = (self.entries.get(self._key(path)) for path in paths)
+        return sum(1 for entry in entries if entry is not None and entry["offset"] is None)
+
+    def lookup(self, path):
+        # CachedMask of path, or None when it has to be decoded
+        entry = self._current(path)
+        if entry is None or entry["offset"] is None:
+            return None
+        return CachedMask(self.data_path, entry["offset"], tuple(entry["shape"]), entry["count"],
+                          entry["fill"], entry["background"])
+
+    def store(self, path, img):
+        stat = os.stat(path)
+        entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "offset": None}
+        packed = packImage(img)
+        if packed is not None:
+            bits, count, fill, background = packed
+            with open(self.data_path, 'ab') as f:
+                offset = f.tell()
+                f.write(bits.tobytes())
+            COUNTERS.addWrite(bits.nbytes)
+            entry.update(offset=offset, shape=list(img.shape), count=count, fill=fill, background=background)
+        self.entries[self._key(path)] = entry
+
+    def prune(self, paths):
+        # Drops the entries of files that are no longer in the dataset
+        keep = {self._key(path) for path in paths}
+        self.entries = {key: entry for key, entry in self.entries.items() if key in keep}
+
+    def save(self):
+        stored = [e for e in self.entries.values() if e["offset"] is not None]
+        # The file must not stay mapped in case compactData replaces it (Windows)
+        _maps.pop(self.data_path, None)
+        offsets = self.compactData(self._span(e) for e in stored)
+        if offsets is not None:
+            for entry, offset in zip(stored, offsets):
+                entry["offset"] = offset
+        self.writeIndex({'version': CACHE_VERSION, 'entries': self.entries})
@@ -0,0 +1,490 @@
+import os
+import time
+import numpy as np
+import cv2
+from PIL import Image
+from collections import deque, namedtuple
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from stageProfiler import COUNTERS
+from cocoRle import encodeMask, encodeRoi
+from maskCache import cachedImage, cachedObjectMask
+from datasetCatalog import parseTreeFile
+
+# Color every non-black SingleTree pixel is recolored to before contour extraction
+TREE_RGB = [245, 155, 66]
+BLACK_THRESHOLD = 5
+
+# A SingleTree mask is kept when its black coverage is within these bounds
+COVERAGE_MIN = 0.2
+COVERAGE_MAX = 0.99
+
+# How an annotation's "segmentation" is written: contour polygons, or COCO
+# compressed RLE of the tree mask (area is then the mask's pixel count)
+SEGMENTATION_MODES = ('polygon', 'rle')
+
+# Optional polygon simplification: Douglas-Peucker (cv2.approxPolyDP) with
+# tolerance pixels, then, for contours still above max_vertices (None = no cap),
+# the smallest tolerance that gets them under it. Polygons are never simplified
+# below MIN_VERTICES; RLE segmentations are not affected
+Simplification = namedtuple('Simplification', ['tolerance', 'max_vertices'])
+MIN_VERTICES = 3
+# Halvings of the tolerance range when searching for the max_vertices tolerance
+CAP_SEARCH_STEPS = 8
+
+
+def coverageBounds(bounds=None):
+    # bounds is (min, max); None or a None bound falls back to the defaults above
+    low, high = bounds or (None, None)
+    low = COVERAGE_MIN if low is None else low
+    high = COVERAGE_MAX if high is None else high
+    return low, high
+
+def isValidCoverage(percentage, bounds=None):
+    low, high = coverageBounds(bounds)
+    return not ((percentage < low) or (percentage > high))
+
+
+def readImage(path, flags=cv2.IMREAD_COLOR):
+    # cv2.imread split into a raw read and cv2.imdecode, so the profiler can
+    # tell disk time from decode time
+    start = time.perf_counter()
+    raw = np.fromfile(path, dtype=np.uint8)
+    read_done = time.perf_counter()
+    img = cv2.imdecode(raw, flags)
+    COUNTERS.addRead(raw.nbytes, read_done - start, time.perf_counter() - read_done)
+    return img
+
+def readPilImage(path):
+    from io import BytesIO
+    start = time.perf_counter()
+    with open(path, 'rb') as f:
+        raw = f.read()
+    read_done = time.perf_counter()
+    img = Image.open(BytesIO(raw))
+    img.load()
+    COUNTERS.addRead(len(raw), read_done - start, time.perf_counter() - read_done)
+    return img
+
+def prefetchImages(paths, flags=cv2.IMREAD_COLOR, io_threads=0, depth=None):
+    # Yields (path, image) in the order of paths. With io_threads, up to depth
+    # images (default 2 per thread) are read and decoded ahead on threads while
+    # the caller works on the current one; np.fromfile and cv2.imdecode release
+    # the GIL. Nothing new is started until the caller takes an image, so depth
+    # also caps how many decoded images sit in memory.
+    if io_threads <= 0:
+        for path in paths:
+            yield path, readImage(path, flags)
+        return
+
+    depth = max(1, depth or io_threads * 2)
+    paths = iter(paths)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=io_threads) as pool:
+        for path in paths:
+            pending.append((path, pool.submit(readImage, path, flags)))
+            if len(pending) == depth:
+                break
+        while pending:
+            path, future = pending.popleft()
+            img = future.result()
+            for next_path in paths:
+                pending.append((next_path, pool.submit(readImage, next_path, flags)))
+                break
+            yield path, img
+
+def savePng(array, mode, path):
+    Image.fromarray(array, mode).save(path)
+    COUNTERS.addWrite(os.path.getsize(path))
+
+def filterMask(separated_mask, RGB):
+    return recolorMask(np.array(readImage(separated_mask)), RGB)
+
+def recolorMask(img, RGB):
+    # Paints every non-black pixel of a decoded SingleTree image in RGB, in place
+    black_threshold = [5,5,5]
+    non_black_mask = np.any(img > black_threshold, axis=-1)
+    img[non_black_mask] = RGB
+    # cv2.imwrite('Filter.png', img)
+    return img
+
+def getSegmentation(img_mask, RGB, img_path=None, segmentation='polygon', simplify=None):
+    rgb = np.array(RGB, dtype="uint8")
+    object_mask = cv2.inRange(img_mask, rgb, rgb)
+    return segmentObjectMask(object_mask, img_path, segmentation, simplify=simplify)
+
+def segmentObjectMask(object_mask, img_path=None, segmentation='polygon', offset=(0, 0), frame_size=None,
+                      simplify=None):
+    # object_mask may be a crop of the frame: offset is its (x, y) position and
+    # frame_size the frame's (height, width), so results are in frame coordinates.
+    # simplify: a Simplification for the polygon, None keeps every contour point
+    contours = cv2.findContours(object_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_TC89_KCOS, offset=offset)
+    contours = contours[0] if len(contours) == 2 else contours[1]
+
+    if not contours:
+        # print(f"{img_path} have no trees!")
+        return []
+
+    if len(contours) != 1:
+        # print(f"{img_path} may contain excessive branch!")
+        return []
+
+    contour = contours[0]
+    # The bbox is always the tree's, also when the polygon is simplified
+    list_poly = [cv2.boundingRect(contour)]
+    if segmentation == 'rle':
+        if frame_size is None:
+            list_poly.append(encodeMask(object_mask))
+        else:
+            list_poly.append(encodeRoi(object_mask > 0, offset, frame_size))
+        list_poly.append(int(np.count_nonzero(object_mask)))
+    else:
+        if simplify is not None:
+            simplified = simplifyContour(contour, simplify)
+            COUNTERS.addSimplified(len(contour), len(simplified),
+                                   maskIou(object_mask, simplified, list_poly[0], offset))
+            contour = simplified
+        # (n, 1, 2) points -> [x0, y0, x1, y1, ...]
+        list_poly.append([contour.reshape(-1).tolist()])
+        list_poly.append(cv2.contourArea(contour))
+
+    return list_poly
+
+def simplifyContour(contour, simplify):
+    # Simplified copy of an (n, 1, 2) contour, or the contour itself when a zero
+    # tolerance leaves nothing to do (it is already under max_vertices)
+    if simplify.tolerance == 0 and (not simplify.max_vertices or len(contour) <= simplify.max_vertices):
+        return contour
+    simplified = cv2.approxPolyDP(contour, simplify.tolerance, True)
+    if simplify.max_vertices and len(simplified) > simplify.max_vertices:
+        # approxPolyDP keeps fewer points the larger the tolerance: double it
+        # until the cap holds, then narrow down to the smallest one that does
+        low, high = simplify.tolerance, max(2 * simplify.tolerance, 1.0)
+        capped = cv2.approxPolyDP(contour, high, True)
+        while len(capped) > simplify.max_vertices:
+            low, high = high, high * 2
+            capped = cv2.approxPolyDP(contour, high, True)
+        for _ in range(CAP_SEARCH_STEPS):
+            middle = (low + high) / 2
+            candidate = cv2.approxPolyDP(contour, middle, True)
+            if len(candidate) > simplify.max_vertices:
+                low = middle
+            else:
+                high, capped = middle, candidate
+        simplified = capped
+    if len(simplified) < MIN_VERTICES:
+        simplified = contour
+    return simplified
+
+def maskIou(object_mask, polygon, bbox, offset=(0, 0)):
+    # IoU of the pixels a polygon covers with the object mask it was traced from.
+    # bbox is the traced contour's (frame coordinates): it holds every mask pixel
+    # and, as simplification only drops contour points, the whole polygon
+    x, y, w, h = bbox
+    left, top = x - offset[0], y - offset[1]
+    source = object_mask[top:top + h, left:left + w] > 0
+    filled = np.zeros((h, w), dtype=np.uint8)
+    cv2.fillPoly(filled, [polygon], 1, offset=(-x, -y))
+    filled = filled > 0
+    union = np.count_nonzero(source | filled)
+    return np.count_nonzero(source & filled) / union if union else 1.0
+
+def extractTreePoly(image_path, segmentation='polygon', simplify=None):
+    new_mask = filterMask(image_path, TREE_RGB)
+    return getSegmentation(new_mask, TREE_RGB, image_path, segmentation, simplify)
+
+
+# Fused single-decode stage
+
+def decodeTree(path):
+    # Keeps the alpha channel for compositing; BGR(A) like every other cv2 decode here
+    return treeImage(readImage(path, cv2.IMREAD_UNCHANGED))
+
+def treeImage(img):
+    # An IMREAD_UNCHANGED decode as decodeTree returns it
+    if img is not None and img.ndim == 2:
+        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    return img
+
+def blackCoverage(img, total_pixels=None):
+    # Share of pixels whose B, G and R are all 0; total_pixels=None uses the
+    # decoded image's own size
+    pixels = img.shape[0] * img.shape[1]
+    return (pixels - cv2.countNonZero(channelMax(img))) / (total_pixels or pixels)
+
+def treeObjectMask(img):
+    # Same pixels filterMask + inRange select, without the recoloring round trip
+    return np.any(img[..., :3] > BLACK_THRESHOLD, axis=-1).astype(np.uint8) * 255
+
+def compositeTrees(imgs):
+    # RGBA composite matching createNewMasks: later trees are painted over earlier ones
+    combined = np.zeros(imgs[0].shape[:2] + (4,), dtype=np.uint8)
+    combined[..., 3] = 255
+    for img in imgs:
+        code = cv2.COLOR_BGRA2RGBA if img.shape[2] == 4 else cv2.COLOR_BGR2RGBA
+        np.copyto(combined, cv2.cvtColor(img, code), where=np.any(img[..., :3] != 0, axis=-1)[..., None])
+    return combined
+
+def instanceValue(name):
+    # Instance map value of a SingleTree file: its tree id + 1, 0 is background
+    value = int(parseTreeFile(name).tree_id) + 1
+    if value > np.iinfo(np.uint16).max:
+        raise ValueError(f"Tree id of {name} does not fit an uint16 instance map")
+    return value
+
+def instanceMap(names, imgs):
+    # uint16 label map of a frame, painted in the same order as compositeTrees,
+    # so it shows which tree is visible at every pixel
+    values = [instanceValue(name) for name in names]
+    if len(set(values)) != len(values):
+        raise ValueError(f"Duplicate tree ids in frame: {', '.join(names)}")
+    id_map = np.zeros(imgs[0].shape[:2], dtype=np.uint16)
+    for value, img in zip(values, imgs):
+        id_map[channelMax(img) > BLACK_THRESHOLD] = value
+    return id_map
+
+def channelMax(img):
+    # Per-pixel max of B, G and R; cv2 on split planes is an order of magnitude
+    # faster than np.any/np.max over the interleaved channel axis
+    b, g, r = cv2.split(img)[:3]
+    return cv2.max(cv2.max(b, g), r)
+
+def instanceBoxes(id_map):
+    # One pass over the map: {value: ((x, y, w, h), pixel count)} of every instance
+    ys, xs = np.nonzero(id_map)
+    values = id_map[ys, xs]
+    order = np.argsort(values, kind='stable')
+    values, xs, ys = values[order], xs[order], ys[order]
+    if len(values) == 0:
+        return {}
+    uniq, starts, counts = np.unique(values, return_index=True, return_counts=True)
+    x0 = np.minimum.reduceat(xs, starts)
+    y0 = np.minimum.reduceat(ys, starts)
+    x1 = np.maximum.reduceat(xs, starts)
+    y1 = np.maximum.reduceat(ys, starts)
+    return {int(v): ((int(a), int(b), int(c - a + 1), int(d - b + 1)), int(n))
+            for v, a, b, c, d, n in zip(uniq, x0, y0, x1, y1, counts)}
+
+def instancePolys(id_map, names, segmentation='polygon', simplify=None):
+    # Contours of every instance, each limited to its bbox plus one pixel of
+    # background so they come out as on the full frame. Trees that are hidden
+    # completely or split in several visible parts get [] like in segmentObjectMask
+    height, width = id_map.shape
+    boxes = instanceBoxes(id_map)
+    polys = []
+    for name in names:
+        value = instanceValue(name)
+        if value not in boxes:
+            polys.append([])
+            continue
+        (x, y, w, h), _ = boxes[value]
+        x0, y0 = max(x - 1, 0), max(y - 1, 0)
+        x1, y1 = min(x + w + 1, width), min(y + h + 1, height)
+        roi = (id_map[y0:y1, x0:x1] == value).astype(np.uint8) * 255
+        polys.append(segmentObjectMask(roi, segmentation=segmentation, offset=(x0, y0), frame_size=(height, width),
+                                       simplify=simplify))
+    return polys
+
+def saveLabelPng(array, path):
+    # 16-bit PNG through OpenCV, PIL has no reliable uint16 writer
+    ok, buf = cv2.imencode('.png', array)
+    if not ok:
+        raise IOError(f"Could not encode {path}")
+    buf.tofile(path)
+    COUNTERS.addWrite(buf.nbytes)
+
+def processFrame(tree_paths, total_pixels=None, mask_path=None, bounds=None, segmentation='polygon',
+                 instance_map=False, map_path=None, entries=None, simplify=None):
+    # Decodes every SingleTree file of a frame once and runs the coverage filter,
+    # compositing and contour extraction on that single decode.
+    # With instance_map, trees are segmented from the frame's instance map
+    # (visible pixels only), which is written to map_path when given.
+    # entries: maskCache.CachedMask (or None) per path, rebuilt instead of decoded.
+    # Returns ((height, width) or None, [(name, percentage, list_poly)], [(name, percentage)]);
+    # files that cannot be decoded are rejected with a percentage of None
+    kept = []
+    rejected = []
+    for path, entry in zip(tree_paths, entries or [None] * len(tree_paths)):
+        img = cachedImage(entry) if entry is not None else decodeTree(path)
+        if img is None:
+            rejected.append((os.path.basename(path), None))
+            continue
+        percentage = blackCoverage(img, total_pixels)
+        if not isValidCoverage(percentage, bounds):
+            rejected.append((os.path.basename(path), percentage))
+            continue
+        kept.append((os.path.basename(path), percentage, img))
+
+    if not kept:
+        return None, [], rejected
+
+    if mask_path:
+        savePng(compositeTrees([img for _, _, img in kept]), "RGBA", mask_path)
+    size = kept[0][2].shape[:2]
+    if instance_map:
+        names = [name for name, _, _ in kept]
+        id_map = instanceMap(names, [img for _, _, img in kept])
+        if map_path:
+            saveLabelPng(id_map, map_path)
+        polys = instancePolys(id_map, names, segmentation, simplify)
+        tree_polys = [(name, percentage, list_poly) for (name, percentage, _), list_poly in zip(kept, polys)]
+    else:
+        tree_polys = [(name, percentage, segmentObjectMask(treeObjectMask(img), segmentation=segmentation,
+                                                           simplify=simplify))
+                      for name, percentage, img in kept]
+    return size, tree_polys, rejected
+
+def processFrames(frame_tasks, total_pixels, workers=1, bounds=None, segmentation='polygon', instance_map=False,
+                  simplify=None):
+    # frame_tasks is a list of (tree_paths, mask_path, map_path, entries); results come back in the same order
+    task = partial(_processFrameTask, total_pixels=total_pixels, bounds=bounds, segmentation=segmentation,
+                   instance_map=instance_map, simplify=simplify)
+    return orderedMap(task, frame_tasks, workers)
+
+def _processFrameTask(task, total_pixels, bounds=None, segmentation='polygon', instance_map=False, simplify=None):
+    tree_paths, mask_path, map_path, entries = task
+    return processFrame(tree_paths, total_pixels, mask_path, bounds, segmentation, instance_map, map_path, entries,
+                        simplify)
+
+def fusedSettings(total_pixels=None, segmentation='polygon', instance_map=False, simplify=None, categories=None):
+    # Everything cached fused results depend on (coverage bounds are applied on
+    # read, so changing them does not invalidate a manifest). categories is a
+    # categoryMasks.CategoryTable, whose Masks/ results share the manifest
+    settings = {"black_threshold": BLACK_THRESHOLD, "total_pixels": total_pixels, "contours": "external_tc89_kcos",
+                "segmentation": segmentation, "instance_map": instance_map,
+                "simplify": list(simplify) if simplify is not None else None}
+    if categories is not None:
+        from categoryMasks import tableSettings
+        settings["categories"] = tableSettings(categories)
+    return settings
+
+def _cachedFrame(tree_paths, mask_path, manifest, bounds=None, map_path=None):
+    # (size, [(name, percentage, path)], [(name, percentage)]) of a frame whose
+    # results are all in the manifest, None when it has to be decoded. Kept trees
+    # carry their path: their polygons stay in the manifest's data file until
+    # the frame is yielded
+    results = []
+    for path in tree_paths:
+        result = manifest.lookup(path)
+        if result is None:
+            return None
+        # Previously rejected trees (stored without a size) that now pass the coverage bounds were never segmented
+        if result["size"] is None and isValidCoverage(result["coverage"], bounds):
+            return None
+        results.append((path, result))
+
+    kept = [(os.path.basename(path), r["coverage"], path) for path, r in results
+            if isValidCoverage(r["coverage"], bounds)]
+    rejected = [(os.path.basename(path), r["coverage"]) for path, r in results
+                if not isValidCoverage(r["coverage"], bounds)]
+    if not kept:
+        return None, [], rejected
+    if mask_path and not os.path.exists(mask_path):
+        return None
+    if map_path and not os.path.exists(map_path):
+        return None
+    size = tuple(next(r["size"] for _, r in results if isValidCoverage(r["coverage"], bounds)))
+    return size, kept, rejected
+
+def iterFusedFrames(frames, total_pixels=None, workers=1, manifest=None, bounds=None, segmentation='polygon',
+                    instance_map=False, mask_cache=None, simplify=None, reporter=None):
+    # frames is a list of (label, tree_paths, mask_path, map_path). Yields
+    # (label, size, [(name, percentage, list_poly)], [(name, percentage)]) in
+    # order. With a RunManifest, frames whose SingleTree files are all unchanged
+    # come from the cache and only the rest are decoded. With a MaskCache,
+    # those are rebuilt from it instead. reporter (optional) gets the cache summary.
+    cached = {}
+    tasks = []
+    for i, (label, tree_paths, mask_path, map_path) in enumerate(frames):
+        hit = _cachedFrame(tree_paths, mask_path, manifest, bounds, map_path) if manifest is not None else None
+        if hit is None:
+            entries = [mask_cache.lookup(path) for path in tree_paths] if mask_cache is not None else None
+            tasks.append((tree_paths, mask_path, map_path, entries))
+        else:
+            cached[i] = hit
+    if manifest is not None:
+        message = f"{len(cached)} frames reused from the manifest, {len(tasks)} to process"
+        if reporter is not None:
+            reporter.status(message)
+        else:
+            print(message)
+
+    results = processFrames(tasks, total_pixels, workers, bounds, segmentation, instance_map, simplify)
+    for i, (label, tree_paths, mask_path, map_path) in enumerate(frames):
+        if i in cached:
+            size, kept, rejected = cached.pop(i)
+            kept = [(name, percentage, manifest.readPayload(path)) for name, percentage, path in kept]
+        else:
+            size, kept, rejected = next(results)
+            if manifest is not None:
+                folder = os.path.dirname(tree_paths[0]) if tree_paths else ''
+                for name, percentage, list_poly in kept:
+                    manifest.store(os.path.join(folder, name), {"coverage": percentage, "size": list(size)}, list_poly)
+                # Unreadable files are not cached, so they are read again once rewritten
+                for name, percentage in rejected:
+                    if percentage is None:
+                        continue
+                    manifest.store(os.path.join(folder, name), {"coverage": percentage, "size": None})
+        yield label, size, kept, rejected
+
+
+def resolveWorkers(workers):
+    # 0 or a negative number means "use every core"
+    if workers is None:
+        return 1
+    if workers <= 0:
+        return os.cpu_count() or 1
+    return workers
+
+def _countedCall(func, item):
+    # Runs one task in a worker and sends its I/O counters back with the result
+    COUNTERS.reset()
+    start = time.perf_counter()
+    result = func(item)
+    COUNTERS.task_seconds += time.perf_counter() - start
+    return result, COUNTERS.snapshot()
+
+def orderedMap(func, items, workers=1):
+    # Yields func(item) in the same order as items, so whatever is built from
+    # the results does not depend on the number of workers
+    workers = resolveWorkers(workers)
+    if workers == 1 or len(items) < 2:
+        for item in items:
+            start = time.perf_counter()
+            result = func(item)
+            COUNTERS.task_seconds += time.perf_counter() - start
+            yield result
+        return
+
+    chunksize = max(1, min(64, len(items) // (workers * 8)))
+    pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        for result, counters in pool.map(partial(_countedCall, func), items, chunksize=chunksize):
+            COUNTERS.merge(counters)
+            yield result
+    finally:
+        # A consumer that stops early (e.g. a cancelled run) does not wait for the queued tasks
+        pool.shutdown(cancel_futures=True)
+
+def extractTreePolys(image_paths, workers=1, io_threads=0, prefetch=None, segmentation='polygon', mask_cache=None,
+                     simplify=None):
+    # A serial run can hide its reads behind contour extraction with prefetch
+    # threads; a process pool already overlaps them across workers.
+    # Files in mask_cache are segmented from their cached plane, without a decode
+    if mask_cache is not None:
+        items = [(path, mask_cache.lookup(path)) for path in image_paths]
+        return orderedMap(partial(_cachedTreePoly, segmentation=segmentation, simplify=simplify), items, workers)
+    if resolveWorkers(workers) == 1 and io_threads > 0:
+        return _prefetchedTreePolys(image_paths, io_threads, prefetch, segmentation, simplify)
+    return orderedMap(partial(extractTreePoly, segmentation=segmentation, simplify=simplify), image_paths, workers)
+
+def _cachedTreePoly(item, segmentation='polygon', simplify=None):
+    path, entry = item
+    if entry is None:
+        return extractTreePoly(path, segmentation, simplify)
+    # Same pixels as extractTreePoly's recolor + inRange
+    return segmentObjectMask(cachedObjectMask(entry, BLACK_THRESHOLD), path, segmentation, simplify=simplify)
+
+def _prefetchedTreePolys(image_paths, io_threads, prefetch, segmentation='polygon', simplify=None):
+    for path, img in prefetchImages(image_paths, io_threads=io_threads, depth=prefetch):
+        yield getSegmentation(recolorMask(img, TREE_RGB), TREE_RGB, path, segmentation, simplify)
@@ -0,0 +1,110 @@
+import os
+from indexedFile import IndexedFile
+
+QUARANTINE_NAME = 'coco_quarantine.json'
+QUARANTINE_FOLDER = 'Quarantine'
+QUARANTINE_VERSION = 1
+
+
+class QuarantineManifest(IndexedFile):
+    # Non-destructive replacement for deleting the files the filters reject.
+    # Every rejected file is recorded with its reason and black coverage so later
+    # stages skip it, and the coverage of every SingleTree file is kept so a run
+    # with other coverage bounds decides from the manifest alone:
+    #   {"settings": {...}, "coverage": {key: percentage}, "moved": [key, ...],
+    #    "rejected": {key: {"reason": str, "coverage": percentage or None}}}
+    # Keys are paths relative to the segmentation folder. With move, apply()
+    # moves the rejected files into Quarantine/<folder>/ in one batch and moves
+    # back the ones that pass again.
+    # Cached coverage is trusted without a stat; delete the manifest after
+    # overwriting exported files in place.
+    def __init__(self, segmentation_folder, settings=None, move=False, manifest_path=None, reporter=None):
+        super().__init__(segmentation_folder, manifest_path or os.path.join(segmentation_folder, QUARANTINE_NAME),
+                         reporter=reporter)
+        self.settings = settings or {}
+        self.move = move
+        self.coverages = {}
+        self.moved = set()
+        # Decisions are remade on every run, only coverage and file locations carry over
+        self.rejected = {}
+        # With limitTo, the previous decisions about the other files are kept
+        self.previous = {}
+        self.scope = None
+        self.load()
+
+    def load(self):
+        data = self.readIndex("quarantine manifest")
+        if data is None:
+            return
+        if data.get('version') != QUARANTINE_VERSION:
+            return
+        # Moved files are where they are whatever the settings
+        self.moved = set(data.get('moved', []))
+        if data.get('settings') != self.settings:
+            self.status("Quarantine settings changed, recomputing every coverage")
+            return
+        self.coverages = data.get('coverage', {})
+        self.previous = data.get('rejected', {})
+
+    def limitTo(self, paths):
+        # Runs that only handle some files (folderWatcher's appends) only decide
+        # about, move and restore those; the others keep their previous decisions
+        self.scope = {self._key(path) for path in paths}
+
+    def save(self):
+        rejected = self.rejected
+        if self.scope is not None:
+            rejected = {key: r for key, r in self.previous.items() if key not in self.scope}
+            rejected.update(self.rejected)
+        self.writeIndex({'version': QUARANTINE_VERSION, 'settings': self.settings, 'coverage': self.coverages,
+                         'moved': sorted(self.moved), 'rejected': rejected}, indent=1)
+
+    def _sourcePath(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def _quarantinePath(self, key):
+        return os.path.join(self.root, QUARANTINE_FOLDER, *key.split('/'))
+
+    def locate(self, path):
+        # Where path currently is on disk
+        key = self._key(path)
+        return self._quarantinePath(key) if key in self.moved else path
+
+    def movedFiles(self):
+        # (folder, name) of every file a previous run moved away
+        return [tuple(key.split('/', 1)) for key in sorted(self.moved)]
+
+    def coverage(self, path):
+        return self.coverages.get(self._key(path))
+
+    def setCoverage(self, path, percentage):
+        self.coverages[self._key(path)] = percentage
+
+    def reject(self, path, reason, percentage=None):
+        key = self._key(path)
+        if percentage is None:
+            percentage = self.coverages.get(key)
+        self.rejected[key] = {'reason': reason, 'coverage': percentage}
+
+    def apply(self):
+        # Brings the files on disk in line with this run's decisions and saves.
+        # Returns (moved, restored) counts
+        to_restore = [key for key in sorted(self.moved)
+                      if key not in self.rejected and (self.scope is None or key in self.scope)]
+        to_move = [key for key in self.rejected if key not in self.moved] if self.move else []
+        made = set()
+        try:
+            for key in to_restore:
+                os.replace(self._quarantinePath(key), self._sourcePath(key))
+                self.moved.discard(key)
+            for key in to_move:
+                target = self._quarantinePath(key)
+                folder = os.path.dirname(target)
+                if folder not in made:
+                    os.makedirs(folder, exist_ok=True)
+                    made.add(folder)
+                os.replace(self._sourcePath(key), target)
+                self.moved.add(key)
+        finally:
+            self.save()
+        return len(to_move), len(to_restore)
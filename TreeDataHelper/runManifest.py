@@ -0,0 +1,114 @@
+import os
+import json
+import hashlib
+from indexedFile import IndexedFile
+
+MANIFEST_NAME = 'coco_manifest.json'
+MANIFEST_VERSION = 2
+
+
+def fileHash(path, chunk_size=1 << 20):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class RunManifest(IndexedFile):
+    # Remembers per-file results between runs so only new or changed files are
+    # recomputed. Entries are keyed by path relative to the segmentation folder:
+    #   {"size": bytes, "mtime": ns, "hash": optional, "result": {...}, "payload": [offset, length]}
+    # A file is unchanged when size and mtime match; with use_hash a size/mtime
+    # mismatch is settled by comparing content hashes (e.g. after a copy).
+    # settings describes everything the results depend on; when it differs from
+    # the stored one, all cached results are dropped.
+    # Results are small and stay in the index (<name>.json); the bulky part of
+    # a result (e.g. polygons) is an optional payload, appended as JSON to
+    # <name>.data and only read back by readPayload, so neither a run nor save()
+    # holds every cached polygon. save() drops the payloads no entry uses from
+    # the data file once they are the larger part of it (IndexedFile.compactData).
+    def __init__(self, segmentation_folder, settings=None, use_hash=False, manifest_path=None, reporter=None):
+        super().__init__(segmentation_folder, manifest_path or os.path.join(segmentation_folder, MANIFEST_NAME),
+                         '.data', reporter)
+        self.settings = settings or {}
+        self.use_hash = use_hash
+        self.entries = {}
+        self.writer = None
+        self.reader = None
+        self.load()
+
+    def load(self):
+        data = self.readIndex("manifest")
+        if data is None:
+            return
+        if data.get('version') != MANIFEST_VERSION or data.get('settings') != self.settings:
+            self.status("Manifest settings changed, recomputing every file")
+            return
+        entries = data.get('entries', {})
+        if not self.spansFit(e['payload'] for e in entries.values() if e.get('payload')):
+            self.status("Manifest data does not match its index, recomputing every file")
+            return
+        self.entries = entries
+
+    def save(self):
+        self._closeFiles()
+        stored = [e for e in self.entries.values() if e.get('payload')]
+        offsets = self.compactData(e['payload'] for e in stored)
+        if offsets is not None:
+            for entry, offset in zip(stored, offsets):
+                entry['payload'] = [offset, entry['payload'][1]]
+        self.writeIndex({'version': MANIFEST_VERSION, 'settings': self.settings, 'entries': self.entries})
+
+    def _closeFiles(self):
+        for f in (self.writer, self.reader):
+            if f is not None:
+                f.close()
+        self.writer = self.reader = None
+
+    def lookup(self, path):
+        # Returns the cached result for path, or None when it is new or changed
+        entry = self.entries.get(self._key(path))
+        if entry is None:
+            return None
+        stat = os.stat(path)
+        if entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+            return entry['result']
+        if self.use_hash and entry.get('hash') and entry['size'] == stat.st_size and entry['hash'] == fileHash(path):
+            entry['mtime'] = stat.st_mtime_ns
+            return entry['result']
+        return None
+
+    def readPayload(self, path):
+        # The payload stored with path's result (after lookup() found it), or None
+        location = self.entries[self._key(path)].get('payload')
+        if location is None:
+            return None
+        if self.writer is not None:
+            self.writer.flush()
+        if self.reader is None:
+            self.reader = open(self.data_path, 'rb')
+        offset, length = location
+        self.reader.seek(offset)
+        return json.loads(self.reader.read(length))
+
+    def store(self, path, result, payload=None):
+        stat = os.stat(path)
+        entry = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'result': result}
+        if self.use_hash:
+            entry['hash'] = fileHash(path)
+        if payload is not None:
+            if self.writer is None:
+                self.writer = open(self.data_path, 'ab')
+            data = json.dumps(payload).encode()
+            entry['payload'] = [self.writer.tell(), len(data)]
+            self.writer.write(data)
+        self.entries[self._key(path)] = entry
+
+    def discard(self, path):
+        self.entries.pop(self._key(path), None)
+
+    def prune(self, paths):
+        # Drops entries of files that are no longer part of the dataset
+        keep = {self._key(path) for path in paths}
+        self.entries = {k: v for k, v in self.entries.items() if k in keep}
@@ -1,39 +1,88 @@
-import maya.cmds as cmds
+try:
+    import maya.cmds as cmds
+except ImportError:
+    # Outside Maya (e.g. tests) pass a stub with ls, listConnections and sets as cmds_module
+    cmds = None
 
-def select_by_material(material):
-    shading_groups = cmds.ls(cmds.listConnections(material), type='shadingEngine')
-    print(shading_groups)
-    faces_to_select = []
-    
-    for sg in shading_groups:
-        connections = cmds.listConnections(sg + ".dagSetMembers", type='mesh')
-        
-        for conn in connections:
-            # Ensure we get the long name to avoid duplicates and ensure uniqueness
-            full_path = cmds.ls(conn, long=True)[0]
-            faces = cmds.sets(sg, query=True) or []
-            for face in faces:
-                open_b_idx = face.index('[')
-                clos_b_idx = face.index(']')
-                face_idxes_int = [int(idx) for idx in face[open_b_idx+1:clos_b_idx].split(':')]
-                for i in range(face_idxes_int[0], face_idxes_int[1] + 1):
-                    face_path = full_path + '.f[' + str(i) + ']'
-                    faces_to_select.append(face_path)
-    return faces_to_select
-   
-                    
+# Face members of a shading group come back from cmds.sets as compact
+# components ("mesh.f[10:2000]", "mesh.f[7]", or the bare mesh when every face
+# uses the material). They are kept as merged (start, end) ranges per mesh and
+# handed back in the same compact form, so a 2M-face asset selects through a
+# handful of strings instead of one per face.
 
-trunk = select_by_material('betula_bark_a_ncl1_2')
-#leaves = select_by_material('MaterialFBXASC032FBXASC035266796055')
+ALL_FACES = None
 
-#cmds.select('Brich_01.f[*]')
-#cmds.select(leaves, deselect=True)
-#cmds.select(small_branches, deselect=True)
-cmds.select(trunk)
 
+def parse_face_member(member):
+    # "node.f[a:b]" -> (node, (a, b)); "node.f[a]" -> (node, (a, a));
+    # "node" or "node.f[*]" -> (node, ALL_FACES)
+    if '.f[' not in member:
+        return member, ALL_FACES
+    node, indices = member.split('.f[', 1)
+    indices = indices.rstrip(']')
+    if indices == '*':
+        return node, ALL_FACES
+    start, _, end = indices.partition(':')
+    return node, (int(start), int(end or start))
 
 
+def merge_ranges(ranges):
+    # Sorted, non-overlapping ranges; touching ones (5:9 and 10:12) are joined
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [tuple(r) for r in merged]
 
 
+def face_ranges_by_material(materials, cmds_module=None):
+    # {long mesh name: merged ranges, or ALL_FACES} of every face using one of materials
+    mc = cmds_module or cmds
+    if isinstance(materials, str):
+        materials = [materials]
+    shading_groups = mc.ls(mc.listConnections(materials) or [], type='shadingEngine') or []
 
-    
\ No newline at end of file
+    ranges = {}
+    for sg in sorted(set(shading_groups)):
+        for member in mc.sets(sg, query=True) or []:
+            node, face_range = parse_face_member(member)
+            ranges.setdefault(node, []).append(face_range)
+
+    by_mesh = {}
+    for node, node_ranges in ranges.items():
+        # Long names so a mesh listed under its short and its long name is only selected once
+        full_path = mc.ls(node, long=True)[0]
+        by_mesh.setdefault(full_path, []).extend(node_ranges)
+    return {mesh: ALL_FACES if ALL_FACES in mesh_ranges else merge_ranges(mesh_ranges)
+            for mesh, mesh_ranges in by_mesh.items()}
+
+
+def face_specifiers(ranges_by_mesh):
+    # Compact component strings for cmds.select
+    faces = []
+    for mesh in sorted(ranges_by_mesh):
+        mesh_ranges = ranges_by_mesh[mesh]
+        if mesh_ranges is ALL_FACES:
+            faces.append(mesh + '.f[*]')
+            continue
+        for start, end in mesh_ranges:
+            faces.append(f"{mesh}.f[{start}]" if start == end else f"{mesh}.f[{start}:{end}]")
+    return faces
+
+
+def select_by_material(materials, cmds_module=None):
+    # materials: one material name or a list of them, queried together
+    return face_specifiers(face_ranges_by_material(materials, cmds_module))
+
+
+if __name__ == "__main__":
+    trunk = select_by_material('betula_bark_a_ncl1_2')
+    #leaves = select_by_material(['MaterialFBXASC032FBXASC035266796055'])
+
+    #cmds.select('Brich_01.f[*]')
+    #cmds.select(leaves, deselect=True)
+    #cmds.select(small_branches, deselect=True)
+    cmds.select(trunk)
@@ -0,0 +1,272 @@
+import os
+import sys
+import json
+import time
+import threading
+import multiprocessing
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PROFILE_NAME = 'coco_profile.json'
+
+# Seconds between the RSS samples RssSampler takes during a stage
+RSS_INTERVAL = 0.01
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+class IOCounters:
+    # Per-process totals filled in by the decode/write helpers in maskOps.
+    # Worker processes send theirs back with every task (see maskOps.orderedMap),
+    # prefetch threads (maskOps.prefetchImages) add to them under the lock.
+    # The simplified_* fields count polygons shrunk by maskOps.simplifyContour.
+    FIELDS = ('files', 'read_bytes', 'write_bytes', 'read_seconds', 'decode_seconds', 'task_seconds',
+              'simplified_polygons', 'contour_vertices', 'simplified_vertices', 'simplified_iou')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        for field in self.FIELDS:
+            setattr(self, field, 0)
+
+    def addRead(self, nbytes, read_seconds, decode_seconds):
+        with self.lock:
+            self.files += 1
+            self.read_bytes += nbytes
+            self.read_seconds += read_seconds
+            self.decode_seconds += decode_seconds
+
+    def addWrite(self, nbytes):
+        with self.lock:
+            self.write_bytes += nbytes
+
+    def addSimplified(self, vertices, simplified_vertices, iou):
+        # iou is summed, divide by simplified_polygons for the mean
+        with self.lock:
+            self.simplified_polygons += 1
+            self.contour_vertices += vertices
+            self.simplified_vertices += simplified_vertices
+            self.simplified_iou += iou
+
+    def snapshot(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def merge(self, snapshot):
+        for field in self.FIELDS:
+            setattr(self, field, getattr(self, field) + snapshot[field])
+
+
+COUNTERS = IOCounters()
+
+
+def simplificationStats(counters, before=None):
+    # Polygon simplification totals of a COUNTERS snapshot (minus the snapshot
+    # before), None when nothing was simplified
+    delta = {field: counters[field] - (before[field] if before else 0) for field in IOCounters.FIELDS}
+    polygons = delta['simplified_polygons']
+    if not polygons:
+        return None
+    vertices = delta['contour_vertices']
+    return {
+        "polygons": polygons,
+        "vertices": vertices,
+        "simplified_vertices": delta['simplified_vertices'],
+        "vertex_reduction": 1 - delta['simplified_vertices'] / vertices if vertices else 0.0,
+        "mean_iou": delta['simplified_iou'] / polygons,
+    }
+
+
+def maxRss():
+    # Lifetime peak RSS in bytes of (this process, its largest reaped child), or
+    # (None, None) where unsupported
+    if resource is None:
+        return None, None
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    return own, children
+
+def currentRss(pid='self'):
+    # Resident bytes of a process from /proc, None where there is no /proc (or
+    # the process is gone)
+    try:
+        with open(f'/proc/{pid}/statm', 'rb') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+class RssSampler:
+    # Peak RSS of one stage: ru_maxrss only holds the peak of the whole process
+    # lifetime, so a thread samples /proc during the stage, this process and the
+    # sum of its live worker processes. A stage that sets a new lifetime peak
+    # gets ru_maxrss instead of its samples when that is higher, which also
+    # covers systems without /proc (there, other stages report None).
+    def __init__(self, interval=RSS_INTERVAL):
+        self.interval = interval
+        self.own = None
+        self.children = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_max = maxRss()
+
+    def start(self):
+        if currentRss() is not None:
+            self._sample()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def _sample(self):
+        own = currentRss()
+        if own is not None:
+            self.own = max(self.own or 0, own)
+        children = [currentRss(child.pid) for child in multiprocessing.active_children()]
+        children = [rss for rss in children if rss is not None]
+        if children or self.children is not None:
+            self.children = max(self.children or 0, sum(children))
+
+    def stop(self):
+        # (own, children) peak bytes of the stage, None for what was not measured
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._sample()
+        own, children = self.own, self.children
+        (own_before, children_before), (own_after, children_after) = self._start_max, maxRss()
+        if own_after is not None and own_after > own_before:
+            own = max(own or 0, own_after)
+        # A worker reaped during the stage with the largest peak so far
+        if children_after is not None and children_after > children_before:
+            children = max(children or 0, children_after)
+        return own, children
+
+
+class StageProfiler:
+    # Opt-in per-stage instrumentation: wall time, files/sec, bytes read and
+    # written, time spent reading and decoding images vs. the rest, and the
+    # stage's peak RSS (see RssSampler).
+    # cprofile_path dumps pstats for the whole run (parent process only);
+    # tracemalloc records the biggest allocation sites of every stage.
+    def __init__(self, enabled=False, cprofile_path=None, tracemalloc=False, top_allocations=5):
+        self.enabled = enabled or bool(cprofile_path) or tracemalloc
+        self.cprofile_path = cprofile_path
+        self.tracemalloc = tracemalloc
+        self.top_allocations = top_allocations
+        self.stages = []
+        self._profile = None
+        self._start = None
+
+    def start(self):
+        if not self.enabled:
+            return
+        self._start = time.perf_counter()
+        if self.cprofile_path:
+            import cProfile
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        if self.tracemalloc:
+            import tracemalloc
+            tracemalloc.start()
+
+    def stop(self):
+        if not self.enabled:
+            return
+        if self._profile is not None:
+            self._profile.disable()
+            self._profile.dump_stats(self.cprofile_path)
+            self._profile = None
+        if self.tracemalloc:
+            import tracemalloc
+            tracemalloc.stop()
+
+    @contextmanager
+    def stage(self, name, files=None):
+        # Yields a dict; set stats["files"] inside the block when the count is only known later
+        stats = {"name": name, "files": files}
+        if not self.enabled:
+            yield stats
+            return
+
+        if self.tracemalloc:
+            import tracemalloc
+            tracemalloc.reset_peak()
+            before = tracemalloc.take_snapshot()
+        COUNTERS.reset()
+        rss = RssSampler().start()
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        try:
+            yield stats
+        finally:
+            wall = time.perf_counter() - start
+            counters = COUNTERS.snapshot()
+            # task_seconds covers per-file work summed over worker processes;
+            # stages without a task pool only have their own wall time. With
+            # prefetch threads, reads overlap compute, so compute is a lower bound
+            busy = counters['task_seconds'] or wall
+            files = stats["files"] if stats["files"] is not None else counters['files']
+            own_rss, children_rss = rss.stop()
+            stats.update({
+                "files": files,
+                "wall_seconds": wall,
+                "cpu_seconds": time.process_time() - cpu_start,
+                "files_per_sec": files / wall if files and wall > 0 else None,
+                "read_bytes": counters['read_bytes'],
+                "write_bytes": counters['write_bytes'],
+                "read_seconds": counters['read_seconds'],
+                "decode_seconds": counters['decode_seconds'],
+                "compute_seconds": max(0.0, busy - counters['read_seconds'] - counters['decode_seconds']),
+                "peak_rss_bytes": own_rss,
+                "peak_children_rss_bytes": children_rss,
+            })
+            simplification = simplificationStats(counters)
+            if simplification is not None:
+                stats["simplification"] = simplification
+            if self.tracemalloc:
+                import tracemalloc
+                stats["traced_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+                diff = tracemalloc.take_snapshot().compare_to(before, 'lineno')[:self.top_allocations]
+                stats["top_allocations"] = [
+                    {"where": str(d.traceback), "size_diff_bytes": d.size_diff, "count_diff": d.count_diff}
+                    for d in diff
+                ]
+            self.stages.append(stats)
+
+    def report(self):
+        return {
+            "total_seconds": time.perf_counter() - self._start if self._start is not None else None,
+            "stages": self.stages,
+        }
+
+    def writeReport(self, folder, name=PROFILE_NAME):
+        path = os.path.join(folder, name)
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+        return path
+
+    def summary(self):
+        lines = []
+        for s in self.stages:
+            rate = f"{s['files_per_sec']:.1f} files/s" if s['files_per_sec'] else "-"
+            rss = f", peak RSS {s['peak_rss_bytes'] / 1e6:.0f} MB" if s['peak_rss_bytes'] else ""
+            if s['peak_children_rss_bytes']:
+                rss += f" (+{s['peak_children_rss_bytes'] / 1e6:.0f} MB workers)"
+            lines.append(f"{s['name']}: {s['wall_seconds']:.2f}s, {rate}, "
+                         f"read {s['read_bytes'] / 1e6:.1f} MB ({s['read_seconds']:.2f}s), "
+                         f"decode {s['decode_seconds']:.2f}s, compute {s['compute_seconds']:.2f}s, "
+                         f"written {s['write_bytes'] / 1e6:.1f} MB{rss}")
+        own_rss = max((s['peak_rss_bytes'] or 0 for s in self.stages), default=0)
+        if own_rss:
+            lines.append(f"Peak RSS: {own_rss / 1e6:.0f} MB")
+        return lines
@@ -0,0 +1,102 @@
+import os
+import argparse
+
+# Writes a fake UE export (Images/, Depth/, Masks/, SingleTrees/) that follows
+# the project's filename conventions, for benchmarking without a real render.
+
+FRAME_SUFFIX = '_Forest_Environment_Set_Map_'
+STREE_SUFFIX = 'Single_Tree_tree'
+
+# Masks/ colors (BGR) for the semantic classes of a frame
+GROUND_BGR = (40, 90, 60)
+TRUNK_BGR = (30, 60, 120)
+CANOPY_BGR = (40, 160, 60)
+
+
+def frameKey(frame_id):
+    return f"{frame_id}{FRAME_SUFFIX}"
+
+def singleTreeName(frame_id, tree_id):
+    return f"{frameKey(frame_id)}{STREE_SUFFIX}{tree_id}.png"
+
+def drawTree(rng, size, color):
+    # One tree: a trunk rectangle under an ellipse canopy, both in the tree's own color.
+    # Returns the BGR image and the trunk and canopy masks for Masks/
+    import numpy as np
+    import cv2
+
+    img = np.zeros((size, size, 3), dtype=np.uint8)
+    cx = int(rng.integers(size // 8, size - size // 8))
+    base = int(rng.integers(size // 2, size - 1))
+    height = int(rng.integers(size // 6, size // 2))
+    trunk_w = max(2, int(rng.integers(size // 96, size // 32 + 2)))
+    # Big enough to stay above the 1% tree coverage the filter requires
+    canopy_w = int(rng.integers(size // 10, size // 5))
+    canopy_h = max(size // 12, height // 2)
+    top = max(canopy_h, base - height)
+
+    trunk = np.zeros((size, size), dtype=np.uint8)
+    cv2.rectangle(trunk, (cx - trunk_w // 2, top), (cx + trunk_w // 2, base), 255, -1)
+    canopy = np.zeros((size, size), dtype=np.uint8)
+    cv2.ellipse(canopy, (cx, top), (canopy_w, canopy_h), 0, 0, 360, 255, -1)
+    img[(trunk > 0) | (canopy > 0)] = color
+    return img, trunk > 0, canopy > 0
+
+def generateDataset(out_folder, frames=10, size=768, trees=20, seed=0, invalid_ratio=0.05, unaligned=2, start_id=1):
+    # invalid_ratio: share of SingleTree images that are left black so the coverage filter rejects them
+    # unaligned: extra frames with an image but no depth/single trees, for checkNumberAlignment
+    import numpy as np
+    import cv2
+
+    rng = np.random.default_rng(seed)
+    folders = {name: os.path.join(out_folder, name) for name in ('Images', 'Depth', 'Masks', 'SingleTrees')}
+    for folder in folders.values():
+        os.makedirs(folder, exist_ok=True)
+
+    yy, xx = np.mgrid[0:size, 0:size]
+    for frame_id in range(start_id, start_id + frames):
+        key = frameKey(frame_id)
+        image = rng.integers(0, 256, (size, size, 3), dtype=np.uint8)
+        depth = ((yy + xx + frame_id) % 65536).astype(np.uint16)
+        semantic = np.empty((size, size, 3), dtype=np.uint8)
+        semantic[:] = GROUND_BGR
+
+        for tree_id in range(trees):
+            path = os.path.join(folders['SingleTrees'], singleTreeName(frame_id, tree_id))
+            if rng.random() < invalid_ratio:
+                cv2.imwrite(path, np.zeros((size, size, 3), dtype=np.uint8))
+                continue
+            color = tuple(int(c) for c in rng.integers(32, 256, 3))
+            tree, trunk, canopy = drawTree(rng, size, color)
+            cv2.imwrite(path, tree)
+            semantic[canopy] = CANOPY_BGR
+            semantic[trunk & ~canopy] = TRUNK_BGR
+
+        cv2.imwrite(os.path.join(folders['Images'], key + '.png'), image)
+        cv2.imwrite(os.path.join(folders['Depth'], key + '.png'), depth)
+        cv2.imwrite(os.path.join(folders['Masks'], key + '.png'), semantic)
+
+    for frame_id in range(start_id + frames, start_id + frames + unaligned):
+        image = rng.integers(0, 256, (size, size, 3), dtype=np.uint8)
+        cv2.imwrite(os.path.join(folders['Images'], frameKey(frame_id) + '.png'), image)
+
+    return out_folder
+
+
+def parseArgs():
+    parser = argparse.ArgumentParser(description="Write a synthetic UE segmentation export.")
+    parser.add_argument('path', help="Output segmentation folder")
+    parser.add_argument('--frames', type=int, default=10)
+    parser.add_argument('--size', type=int, default=768, help="Square frame resolution")
+    parser.add_argument('--trees', type=int, default=20, help="SingleTree images per frame")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--invalid-ratio', type=float, default=0.05,
+                        help="Share of SingleTree images the coverage filter should reject")
+    parser.add_argument('--unaligned', type=int, default=2, help="Frames with an image only")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parseArgs()
+    generateDataset(args.path, args.frames, args.size, args.trees, args.seed, args.invalid_ratio, args.unaligned)
+    print(f"Wrote {args.frames} frames to {args.path}")
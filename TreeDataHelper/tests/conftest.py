@@ -0,0 +1,42 @@
+import os
+import sys
+import types
+import importlib
+import pytest
+
+# The tools are flat scripts, imported by module name like they import each other
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def reporter():
+    from benchmark import QuietReporter
+    return QuietReporter()
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    # A small synthetic export: 6 frames of 128 px with 5 SingleTree images each
+    from synthDataset import generateDataset
+    return generateDataset(str(tmp_path / "export"), frames=6, size=128, trees=5, seed=3, invalid_ratio=0.1)
+
+
+@pytest.fixture
+def maya_cmds(monkeypatch):
+    # load(module, cmds) installs cmds as a stub maya.cmds module and reloads
+    # module, so that its own "import maya.cmds" picks the stub up. The modules
+    # are reloaded again without the stub afterwards
+    loaded = []
+
+    def load(module, cmds):
+        maya = types.ModuleType("maya")
+        maya.cmds = cmds
+        monkeypatch.setitem(sys.modules, "maya", maya)
+        monkeypatch.setitem(sys.modules, "maya.cmds", cmds)
+        loaded.append(module)
+        return importlib.reload(module)
+
+    yield load
+    monkeypatch.undo()
+    for module in loaded:
+        importlib.reload(module)
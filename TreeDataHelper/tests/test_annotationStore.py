@@ -0,0 +1,39 @@
+import os
+import json
+from annotationStore import AnnotationStore, AnnotationStoreWriter
+from cocoEngine import PipelineOptions, runPipeline
+
+
+def polygonAnnotation(ann_id, image_id):
+    return {"id": ann_id, "image_id": image_id, "category_id": 0, "bbox": [0, 0, 2, 2],
+            "segmentation": [[0, 0, 2, 0, 2, 2]], "area": 2.0, "iscrowd": 0}
+
+
+def test_annotations_for_unsorted_image_ids(tmp_path):
+    # Stable ids follow the folder listing, so images arrive in any id order
+    image_ids = [5, 3, 6, 4, 1, 2]
+    counts = {5: 2, 3: 0, 6: 3, 4: 1, 1: 2, 2: 1}
+    store_path = str(tmp_path / "coco_store")
+    with AnnotationStoreWriter(store_path, {}, []) as writer:
+        for image_id in image_ids:
+            writer.addImage({"id": image_id, "width": 4, "height": 4, "file_name": f"{image_id}.png"})
+            writer.addAnnotations([polygonAnnotation(image_id << 16 | n, image_id) for n in range(counts[image_id])])
+
+    store = AnnotationStore(store_path)
+    for image_id in image_ids:
+        annotations = store.annotationsForImage(image_id)
+        assert [a["id"] for a in annotations] == [image_id << 16 | n for n in range(counts[image_id])]
+    assert store.annotationsForImage(7) == []
+
+
+def test_store_matches_coco_after_stable_id_run(dataset, reporter):
+    runPipeline(dataset, PipelineOptions(stable_ids=True, output="both"), reporter)
+    with open(os.path.join(dataset, "coco.json")) as f:
+        coco = json.load(f)
+    store = AnnotationStore(os.path.join(dataset, "coco_store"))
+
+    assert coco["images"]
+    for image in coco["images"]:
+        expected = [a for a in coco["annotations"] if a["image_id"] == image["id"]]
+        assert expected
+        assert store.annotationsForImage(image["id"]) == expected
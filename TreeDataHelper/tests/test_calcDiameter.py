@@ -0,0 +1,119 @@
+import csv
+import json
+import pytest
+import calcDiameter
+from calcDiameter import (batch_diameters, clear_diameter_cache, diameters_by_tree_id, tree_id_of,
+                          write_diameters)
+
+
+class FakeCmds:
+    # The part of maya.cmds the diameters use: transforms by long name with
+    # world bounding boxes [xmin, ymin, zmin, xmax, ymax, zmax]
+    def __init__(self, boxes, per_object=False):
+        self.boxes = boxes
+        # Like xform on some Maya versions: one box for a whole list of objects
+        self.per_object = per_object
+        self.xform_calls = 0
+
+    def ls(self, objects, type=None, long=False):
+        assert type == 'transform' and long
+        names = [objects] if isinstance(objects, str) else objects
+        found = []
+        for name in names:
+            suffix = name.lstrip('*')
+            found += [t for t in self.boxes if t.split('|')[-1].endswith(suffix)] if name.startswith('*') \
+                else [t for t in self.boxes if t == name or t.split('|')[-1] == name]
+        return found
+
+    def xform(self, objects, query=False, boundingBox=False, worldSpace=False):
+        assert query and boundingBox and worldSpace
+        self.xform_calls += 1
+        if isinstance(objects, str):
+            return list(self.boxes[objects])
+        if self.per_object and len(objects) > 1:
+            return [min(b[i] for b in map(self.boxes.get, objects)) for i in range(3)] + \
+                   [max(b[i] for b in map(self.boxes.get, objects)) for i in range(3, 6)]
+        return [v for t in objects for v in self.boxes[t]]
+
+
+BOXES = {
+    "|forest|tree12_trunk": [0, 0, 0, 0.4, 5, 0.3],
+    "|forest|tree3_trunk": [1, 0, 1, 1.2, 4, 1.5],
+    "|forest|ns:birch07_v2_trunk": [-1, 0, -1, -0.5, 6, -0.8],
+}
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    clear_diameter_cache()
+    yield
+    clear_diameter_cache()
+
+
+@pytest.mark.parametrize("per_object", [False, True])
+def test_batch_diameters(per_object):
+    cmds = FakeCmds(BOXES, per_object)
+    diameters = batch_diameters('*_trunk', cmds)
+    assert diameters == pytest.approx({
+        "|forest|tree12_trunk": 0.4,
+        "|forest|tree3_trunk": 0.5,
+        "|forest|ns:birch07_v2_trunk": 0.5,
+    })
+    calls = cmds.xform_calls
+    # Cached until clear_diameter_cache()
+    assert batch_diameters('*_trunk', cmds) == diameters
+    assert cmds.xform_calls == calls
+    assert calcDiameter.calculate_cylinder_diameter("|forest|tree12_trunk", cmds) == pytest.approx(0.4)
+
+
+def test_tree_id_of():
+    assert tree_id_of("|forest|tree12_trunk") == 12
+    # The treeN of the short name, without the namespace
+    assert tree_id_of("|forest2|ns1:tree7_v2_trunk") == 7
+    assert tree_id_of("tree3") == 3
+    # Names without exactly one treeN are refused rather than guessed
+    for name in ("|forest|ns:birch07_v2_trunk", "|forest12|trunk", "|forest|tree1_tree2_trunk"):
+        with pytest.raises(ValueError, match="treeN"):
+            tree_id_of(name)
+
+
+def test_explicit_tree_ids():
+    diameters = {"|forest|ns:birch07_v2_trunk": 0.5, "|forest|tree3_trunk": 0.5}
+    with pytest.raises(ValueError):
+        diameters_by_tree_id(diameters)
+    by_id = diameters_by_tree_id(diameters, {"|forest|ns:birch07_v2_trunk": 7, "|forest|tree3_trunk": 3})
+    assert by_id == {7: ("|forest|ns:birch07_v2_trunk", 0.5), 3: ("|forest|tree3_trunk", 0.5)}
+    assert diameters_by_tree_id({"|forest|birch7": 0.5}, lambda t: t[-1]) == {7: ("|forest|birch7", 0.5)}
+
+
+def test_duplicate_tree_ids_are_rejected():
+    with pytest.raises(ValueError, match="Tree id 12"):
+        diameters_by_tree_id({"|a|tree12_trunk": 0.4, "|b|tree12_trunk": 0.3})
+
+
+def test_write_diameters(tmp_path):
+    diameters = batch_diameters('*_trunk', FakeCmds(BOXES))
+    by_id = diameters_by_tree_id(diameters, {"|forest|tree12_trunk": 12, "|forest|tree3_trunk": 3,
+                                             "|forest|ns:birch07_v2_trunk": 7})
+
+    json_path = write_diameters(by_id, str(tmp_path / "diameters.json"))
+    with open(json_path) as f:
+        data = json.load(f)
+    assert list(data) == ["3", "7", "12"]
+    assert data["7"]["object"] == "|forest|ns:birch07_v2_trunk"
+    assert data["12"]["object"] == "|forest|tree12_trunk"
+    assert data["12"]["diameter"] == pytest.approx(0.4)
+
+    csv_path = write_diameters(by_id, str(tmp_path / "diameters.csv"))
+    with open(csv_path, newline='') as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ["tree_id", "object", "diameter"]
+    assert [row[0] for row in rows[1:]] == ["3", "7", "12"]
+    assert rows[3][1] == "|forest|tree12_trunk" and float(rows[3][2]) == pytest.approx(0.4)
+
+
+def test_diameters_default_to_maya_cmds(maya_cmds):
+    cmds = FakeCmds(BOXES)
+    module = maya_cmds(calcDiameter, cmds)
+    assert module.batch_diameters("tree3_trunk") == pytest.approx({"|forest|tree3_trunk": 0.5})
+    assert cmds.xform_calls == 1
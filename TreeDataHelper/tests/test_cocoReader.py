@@ -0,0 +1,93 @@
+import json
+import pytest
+from cocoEngine import PipelineOptions, runPipeline
+from cocoReader import CocoReader
+
+
+def writeCoco(path, coco):
+    with open(path, "w") as f:
+        json.dump(coco, f)
+    return str(path)
+
+
+def image(i, width=64, height=48):
+    return {"id": i, "file_name": f"{i}_Image.png", "width": width, "height": height}
+
+
+def annotation(i, image_id, bbox=(1, 2, 3, 4)):
+    return {"id": i, "image_id": image_id, "category_id": 1, "bbox": list(bbox), "area": 12,
+            "segmentation": [[1, 2, 4, 2, 4, 6]], "iscrowd": 0}
+
+
+def checks(problems):
+    return {p.check: (p.count, p.examples) for p in problems}
+
+
+def compareWithJson(path, window):
+    with open(path) as f:
+        coco = json.load(f)
+    with CocoReader(path, window=window) as reader:
+        assert reader.num_images == len(coco["images"])
+        assert reader.num_annotations == len(coco["annotations"])
+        for entry in coco["images"]:
+            assert reader.image(entry["id"]) == entry
+            expected = [a for a in coco["annotations"] if a["image_id"] == entry["id"]]
+            assert reader.annotationsForImage(entry["id"]) == expected
+        assert reader.image(-5) is None
+        assert reader.annotationsForImage(-5) == []
+        return reader.validate()
+
+
+@pytest.mark.parametrize("segmentation", ["polygon", "rle"])
+@pytest.mark.parametrize("window", [97, 1 << 20])
+def test_pipeline_output_matches_json_load(dataset, reporter, segmentation, window):
+    # A 97 byte window splits objects, strings and RLE counts across slices
+    runPipeline(dataset, PipelineOptions(segmentation=segmentation, stable_ids=True), reporter)
+    assert compareWithJson(f"{dataset}/coco.json", window) == []
+
+
+def test_brackets_and_quotes_inside_strings(tmp_path):
+    images = [dict(image(1), file_name='a]b{"}[\\\\.png'), dict(image(2), file_name='\\"{[')]
+    annotations = [annotation(10, 1), dict(annotation(11, 2), note='}]"\\'), annotation(12, 1)]
+    path = writeCoco(tmp_path / "coco.json", {"info": {"description": "[{"}, "images": images,
+                                               "annotations": annotations, "categories": []})
+    for window in (3, 7, 1 << 20):
+        assert compareWithJson(path, window) == []
+
+
+def test_truncated_file_is_refused(tmp_path):
+    path = writeCoco(tmp_path / "coco.json", {"images": [image(1)], "annotations": [annotation(1, 1)]})
+    with open(path, "r+b") as f:
+        f.truncate(len(f.read()) - 3)
+    with pytest.raises(ValueError, match="Truncated"):
+        CocoReader(path)
+
+
+def test_validate_flags_broken_files(tmp_path):
+    images = [image(1), image(2, width=10, height=10), image(2)]
+    annotations = [
+        annotation(1, 1),
+        annotation(2, 1),
+        annotation(2, 2, bbox=(0, 0, 10, 10)),
+        annotation(3, 7),
+        annotation(4, 2, bbox=(5, 5, 6, 2)),
+        annotation(5, 1, bbox=(-1, 0, 3, 3)),
+        annotation("6", 1),
+        {k: v for k, v in annotation(8, 1).items() if k != "image_id"},
+    ]
+    path = writeCoco(tmp_path / "coco.json", {"images": images, "annotations": annotations})
+    with CocoReader(path, window=11) as reader:
+        found = checks(reader.validate())
+    assert found["duplicate_image_ids"] == (1, [2])
+    assert found["duplicate_annotation_ids"] == (1, [2])
+    assert found["dangling_image_ids"] == (1, [3])
+    assert found["missing_image_id"] == (1, [8])
+    # Image 2 is found by its first entry (10x10): bbox 5+6 > 10
+    assert found["bbox_out_of_bounds"] == (2, [4, 5])
+
+
+def test_string_and_number_ids_differ(tmp_path):
+    path = writeCoco(tmp_path / "coco.json", {"images": [image(1)],
+                                               "annotations": [annotation(6, 1), annotation("6", 1)]})
+    with CocoReader(path) as reader:
+        assert reader.validate() == []
@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+from cocoRle import countsToString, decodeMask, encodeMask, encodeRoi, maskArea, runLengths, stringToCounts
+from maskOps import segmentObjectMask
+
+
+def corners():
+    # Touches all four borders, with runs that wrap from one column into the next
+    mask = np.zeros((4, 6), dtype=np.uint8)
+    mask[0, 0] = 1
+    mask[3, 5] = 1
+    mask[1:3, 2:4] = 1
+    mask[:, 4] = 1
+    return mask
+
+
+def wide():
+    # Runs long enough for several 5-bit groups and for negative deltas
+    mask = np.zeros((200, 3000), dtype=np.uint8)
+    mask[:, 1000:2900] = 1
+    mask[0, 0] = 1
+    return mask
+
+
+def tall():
+    mask = np.zeros((5, 2), dtype=np.uint8)
+    mask[2:, 1] = 1
+    return mask
+
+
+# Strings pycocotools.mask.encode returns for the same masks
+FIXED = [
+    (np.zeros((3, 4), dtype=np.uint8), '<'),
+    (np.ones((3, 4), dtype=np.uint8), '0<'),
+    (corners(), '0181J0O22M'),
+    (tall(), '73'),
+    (wide(), '01oYS6oRc;QW`J'),
+]
+
+
+def masks(seed=5):
+    rng = np.random.default_rng(seed)
+    shapes = [(1, 1), (1, 9), (9, 1), (17, 40), (64, 23)]
+    yield from (mask for mask, _ in FIXED)
+    for h, w in shapes:
+        yield (rng.random((h, w)) < 0.5).astype(np.uint8)
+        blob = np.zeros((h, w), dtype=np.uint8)
+        blob[h // 4:h - h // 4, w // 3:] = 1
+        yield blob
+
+
+@pytest.mark.parametrize("mask,counts", FIXED)
+def test_known_strings(mask, counts):
+    assert encodeMask(mask) == {"size": list(mask.shape), "counts": counts}
+
+
+@pytest.mark.parametrize("mask", list(masks()))
+def test_round_trip(mask):
+    rle = encodeMask(mask)
+    assert stringToCounts(rle["counts"]) == runLengths(mask).tolist()
+    assert countsToString(stringToCounts(rle["counts"])) == rle["counts"]
+    assert np.array_equal(decodeMask(rle), mask)
+    assert maskArea(rle) == np.count_nonzero(mask)
+
+
+@pytest.mark.parametrize("mask", list(masks()))
+def test_matches_pycocotools(mask):
+    coco = pytest.importorskip("pycocotools.mask")
+    rle = encodeMask(mask)
+    expected = coco.encode(np.asfortranarray(mask))
+    assert rle["counts"] == expected["counts"].decode("ascii")
+    assert rle["size"] == list(expected["size"])
+    assert maskArea(rle) == coco.area(expected)
+
+
+@pytest.mark.parametrize("offset", [(0, 0), (1, 2), (3, 0), (0, 7), (3, 7)])
+def test_roi_equals_the_frame_mask(offset):
+    # A 4x6 crop placed anywhere in a 11x9 frame, also flush with its borders
+    frame_size = (11, 9)
+    roi = corners().astype(bool)
+    x0, y0 = offset
+    frame = np.zeros(frame_size, dtype=np.uint8)
+    frame[y0:y0 + 4, x0:x0 + 6] = roi
+    assert encodeRoi(roi, offset, frame_size) == encodeMask(frame)
+
+
+def test_segment_bbox_and_area_agree_with_pycocotools():
+    coco = pytest.importorskip("pycocotools.mask")
+    mask = np.zeros((30, 50), dtype=np.uint8)
+    mask[4:20, 10:49] = 255
+    mask[20:30, 0:12] = 255
+    bbox, rle, area = segmentObjectMask(mask, segmentation='rle')
+    expected = coco.encode(np.asfortranarray((mask > 0).astype(np.uint8)))
+    assert rle["counts"] == expected["counts"].decode("ascii")
+    assert list(bbox) == coco.toBbox(expected).astype(int).tolist()
+    assert area == coco.area(expected)
+    # The same tree cropped out of the frame
+    crop = mask[4:30, 0:49]
+    bbox, rle_roi, area = segmentObjectMask(crop, segmentation='rle', offset=(0, 4), frame_size=mask.shape)
+    assert rle_roi == rle
+    assert list(bbox) == coco.toBbox(expected).astype(int).tolist()
@@ -0,0 +1,28 @@
+import os
+import json
+import pytest
+from cocoEngine import PipelineOptions, runPipeline
+from cocoShards import CATEGORY_ID_BASE, categoryAnnotationId, stableAnnotationId
+from synthDataset import singleTreeName
+
+
+def test_tree_ids_stay_below_the_category_range():
+    assert stableAnnotationId(3, str(CATEGORY_ID_BASE - 1)) < categoryAnnotationId(3, 0)
+    with pytest.raises(ValueError, match="reserved"):
+        stableAnnotationId(3, CATEGORY_ID_BASE)
+    with pytest.raises(ValueError):
+        stableAnnotationId(3, -1)
+
+
+@pytest.mark.parametrize("stable_ids", [False, True])
+def test_category_run_checks_tree_ids_before_writing(dataset, reporter, tmp_path, stable_ids):
+    table = tmp_path / "categories.json"
+    table.write_text(json.dumps({"categories": [{"name": "trunk", "color": [120, 60, 30]}]}))
+    trees = os.path.join(dataset, "SingleTrees")
+    os.rename(os.path.join(trees, singleTreeName(1, 2)), os.path.join(trees, singleTreeName(1, CATEGORY_ID_BASE)))
+    before = sorted(os.listdir(dataset))
+
+    options = PipelineOptions(fused=True, stable_ids=stable_ids, categories=str(table))
+    with pytest.raises(ValueError, match=f"tree id {CATEGORY_ID_BASE}"):
+        runPipeline(dataset, options, reporter)
+    assert sorted(os.listdir(dataset)) == before
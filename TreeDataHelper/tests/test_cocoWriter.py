@@ -0,0 +1,106 @@
+import os
+import json
+import pytest
+import cocoWriter
+from cocoWriter import CocoAppender, CocoLayout, CocoWriter
+
+CATEGORIES = [{"supercategory": "tree", "id": 1, "name": "tree"}]
+
+
+def image(i):
+    return {"id": i, "file_name": f"{i}_Image.png", "width": 64, "height": 48}
+
+
+def annotation(i):
+    return {"id": 100 + i, "image_id": i, "category_id": 1, "bbox": [1, 2, 3, 4], "area": 12}
+
+
+def writeLayout(path, frames, reserve):
+    layout = CocoLayout(reserve=reserve)
+    with CocoWriter(path, {"description": "test"}, CATEGORIES, layout=layout) as writer:
+        for i in frames:
+            writer.addImage(image(i))
+            writer.addAnnotation(annotation(i))
+    return layout
+
+
+def append(path, layout, frames):
+    with CocoAppender(path, layout) as appender:
+        for i in frames:
+            appender.addImage(image(i))
+            appender.addAnnotation(annotation(i))
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def expected(frames):
+    return {"info": {"description": "test"}, "licenses": None, "images": [image(i) for i in frames],
+            "categories": CATEGORIES, "annotations": [annotation(i) for i in frames]}
+
+
+@pytest.mark.parametrize("reserve", [4096, 10])
+def test_appends_equal_a_full_write(tmp_path, reserve):
+    # 10 bytes cannot hold an image, so every append rebuilds the file
+    path = str(tmp_path / "coco.json")
+    layout = writeLayout(path, [1, 2], reserve)
+    append(path, layout, [3])
+    append(path, layout, [])
+    append(path, layout, [4, 5])
+    assert load(path) == expected([1, 2, 3, 4, 5])
+    assert os.listdir(tmp_path) == ["coco.json"]
+    assert layout.matches(path)
+
+
+def test_empty_file_takes_appends(tmp_path):
+    path = str(tmp_path / "coco.json")
+    layout = writeLayout(path, [], 4096)
+    append(path, layout, [1])
+    assert load(path) == expected([1])
+
+
+@pytest.mark.parametrize("reserve", [4096, 10])
+def test_readers_never_see_a_partial_append(tmp_path, monkeypatch, reserve):
+    # fsync runs once the new images and annotations are both written, just
+    # before the rename: coco.json must still be the complete previous file
+    path = str(tmp_path / "coco.json")
+    layout = writeLayout(path, [1, 2], reserve)
+    seen = []
+    fsync = os.fsync
+
+    def reading_fsync(fd):
+        seen.append(load(path))
+        fsync(fd)
+
+    monkeypatch.setattr(cocoWriter.os, "fsync", reading_fsync)
+    append(path, layout, [3])
+    assert seen == [expected([1, 2])]
+    assert load(path) == expected([1, 2, 3])
+
+
+def test_failed_append_leaves_the_file(tmp_path, monkeypatch):
+    path = str(tmp_path / "coco.json")
+    layout = writeLayout(path, [1, 2], 4096)
+
+    def failing_fsync(fd):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(cocoWriter.os, "fsync", failing_fsync)
+    with pytest.raises(OSError):
+        append(path, layout, [3])
+    assert load(path) == expected([1, 2])
+    assert os.listdir(tmp_path) == ["coco.json"]
+    # The layout still describes the file, so the next batch appends as usual
+    monkeypatch.undo()
+    append(path, layout, [4])
+    assert load(path) == expected([1, 2, 4])
+
+
+def test_replaced_file_is_refused(tmp_path):
+    path = str(tmp_path / "coco.json")
+    layout = writeLayout(path, [1], 4096)
+    writeLayout(path, [1, 2], 4096)
+    with pytest.raises(ValueError):
+        CocoAppender(path, layout)
@@ -0,0 +1,52 @@
+import os
+import numpy as np
+import cv2
+import pytest
+from cocoEngine import checkSingleTreeMask
+from datasetCatalog import DatasetCatalog
+from maskOps import blackCoverage, isValidCoverage
+from synthDataset import singleTreeName
+
+SIZE = 256
+
+
+def lineImage(step, offset, width=1, horizontal=False):
+    # Thin structures: lines of width pixels every step pixels, starting at offset
+    img = np.zeros((SIZE, SIZE, 3), dtype=np.uint8)
+    for start in range(offset, SIZE, step):
+        if horizontal:
+            img[start:start + width] = (40, 200, 90)
+        else:
+            img[:, start:start + width] = (40, 200, 90)
+    return img
+
+
+THIN_IMAGES = [lineImage(step, offset, width, horizontal)
+               for step, width in ((128, 1), (64, 1), (96, 1), (5, 4), (4, 3))
+               for offset in range(4)
+               for horizontal in (False, True)]
+
+
+@pytest.fixture
+def thinTrees(tmp_path):
+    folder = tmp_path / "export"
+    os.makedirs(folder / "SingleTrees")
+    paths = []
+    for tree_id, img in enumerate(THIN_IMAGES):
+        path = str(folder / "SingleTrees" / singleTreeName(1, tree_id))
+        cv2.imwrite(path, img)
+        paths.append(path)
+    return str(folder), paths
+
+
+def test_decisions_match_exact_coverage_on_thin_structures(thinTrees, reporter):
+    folder, paths = thinTrees
+    coverages = {path: blackCoverage(img) for path, img in zip(paths, THIN_IMAGES)}
+    # Both outcomes occur, close to both bounds
+    assert {isValidCoverage(c) for c in coverages.values()} == {True, False}
+
+    invalid = checkSingleTreeMask(DatasetCatalog(folder), reporter)
+    for path, coverage in coverages.items():
+        valid = isValidCoverage(coverage)
+        assert os.path.exists(path) == valid
+        assert invalid.get(path) == (None if valid else coverage)
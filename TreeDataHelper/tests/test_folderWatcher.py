@@ -0,0 +1,78 @@
+import os
+import json
+import shutil
+import threading
+import time
+from benchmark import QuietReporter
+from cocoEngine import PipelineOptions, runPipeline
+from folderWatcher import watchDataset
+
+WATCHED = ("Images", "Depth", "SingleTrees")
+
+
+class RecordingReporter(QuietReporter):
+    def __init__(self, cancel):
+        super().__init__(cancel)
+        self.messages = []
+
+    def status(self, message):
+        self.messages.append(message)
+
+    def waitFor(self, text, count, timeout=20):
+        deadline = time.monotonic() + timeout
+        while sum(text in m for m in self.messages) < count:
+            assert time.monotonic() < deadline, self.messages
+            time.sleep(0.05)
+
+
+def loadCoco(folder):
+    with open(os.path.join(folder, "coco.json")) as f:
+        coco = json.load(f)
+    return sorted(coco["images"], key=lambda i: i["id"]), sorted(coco["annotations"], key=lambda a: a["id"])
+
+
+def copyFrames(source, target, keys, trees=None):
+    for folder in WATCHED:
+        for name in sorted(os.listdir(os.path.join(source, folder))):
+            if name.split('_')[0] in keys and (trees is None or folder != "SingleTrees" or trees(name)):
+                shutil.copy(os.path.join(source, folder, name), os.path.join(target, folder, name))
+
+
+def test_new_frames_are_appended(dataset, tmp_path):
+    expected = str(tmp_path / "expected")
+    shutil.copytree(dataset, expected)
+    runPipeline(expected, PipelineOptions(incremental=True, stable_ids=True), QuietReporter())
+
+    watched = str(tmp_path / "watched")
+    for folder in WATCHED + ("Masks",):
+        os.makedirs(os.path.join(watched, folder))
+    # Images/ also holds frames without a depth image, which never become complete
+    frame_ids = sorted({name.split('_')[0] for name in os.listdir(os.path.join(dataset, "Depth"))}, key=int)
+    late_tree = sorted(n for n in os.listdir(os.path.join(dataset, "SingleTrees"))
+                       if n.split('_')[0] == frame_ids[0])[-1]
+    copyFrames(dataset, watched, frame_ids[:2], trees=lambda name: name != late_tree)
+
+    reporter = RecordingReporter(threading.Event())
+    options = PipelineOptions(incremental=True, stable_ids=True)
+    watch = threading.Thread(target=watchDataset, args=(watched, options, reporter),
+                             kwargs=dict(settle=0.2, poll=True, interval=0.05))
+    watch.start()
+    try:
+        reporter.waitFor("frames in coco.json", 1)
+        for i, frame_id in enumerate(frame_ids[2:]):
+            copyFrames(dataset, watched, [frame_id])
+            reporter.waitFor("frames appended", i + 1)
+        # A SingleTree file of a frame already in coco.json makes the next run a full one
+        full_runs = sum("frames in coco.json" in m and "appended" not in m for m in reporter.messages)
+        shutil.copy(os.path.join(dataset, "SingleTrees", late_tree), os.path.join(watched, "SingleTrees", late_tree))
+        deadline = time.monotonic() + 20
+        while sum("frames in coco.json" in m and "appended" not in m for m in reporter.messages) == full_runs:
+            assert time.monotonic() < deadline, reporter.messages
+            time.sleep(0.05)
+    finally:
+        reporter.cancel.set()
+        watch.join()
+
+    assert not any("failed" in m for m in reporter.messages), reporter.messages
+    assert loadCoco(watched) == loadCoco(expected)
+    assert sorted(os.listdir(os.path.join(watched, "NewMasks"))) == sorted(os.listdir(os.path.join(expected, "NewMasks")))
@@ -0,0 +1,43 @@
+import os
+import pytest
+from indexedFile import IndexedFile, atomicWrite
+
+
+def test_compaction_keeps_only_live_spans(tmp_path):
+    store = IndexedFile(str(tmp_path), str(tmp_path / "index.json"), '.data')
+    with open(store.data_path, 'wb') as f:
+        f.write(b"aaaa" + b"dead" * 10 + b"bb" + b"cccccc")
+    spans = [(46, 6), (0, 4), (44, 2)]
+    offsets = store.compactData(spans)
+    assert offsets == [6, 0, 4]
+    with open(store.data_path, 'rb') as f:
+        assert f.read() == b"aaaabbcccccc"
+    # Now every byte is live, so the file stays as it is
+    assert store.compactData([(0, 4), (4, 2), (6, 6)]) is None
+    assert store.spansFit([(6, 6)])
+    assert not store.spansFit([(6, 7)])
+
+
+def test_index_round_trip_and_unreadable_index(tmp_path, reporter):
+    store = IndexedFile(str(tmp_path), str(tmp_path / "index.json"), reporter=reporter)
+    assert store.readIndex("index") is None
+    store.writeIndex({"entries": {store._key(str(tmp_path / "Depth" / "1.png")): 1}})
+    assert store.readIndex("index") == {"entries": {"Depth/1.png": 1}}
+    (tmp_path / "index.json").write_text("{")
+    assert store.readIndex("index") is None
+    assert os.listdir(tmp_path) == ["index.json"]
+
+
+def test_failed_write_keeps_the_old_file(tmp_path):
+    path = str(tmp_path / "index.json")
+    atomicWrite(path, lambda f: f.write("old"))
+
+    def failing(f):
+        f.write("partial")
+        raise OSError("disk full")
+
+    with pytest.raises(OSError):
+        atomicWrite(path, failing)
+    with open(path) as f:
+        assert f.read() == "old"
+    assert os.listdir(tmp_path) == ["index.json"]
@@ -0,0 +1,133 @@
+import os
+import json
+import cv2
+import numpy as np
+import pytest
+from cocoEngine import PipelineOptions, runPipeline
+from cocoRle import decodeMask
+from cocoShards import stableAnnotationId
+from datasetCatalog import DatasetCatalog
+from maskOps import instanceMap, instancePolys
+from synthDataset import frameKey, singleTreeName
+
+SIZE = 64
+FRAME = 1
+
+# (x0, y0, x1, y1) rectangles, inclusive. Later trees are painted over earlier
+# ones; in id order tree 2 hides the middle of tree 1 (which stays one C-shaped
+# part) and all of tree 0, and tree 3 stands alone
+TREES = {0: (30, 25, 37, 32), 1: (5, 10, 34, 50), 2: (20, 20, 44, 40), 3: (50, 5, 60, 60)}
+
+
+def treeImage(rect, color):
+    x0, y0, x1, y1 = rect
+    img = np.zeros((SIZE, SIZE, 3), dtype=np.uint8)
+    img[y0:y1 + 1, x0:x1 + 1] = color
+    return img
+
+
+def expectedMap(order):
+    id_map = np.zeros((SIZE, SIZE), dtype=np.uint16)
+    for tree_id in order:
+        x0, y0, x1, y1 = TREES[tree_id]
+        id_map[y0:y1 + 1, x0:x1 + 1] = tree_id + 1
+    return id_map
+
+
+def onePart(visible):
+    # Whether a tree gets an annotation: it shows in a single 8-connected part
+    return cv2.connectedComponents(visible.astype(np.uint8), connectivity=8)[0] == 2
+
+
+def pixelBox(visible):
+    ys, xs = np.nonzero(visible)
+    return [int(xs.min()), int(ys.min()), int(xs.max() - xs.min() + 1), int(ys.max() - ys.min() + 1)]
+
+
+@pytest.fixture
+def overlapping(tmp_path):
+    # One frame whose trees overlap, in the export layout
+    folder = tmp_path / "export"
+    for name in ("Images", "Depth", "Masks", "SingleTrees"):
+        (folder / name).mkdir(parents=True)
+    key = frameKey(FRAME)
+    cv2.imwrite(str(folder / "Images" / (key + ".png")), np.full((SIZE, SIZE, 3), 90, dtype=np.uint8))
+    cv2.imwrite(str(folder / "Depth" / (key + ".png")), np.ones((SIZE, SIZE), dtype=np.uint16))
+    cv2.imwrite(str(folder / "Masks" / (key + ".png")), np.zeros((SIZE, SIZE, 3), dtype=np.uint8))
+    for tree_id, rect in TREES.items():
+        cv2.imwrite(str(folder / "SingleTrees" / singleTreeName(FRAME, tree_id)),
+                    treeImage(rect, (40 + 50 * tree_id, 200, 100)))
+    return str(folder)
+
+
+def test_map_and_visible_parts():
+    names = [singleTreeName(FRAME, tree_id) for tree_id in sorted(TREES)]
+    imgs = [treeImage(TREES[tree_id], (60, 60, 60)) for tree_id in sorted(TREES)]
+    id_map = instanceMap(names, imgs)
+    assert id_map.dtype == np.uint16
+    assert np.array_equal(id_map, expectedMap(sorted(TREES)))
+
+    polys = instancePolys(id_map, names, segmentation='rle')
+    # Tree 0 is hidden completely
+    assert polys[0] == []
+    for tree_id, poly in zip(sorted(TREES), polys):
+        if tree_id == 0:
+            continue
+        visible = id_map == tree_id + 1
+        bbox, rle, area = poly
+        assert list(bbox) == pixelBox(visible)
+        assert np.array_equal(decodeMask(rle), visible)
+        assert area == np.count_nonzero(visible)
+
+
+def test_duplicate_tree_ids_are_refused():
+    img = treeImage(TREES[1], (60, 60, 60))
+    names = [singleTreeName(FRAME, 1), singleTreeName(FRAME, 1).replace(".png", ".PNG")]
+    with pytest.raises(ValueError, match="Duplicate tree ids"):
+        instanceMap(names, [img, img])
+
+
+def paintOrder(folder):
+    # The pipeline paints a frame's trees in the catalog's (listing) order
+    catalog = DatasetCatalog(folder)
+    return [int(record.tree_id) for record in catalog.singleTreesForFrame(frameKey(FRAME))]
+
+
+def test_pipeline_annotates_visible_pixels(overlapping, reporter):
+    runPipeline(overlapping, PipelineOptions(instance_map=True, segmentation='rle', stable_ids=True), reporter)
+
+    path = os.path.join(overlapping, "InstanceMaps", frameKey(FRAME) + ".png")
+    written = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    assert written.dtype == np.uint16
+    assert np.array_equal(written, expectedMap(paintOrder(overlapping)))
+
+    with open(os.path.join(overlapping, "coco.json")) as f:
+        coco = json.load(f)
+    annotations = {a["id"]: a for a in coco["annotations"]}
+    shown = [tree_id for tree_id in sorted(TREES) if onePart(written == tree_id + 1)]
+    assert sorted(annotations) == [stableAnnotationId(FRAME, tree_id) for tree_id in shown]
+    hidden = 0
+    for tree_id in shown:
+        annotation = annotations[stableAnnotationId(FRAME, tree_id)]
+        visible = written == tree_id + 1
+        assert np.array_equal(decodeMask(annotation["segmentation"]), visible)
+        assert annotation["area"] == np.count_nonzero(visible)
+        assert annotation["bbox"] == pixelBox(visible)
+        x0, y0, x1, y1 = TREES[tree_id]
+        hidden += annotation["area"] < (x1 - x0 + 1) * (y1 - y0 + 1)
+    # Whatever the listing order, some tree is cut to the part others leave visible
+    assert hidden
+
+
+def test_pipeline_polygons_follow_the_visible_part(overlapping, reporter):
+    runPipeline(overlapping, PipelineOptions(instance_map=True, stable_ids=True), reporter)
+    with open(os.path.join(overlapping, "coco.json")) as f:
+        coco = json.load(f)
+    id_map = expectedMap(paintOrder(overlapping))
+    for annotation in coco["annotations"]:
+        tree_id = annotation["id"] - stableAnnotationId(FRAME, 0)
+        visible = id_map == tree_id + 1
+        # Every vertex lies on the tree's own visible pixels, and they span its visible part
+        points = np.array(annotation["segmentation"][0]).reshape(-1, 2)
+        assert all(visible[y, x] for x, y in points)
+        assert annotation["bbox"] == pixelBox(visible)
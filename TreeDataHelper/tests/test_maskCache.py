@@ -0,0 +1,44 @@
+import os
+import numpy as np
+from benchmark import QuietReporter
+from maskCache import MaskCache, CACHE_NAME
+
+
+class RecordingReporter(QuietReporter):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def status(self, message):
+        self.messages.append(message)
+
+
+def test_only_two_color_images_are_cached(tmp_path):
+    folder = str(tmp_path)
+    flat = np.zeros((8, 8, 3), dtype=np.uint8)
+    flat[2:5, 3:6] = (0, 200, 0)
+    shaded = flat.copy()
+    shaded[2, 3] = (0, 120, 0)
+    paths = []
+    for name, img in (("flat.png", flat), ("shaded.png", shaded)):
+        paths.append(os.path.join(folder, name))
+        open(paths[-1], 'wb').close()
+        cache = MaskCache(folder)
+        cache.store(paths[-1], img)
+        cache.save()
+
+    cache = MaskCache(folder)
+    assert cache.lookup(paths[0]) is not None
+    assert cache.lookup(paths[1]) is None
+    assert cache.uncacheable(paths) == 1
+
+
+def test_load_messages_go_to_the_reporter(tmp_path, capsys):
+    folder = str(tmp_path)
+    with open(os.path.join(folder, CACHE_NAME), 'w') as f:
+        f.write("{")
+    reporter = RecordingReporter()
+    MaskCache(folder, reporter=reporter)
+
+    assert len(reporter.messages) == 1 and "unreadable" in reporter.messages[0]
+    assert capsys.readouterr().out == ""
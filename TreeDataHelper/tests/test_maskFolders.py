@@ -0,0 +1,88 @@
+import os
+import pytest
+import cocoEngine
+import maskOps
+from cocoEngine import PipelineOptions, runPipeline
+
+
+class Interrupted(Exception):
+    pass
+
+
+def snapshot(folder):
+    # name -> contents of every file in folder
+    result = {}
+    for name in sorted(os.listdir(folder)):
+        with open(os.path.join(folder, name), 'rb') as f:
+            result[name] = f.read()
+    return result
+
+
+def leftovers(dataset):
+    return [name for name in os.listdir(dataset) if name.endswith(('.tmp', '.old'))]
+
+
+def failAfterFirstFrame(monkeypatch):
+    iterFusedFrames = maskOps.iterFusedFrames
+
+    def failing(*args, **kwargs):
+        frames = iterFusedFrames(*args, **kwargs)
+        yield next(frames)
+        raise Interrupted()
+    monkeypatch.setattr(maskOps, "iterFusedFrames", failing)
+
+    def failingImgList(*args, **kwargs):
+        raise Interrupted()
+    monkeypatch.setattr(cocoEngine, "createImgList", failingImgList)
+
+
+@pytest.mark.parametrize("fused", [False, True])
+def test_failed_rebuild_keeps_previous_masks(dataset, reporter, monkeypatch, fused):
+    runPipeline(dataset, PipelineOptions(fused=fused), reporter)
+    mask_folder = os.path.join(dataset, "NewMasks")
+    before = snapshot(mask_folder)
+    # A mask the rebuild would delete, as a frame that is gone
+    with open(os.path.join(mask_folder, "999_gone_.png"), 'wb') as f:
+        f.write(b"previous")
+    before["999_gone_.png"] = b"previous"
+
+    failAfterFirstFrame(monkeypatch)
+    with pytest.raises(Interrupted):
+        runPipeline(dataset, PipelineOptions(fused=fused), reporter)
+
+    assert snapshot(mask_folder) == before
+    assert leftovers(dataset) == []
+
+
+@pytest.mark.parametrize("fused", [False, True])
+def test_rebuild_replaces_masks(dataset, reporter, fused):
+    runPipeline(dataset, PipelineOptions(fused=fused), reporter)
+    mask_folder = os.path.join(dataset, "NewMasks")
+    before = snapshot(mask_folder)
+    with open(os.path.join(mask_folder, "999_gone_.png"), 'wb') as f:
+        f.write(b"previous")
+
+    runPipeline(dataset, PipelineOptions(fused=fused), reporter)
+
+    assert snapshot(mask_folder) == before
+    assert leftovers(dataset) == []
+    umask = os.umask(0)
+    os.umask(umask)
+    assert os.stat(mask_folder).st_mode & 0o777 == 0o777 & ~umask
+
+
+def test_failed_incremental_run_keeps_stale_masks(dataset, reporter, monkeypatch):
+    options = PipelineOptions(fused=True, incremental=True)
+    runPipeline(dataset, options, reporter)
+    stale = os.path.join(dataset, "NewMasks", "999_gone_.png")
+    with open(stale, 'wb') as f:
+        f.write(b"previous")
+
+    failAfterFirstFrame(monkeypatch)
+    with pytest.raises(Interrupted):
+        runPipeline(dataset, options, reporter)
+    assert os.path.exists(stale)
+
+    monkeypatch.undo()
+    runPipeline(dataset, options, reporter)
+    assert not os.path.exists(stale)
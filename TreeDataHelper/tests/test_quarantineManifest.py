@@ -0,0 +1,53 @@
+import os
+import json
+from benchmark import QuietReporter
+from quarantineManifest import QuarantineManifest, QUARANTINE_NAME
+
+
+class RecordingReporter(QuietReporter):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def status(self, message):
+        self.messages.append(message)
+
+
+def test_load_messages_go_to_the_reporter(tmp_path, capsys):
+    folder = str(tmp_path)
+    QuarantineManifest(folder, {"total_pixels": None}).save()
+
+    reporter = RecordingReporter()
+    QuarantineManifest(folder, {"total_pixels": 100}, reporter=reporter)
+    with open(os.path.join(folder, QUARANTINE_NAME), 'w') as f:
+        f.write("{")
+    QuarantineManifest(folder, reporter=reporter)
+
+    assert len(reporter.messages) == 2
+    assert "settings changed" in reporter.messages[0]
+    assert "unreadable" in reporter.messages[1]
+    assert capsys.readouterr().out == ""
+
+
+def test_limited_run_keeps_other_decisions(tmp_path):
+    folder = str(tmp_path)
+    trees = os.path.join(folder, "SingleTrees")
+    os.makedirs(trees)
+    paths = []
+    for name in ("1_a_b_tree0.png", "2_a_b_tree0.png"):
+        paths.append(os.path.join(trees, name))
+        open(paths[-1], 'wb').close()
+    quarantine = QuarantineManifest(folder, move=True)
+    for path in paths:
+        quarantine.reject(path, "coverage", 0.995)
+    quarantine.apply()
+
+    # Only the second file is handled and passes now: the first stays quarantined
+    quarantine = QuarantineManifest(folder, move=True)
+    quarantine.limitTo([paths[1]])
+    assert quarantine.apply() == (0, 1)
+    assert not os.path.exists(paths[0]) and os.path.exists(paths[1])
+    reloaded = QuarantineManifest(folder, move=True)
+    assert reloaded.movedFiles() == [("SingleTrees", "1_a_b_tree0.png")]
+    with open(os.path.join(folder, QUARANTINE_NAME)) as f:
+        assert list(json.load(f)["rejected"]) == ["SingleTrees/1_a_b_tree0.png"]
@@ -0,0 +1,72 @@
+import os
+import json
+from cocoEngine import PipelineOptions, runPipeline
+from runManifest import RunManifest, MANIFEST_NAME
+
+
+def touch(folder, name, content=b"tree"):
+    path = os.path.join(folder, name)
+    with open(path, 'wb') as f:
+        f.write(content)
+    return path
+
+
+def test_payloads_are_kept_out_of_the_index(tmp_path, reporter):
+    folder = str(tmp_path)
+    a = touch(folder, "a.png")
+    b = touch(folder, "b.png")
+    manifest = RunManifest(folder, {"x": 1}, reporter=reporter)
+    manifest.store(a, {"coverage": 0.5}, [[1, 2, 3]])
+    manifest.store(b, {"coverage": 0.9})
+    assert manifest.readPayload(a) == [[1, 2, 3]]
+    manifest.save()
+
+    with open(os.path.join(folder, MANIFEST_NAME)) as f:
+        assert "[[1, 2, 3]]" not in f.read()
+    reloaded = RunManifest(folder, {"x": 1}, reporter=reporter)
+    assert reloaded.lookup(a) == {"coverage": 0.5}
+    assert reloaded.readPayload(a) == [[1, 2, 3]]
+    assert reloaded.readPayload(b) is None
+
+
+def test_unused_payloads_are_compacted(tmp_path, reporter):
+    folder = str(tmp_path)
+    paths = [touch(folder, f"{i}.png") for i in range(4)]
+    manifest = RunManifest(folder, reporter=reporter)
+    for i, path in enumerate(paths):
+        manifest.store(path, {}, list(range(i * 10)))
+    manifest.save()
+    data_path = manifest.data_path
+    size = os.path.getsize(data_path)
+
+    manifest = RunManifest(folder, reporter=reporter)
+    manifest.prune(paths[1:2])
+    manifest.save()
+    assert os.path.getsize(data_path) < size / 2
+    assert RunManifest(folder, reporter=reporter).readPayload(paths[1]) == list(range(10))
+
+
+def test_index_past_the_data_file_is_dropped(tmp_path, reporter):
+    folder = str(tmp_path)
+    path = touch(folder, "a.png")
+    manifest = RunManifest(folder, reporter=reporter)
+    manifest.store(path, {}, "payload")
+    manifest.save()
+    open(manifest.data_path, 'wb').close()
+    assert RunManifest(folder, reporter=reporter).lookup(path) is None
+
+
+def test_incremental_run_matches_full_run(dataset, reporter):
+    coco_path = os.path.join(dataset, "coco.json")
+    runPipeline(dataset, PipelineOptions(fused=True), reporter)
+    with open(coco_path) as f:
+        expected = json.load(f)
+    expected.pop("info")
+
+    options = PipelineOptions(fused=True, incremental=True)
+    for _ in range(2):
+        runPipeline(dataset, options, reporter)
+        with open(coco_path) as f:
+            coco = json.load(f)
+        coco.pop("info")
+        assert coco == expected
@@ -0,0 +1,80 @@
+import selectFacesByMat
+from selectFacesByMat import ALL_FACES, face_ranges_by_material, merge_ranges, parse_face_member, select_by_material
+
+
+class FakeCmds:
+    # The part of maya.cmds the selection uses, over a fixed scene:
+    # material -> connected nodes, shading group -> members, short -> long names
+    def __init__(self, connections, members, long_names, node_types):
+        self.connections = connections
+        self.members = members
+        self.long_names = long_names
+        self.node_types = node_types
+        self.calls = []
+
+    def listConnections(self, materials):
+        self.calls.append("listConnections")
+        return [node for material in materials for node in self.connections.get(material, [])]
+
+    def ls(self, nodes, type=None, long=False):
+        self.calls.append("ls")
+        nodes = [nodes] if isinstance(nodes, str) else nodes
+        if type is not None:
+            nodes = [node for node in nodes if self.node_types.get(node) == type]
+        if long:
+            nodes = [self.long_names.get(node, node) for node in nodes]
+        return nodes
+
+    def sets(self, shading_group, query=False):
+        assert query
+        self.calls.append("sets")
+        return list(self.members.get(shading_group, []))
+
+
+def scene():
+    return FakeCmds(
+        connections={"bark": ["barkSG", "bark_place2d"], "leaf": ["leafSG"]},
+        members={
+            # The same mesh under its short and long name, with touching and overlapping ranges
+            "barkSG": ["birch.f[10:19]", "|grp|birch.f[20:25]", "birch.f[3]", "birch.f[4:5]", "birch.f[12:14]"],
+            "leafSG": ["|grp|leaves", "birch.f[40]"],
+        },
+        long_names={"birch": "|grp|birch", "leaves": "|grp|leaves"},
+        node_types={"barkSG": "shadingEngine", "leafSG": "shadingEngine", "bark_place2d": "place2dTexture"})
+
+
+def test_parse_face_member():
+    assert parse_face_member("mesh.f[10:2000]") == ("mesh", (10, 2000))
+    assert parse_face_member("|grp|mesh.f[7]") == ("|grp|mesh", (7, 7))
+    assert parse_face_member("mesh.f[*]") == ("mesh", ALL_FACES)
+    assert parse_face_member("mesh") == ("mesh", ALL_FACES)
+
+
+def test_merge_ranges():
+    assert merge_ranges([(10, 19), (3, 3), (20, 25), (4, 5), (12, 14)]) == [(3, 5), (10, 25)]
+    assert merge_ranges([(0, 100), (5, 6), (102, 102)]) == [(0, 100), (102, 102)]
+    assert merge_ranges([]) == []
+
+
+def test_ranges_are_merged_per_long_mesh_name():
+    cmds = scene()
+    assert face_ranges_by_material("bark", cmds) == {"|grp|birch": [(3, 5), (10, 25)]}
+    # Two materials are queried together; a bare mesh member means every face
+    assert face_ranges_by_material(["bark", "leaf"], cmds) == {
+        "|grp|birch": [(3, 5), (10, 25), (40, 40)],
+        "|grp|leaves": ALL_FACES,
+    }
+
+
+def test_select_by_material_returns_compact_specifiers():
+    cmds = scene()
+    assert select_by_material(["bark", "leaf"], cmds) == [
+        "|grp|birch.f[3:5]", "|grp|birch.f[10:25]", "|grp|birch.f[40]", "|grp|leaves.f[*]"]
+    assert select_by_material("unused", cmds) == []
+
+
+def test_selection_defaults_to_maya_cmds(maya_cmds):
+    cmds = scene()
+    module = maya_cmds(selectFacesByMat, cmds)
+    assert module.select_by_material("bark") == ["|grp|birch.f[3:5]", "|grp|birch.f[10:25]"]
+    assert "sets" in cmds.calls
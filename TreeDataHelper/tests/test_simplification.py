@@ -0,0 +1,72 @@
+import cv2
+import numpy as np
+import pytest
+import maskOps
+from maskOps import Simplification, maskIou, segmentObjectMask, simplifyContour
+
+
+def diskMask(size=64, center=(30, 34), radius=20):
+    mask = np.zeros((size, size), dtype=np.uint8)
+    cv2.circle(mask, center, radius, 255, -1)
+    return mask
+
+
+def traced(mask, offset=(0, 0)):
+    contours = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_TC89_KCOS, offset=offset)
+    return (contours[0] if len(contours) == 2 else contours[1])[0]
+
+
+def test_zero_tolerance_under_cap_is_not_simplified(monkeypatch):
+    contour = traced(diskMask())
+
+    def approxPolyDP(*args):
+        raise AssertionError("approxPolyDP ran without anything to simplify")
+    monkeypatch.setattr(maskOps.cv2, "approxPolyDP", approxPolyDP)
+
+    assert simplifyContour(contour, Simplification(0.0, len(contour))) is contour
+    assert simplifyContour(contour, Simplification(0.0, None)) is contour
+
+
+def test_zero_tolerance_over_cap_is_capped():
+    contour = traced(diskMask())
+    capped = simplifyContour(contour, Simplification(0.0, 8))
+    assert 3 <= len(capped) <= 8
+
+
+@pytest.mark.parametrize("offset", [(0, 0), (100, 40)])
+def test_iou_is_measured_against_the_mask(offset):
+    mask = diskMask()
+    contour = traced(mask, offset)
+    bbox = cv2.boundingRect(contour)
+    # The traced contour covers the disk almost exactly, a triangle of it does not
+    assert maskIou(mask, contour, bbox, offset) > 0.95
+    triangle = np.ascontiguousarray(contour[::len(contour) // 3][:3])
+    assert maskIou(mask, triangle, bbox, offset) < 0.6
+
+    # A ring: the traced outer contour fills the hole the mask does not have
+    ring = mask.copy()
+    cv2.circle(ring, (30, 34), 12, 0, -1)
+    assert maskIou(ring, contour, bbox, offset) < 0.75
+
+
+def test_segmentation_records_mask_iou():
+    mask = diskMask()
+    before = maskOps.COUNTERS.snapshot()
+    bbox, polygon, _ = segmentObjectMask(mask, simplify=Simplification(1.5, None))
+    after = maskOps.COUNTERS.snapshot()
+    assert after['simplified_polygons'] - before['simplified_polygons'] == 1
+    points = np.array(polygon[0], dtype=np.int32).reshape(-1, 1, 2)
+    assert after['simplified_iou'] - before['simplified_iou'] == pytest.approx(maskIou(mask, points, bbox))
+
+
+@pytest.mark.parametrize("text", ["-1", "-0.5", "nan", "inf"])
+def test_invalid_tolerances_are_rejected(text):
+    import argparse
+    from cocoEngine import PipelineOptions
+    from cocoGeneratorV2 import toleranceArg
+
+    with pytest.raises(argparse.ArgumentTypeError):
+        toleranceArg(text)
+    with pytest.raises(ValueError):
+        PipelineOptions(simplify_tolerance=float(text))
+    assert toleranceArg("0") == 0.0
@@ -0,0 +1,32 @@
+import time
+import numpy as np
+import pytest
+from stageProfiler import StageProfiler, currentRss
+
+MB = 1 << 20
+
+
+@pytest.mark.skipif(currentRss() is None, reason="per-stage RSS is sampled from /proc")
+def test_stages_report_their_own_peak():
+    profiler = StageProfiler(enabled=True)
+    profiler.start()
+    with profiler.stage("heavy"):
+        block = np.ones(200 * MB, dtype=np.uint8)
+        # Long enough for several samples, also when an earlier test set a higher lifetime peak
+        time.sleep(0.05)
+        del block
+    with profiler.stage("light"):
+        pass
+    profiler.stop()
+    heavy, light = profiler.stages
+    assert heavy["peak_rss_bytes"] - light["peak_rss_bytes"] > 150 * MB
+    assert light["peak_children_rss_bytes"] is None
+    assert any("heavy" in line and "peak RSS" in line for line in profiler.summary())
+
+
+def test_disabled_profiler_records_nothing():
+    profiler = StageProfiler()
+    with profiler.stage("stage") as stats:
+        pass
+    assert stats == {"name": "stage", "files": None}
+    assert profiler.stages == []
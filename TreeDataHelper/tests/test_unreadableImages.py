@@ -0,0 +1,49 @@
+import os
+import json
+import pytest
+from cocoEngine import PipelineOptions, runPipeline
+from quarantineManifest import QUARANTINE_NAME
+from synthDataset import singleTreeName
+
+# A tree of frame 1 the synthetic dataset (seed 3) draws, i.e. one that passes the coverage filter
+TREE_ID = 2
+
+
+def truncate(dataset):
+    path = os.path.join(dataset, "SingleTrees", singleTreeName(1, TREE_ID))
+    size = os.path.getsize(path)
+    with open(path, 'r+b') as f:
+        f.truncate(size // 2)
+    return path
+
+
+def annotatedTrees(dataset):
+    with open(os.path.join(dataset, "coco.json")) as f:
+        coco = json.load(f)
+    # Stable annotation ids are frame id << 16 | tree id
+    return {(a["id"] >> 16, a["id"] & 0xFFFF) for a in coco["annotations"]}
+
+
+@pytest.mark.parametrize("fused", [False, True])
+def test_truncated_singletree_is_removed(dataset, reporter, fused):
+    path = truncate(dataset)
+    runPipeline(dataset, PipelineOptions(fused=fused, stable_ids=True), reporter)
+
+    assert not os.path.exists(path)
+    trees = annotatedTrees(dataset)
+    assert (1, TREE_ID) not in trees
+    assert any(frame == 1 for frame, _ in trees)
+
+
+@pytest.mark.parametrize("fused", [False, True])
+def test_truncated_singletree_is_quarantined(dataset, reporter, fused):
+    path = truncate(dataset)
+    runPipeline(dataset, PipelineOptions(fused=fused, stable_ids=True, quarantine="record"), reporter)
+
+    assert os.path.exists(path)
+    assert (1, TREE_ID) not in annotatedTrees(dataset)
+    with open(os.path.join(dataset, QUARANTINE_NAME)) as f:
+        quarantine = json.load(f)
+    key = "SingleTrees/" + os.path.basename(path)
+    assert quarantine["rejected"][key] == {"reason": "unreadable", "coverage": None}
+    assert key not in quarantine["coverage"]